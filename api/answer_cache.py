@@ -0,0 +1,132 @@
+"""
+Two-tier cache of LLM answers: exact prompt matches and semantically similar questions.
+"""
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from core.models import Chunk, EmbeddingModel, GenerationModel
+from .utils import PDFProcessor
+from .vector_index import VectorIndexStore
+
+STAT_NAMES = ['exact_hits', 'semantic_hits', 'misses', 'saved_tokens']
+
+
+class AnswerCacheScope:
+    """
+    Cache lookups for one request, bound to a workspace's index version.
+
+    The exact tier keys on a hash of the built prompt and the GenerationModel id.
+    The semantic tier is used only when a query embedding is given. It keeps the
+    query embeddings answered for one retrieved chunk set and reuses an answer
+    when the new query's cosine similarity reaches
+    ``ANSWER_CACHE_SEMANTIC_THRESHOLD``. Every key includes the index version,
+    so any write to the workspace's index makes its cached answers unreachable.
+    They then expire after ``ANSWER_CACHE_TTL_SECONDS``.
+    """
+
+    def __init__(self, workspace_id: int, version: str, query_embedding: Optional[np.ndarray] = None):
+        self.workspace_id = workspace_id
+        self.version = version
+        self.query_embedding = query_embedding
+        self.hit: Optional[str] = None  # 'exact' or 'semantic' once get() found an answer
+
+    def get(self, generation_model: GenerationModel, prompt: str,
+            chunks: List[Chunk]) -> Optional[Tuple[str, List[Dict]]]:
+        """Return a cached (answer, citations) for this prompt or a similar question, if any."""
+        entry = cache.get(self._exact_key(generation_model, prompt))
+        if entry is not None:
+            self.hit = 'exact'
+        elif self.query_embedding is not None and settings.ANSWER_CACHE_SEMANTIC_THRESHOLD > 0:
+            entry = self._semantic_match(generation_model, chunks)
+            if entry is not None:
+                self.hit = 'semantic'
+
+        if entry is None:
+            AnswerCache.record('misses')
+            return None
+        AnswerCache.record(f'{self.hit}_hits')
+        AnswerCache.record('saved_tokens', entry['tokens'])
+        return entry['answer'], entry['citations']
+
+    def put(self, generation_model: GenerationModel, prompt: str, chunks: List[Chunk],
+            answer: str, citations: List[Dict]):
+        """Store a freshly generated answer in both tiers."""
+        exact_key = self._exact_key(generation_model, prompt)
+        tokens = PDFProcessor.estimate_token_count(prompt) + PDFProcessor.estimate_token_count(answer)
+        cache.set(exact_key, {'answer': answer, 'citations': citations, 'tokens': tokens},
+                  settings.ANSWER_CACHE_TTL_SECONDS)
+
+        if self.query_embedding is None or settings.ANSWER_CACHE_SEMANTIC_THRESHOLD <= 0:
+            return
+        # Read-modify-write: a concurrent put may drop an entry, which only costs a future hit
+        semantic_key = self._semantic_key(generation_model, chunks)
+        entries = cache.get(semantic_key) or []
+        entries.append({'embedding': np.asarray(self.query_embedding, dtype='float32').tolist(), 'key': exact_key})
+        cache.set(semantic_key, entries[-settings.ANSWER_CACHE_SEMANTIC_ENTRIES:], settings.ANSWER_CACHE_TTL_SECONDS)
+
+    def _semantic_match(self, generation_model: GenerationModel, chunks: List[Chunk]) -> Optional[Dict]:
+        entries = cache.get(self._semantic_key(generation_model, chunks))
+        if not entries:
+            return None
+        # Embeddings are normalized, so one matrix-vector product gives every cosine similarity
+        similarities = np.array([entry['embedding'] for entry in entries], dtype='float32') @ np.asarray(
+            self.query_embedding, dtype='float32'
+        )
+        best = int(np.argmax(similarities))
+        if similarities[best] < settings.ANSWER_CACHE_SEMANTIC_THRESHOLD:
+            return None
+        return cache.get(entries[best]['key'])
+
+    def _exact_key(self, generation_model: GenerationModel, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        return f'answer_cache:exact:{self.workspace_id}:{self.version}:{generation_model.id}:{digest}'
+
+    def _semantic_key(self, generation_model: GenerationModel, chunks: List[Chunk]) -> str:
+        chunk_set = hashlib.sha256(','.join(str(chunk_id) for chunk_id in sorted(c.id for c in chunks)).encode())
+        return f'answer_cache:semantic:{self.workspace_id}:{self.version}:{generation_model.id}:{chunk_set.hexdigest()}'
+
+
+class AnswerCache:
+    """Entry point for the answer cache and its hit-rate statistics."""
+
+    @staticmethod
+    def scope(workspace_id: int, embedding_model: EmbeddingModel,
+              query_embedding: Optional[np.ndarray] = None) -> Optional[AnswerCacheScope]:
+        """
+        Cache scope for a question over a workspace, or None when caching is off
+        (or the workspace has no embedding model to version its index by).
+
+        Pass ``query_embedding`` to enable the semantic tier. Leave it out when
+        the prompt depends on more than the question, such as chat history.
+        """
+        if not settings.ANSWER_CACHE_ENABLED or embedding_model is None:
+            return None
+        version = f'{embedding_model.id}.{VectorIndexStore.version(embedding_model, workspace_id)}'
+        return AnswerCacheScope(workspace_id, version, query_embedding)
+
+    @staticmethod
+    def record(name: str, amount: int = 1):
+        key = f'answer_cache:stats:{name}'
+        # add() is a no-op if the counter exists; incr() is atomic on shared backends
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, None)
+
+    @staticmethod
+    def stats() -> Dict:
+        """Hits per tier, misses, hit rate and the estimated prompt+completion tokens saved."""
+        values = cache.get_many([f'answer_cache:stats:{name}' for name in STAT_NAMES])
+        stats = {name: values.get(f'answer_cache:stats:{name}', 0) for name in STAT_NAMES}
+        lookups = stats['exact_hits'] + stats['semantic_hits'] + stats['misses']
+        stats['lookups'] = lookups
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['semantic_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    @staticmethod
+    def reset_stats():
+        cache.delete_many([f'answer_cache:stats:{name}' for name in STAT_NAMES])
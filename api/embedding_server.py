@@ -0,0 +1,272 @@
+"""
+Shared embedding inference server with dynamic micro-batching, and its client.
+"""
+import os
+import json
+import queue
+import socket
+import struct
+import threading
+import socketserver
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+# Messages are a 4-byte big-endian header length, a JSON header and an optional binary payload
+_LENGTH = struct.Struct('!I')
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b''):
+    data = json.dumps(header).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(min(size - len(buffer), 1 << 20))
+        if not data:
+            raise ConnectionError('Embedding server connection closed')
+        buffer.extend(data)
+    return bytes(buffer)
+
+
+def _recv(sock: socket.socket) -> dict:
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, length))
+
+
+class EmbeddingServerError(Exception):
+    """Encoding failed on the server; ``error_type`` names the server-side exception class."""
+
+    def __init__(self, message: str, error_type: Optional[str] = None):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class _Request:
+    """One client call waiting for its slice of a micro-batch."""
+
+    __slots__ = ('texts', 'model_id', 'done', 'vectors', 'error', 'error_type')
+
+    def __init__(self, texts: List[str], model_id: Optional[int]):
+        self.texts = texts
+        self.model_id = model_id
+        self.done = threading.Event()
+        self.vectors = None
+        self.error = None
+        self.error_type = None
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serve encode requests on one persistent client connection."""
+
+    def handle(self):
+        while True:
+            try:
+                header = _recv(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            try:
+                vectors = self.server.embedding_server.submit(header['texts'], header.get('model_id'))
+                response = ({'shape': list(vectors.shape)}, vectors.tobytes())
+            except Exception as e:
+                # The type lets clients tell "no embedding backend" apart from other failures
+                response = ({'error': str(e), 'error_type': getattr(e, 'error_type', type(e).__name__)}, b'')
+            try:
+                _send(self.request, *response)
+            except OSError:
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class EmbeddingServer:
+    """
+    Own the embedding models for every web and worker process on a host.
+
+    Clients connect over a Unix socket. One connection thread per client
+    queues that client's texts. A single batching thread merges whatever
+    arrives within ``max_wait_ms`` of the first request, up to
+    ``max_batch_size`` texts, into one ``encode`` call per embedding model.
+    It then hands each caller its own rows. Models come from
+    EmbeddingService's pool, so each one is loaded once per host rather
+    than once per process.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, max_batch_size: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None):
+        self.socket_path = socket_path or settings.EMBEDDING_SERVER_SOCKET
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_SERVER_MAX_BATCH
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.EMBEDDING_SERVER_MAX_WAIT_MS) / 1000
+        self.batches = 0
+        self.texts = 0
+        self._requests = queue.Queue()
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def start(self):
+        """Bind the socket and start serving in background threads."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _UnixServer(self.socket_path, _Handler)
+        self._server.embedding_server = self
+        os.chmod(self.socket_path, 0o660)
+        self._threads = [
+            threading.Thread(target=self._batch_loop, name='embedding-batcher', daemon=True),
+            threading.Thread(target=self._server.serve_forever, name='embedding-server', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def serve_forever(self):
+        """Start and block until interrupted."""
+        self.start()
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(1)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def submit(self, texts: List[str], model_id: Optional[int] = None) -> np.ndarray:
+        """Queue texts for the next micro-batch and wait for their vectors."""
+        request = _Request(texts, model_id)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise EmbeddingServerError(request.error, request.error_type)
+        return request.vectors
+
+    def _batch_loop(self):
+        while not self._stop.is_set():
+            try:
+                first = self._requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch = [first]
+            size = len(first.texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._run(batch)
+
+    def _run(self, batch: List[_Request]):
+        by_model = defaultdict(list)
+        for request in batch:
+            by_model[request.model_id].append(request)
+
+        for model_id, requests in by_model.items():
+            try:
+                texts = [text for request in requests for text in request.texts]
+                vectors = np.asarray(
+                    self._get_model(model_id).encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True),
+                    dtype='float32'
+                )
+                offset = 0
+                for request in requests:
+                    request.vectors = vectors[offset:offset + len(request.texts)]
+                    offset += len(request.texts)
+                self.batches += 1
+                self.texts += len(texts)
+            except Exception as e:
+                for request in requests:
+                    request.error = str(e)
+                    request.error_type = type(e).__name__
+            finally:
+                for request in requests:
+                    request.done.set()
+
+    @staticmethod
+    def _get_model(model_id: Optional[int]):
+        from core.models import EmbeddingModel
+        from .utils import EmbeddingService
+
+        close_old_connections()
+        embedding_model = EmbeddingModel.objects.get(id=model_id) if model_id else None
+        return EmbeddingService.get_model(embedding_model)
+
+
+class EmbeddingClient:
+    """Thin client for the embedding server, with one persistent connection per thread."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.timeout = timeout or settings.EMBEDDING_SERVER_TIMEOUT
+        self._local = threading.local()
+
+    def encode(self, texts: List[str], model_id: Optional[int] = None) -> np.ndarray:
+        """
+        Embed texts on the server; returns a (len(texts), dimension) float32 array.
+
+        Raises EmbeddingBackendUnavailable when the server has no embedding
+        backend, and EmbeddingServerError for any other server-side failure.
+        """
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                _send(sock, {'texts': list(texts), 'model_id': model_id})
+                header = _recv(sock)
+                if 'error' in header:
+                    self._raise_error(header)
+                shape = header['shape']
+                data = _recv_exact(sock, int(np.prod(shape)) * 4)
+                return np.frombuffer(data, dtype='float32').reshape(shape)
+            except (OSError, ConnectionError):
+                # Stale connection (server restarted, or a timeout left it mid-message): reconnect once
+                self._close()
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _raise_error(header: dict):
+        from .utils import EmbeddingBackendUnavailable
+
+        message = f"Embedding server error: {header['error']}"
+        if header.get('error_type') == EmbeddingBackendUnavailable.__name__:
+            raise EmbeddingBackendUnavailable(message)
+        raise EmbeddingServerError(message, header.get('error_type'))
+
+    def _connection(self) -> socket.socket:
+        # Connections are not shared across forks (gunicorn/Celery prefork)
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.sock = None
+            self._local.pid = os.getpid()
+        if self._local.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return self._local.sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
@@ -0,0 +1,48 @@
+"""
+Deferred imports for heavy optional dependencies.
+"""
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    torch (via sentence-transformers), faiss and the LLM SDKs take seconds
+    and hundreds of MB to import. Most processes that import ``api.utils``
+    never use them: ``manage.py`` commands, Celery beat, and web workers that
+    only serve CRUD. ``available`` checks whether the package is installed
+    without importing it, so the ``*_AVAILABLE`` flags stay cheap.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    @property
+    def available(self) -> bool:
+        try:
+            return importlib.util.find_spec(self._name) is not None
+        except (ImportError, ValueError):
+            return False
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        """Import the module now (if not already) and return it."""
+        if self._module is None:
+            # The import system serialises concurrent first imports itself
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            # Keep introspection (copy, pickle, mock, asyncio) from triggering the import
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
@@ -0,0 +1,61 @@
+"""
+Management command to compare the torch and ONNX embedding backends.
+"""
+import time
+import resource
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Chunk, EmbeddingModel
+from api.utils import EmbeddingService
+
+
+class Command(BaseCommand):
+    help = 'Benchmark throughput, memory and output parity of the torch and ONNX embedding backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('embedding_model_id', type=int)
+        parser.add_argument('--texts', type=int, default=512, help='Number of texts to embed')
+        parser.add_argument('--batch-size', type=int, default=32)
+
+    def handle(self, *args, **options):
+        try:
+            embedding_model = EmbeddingModel.objects.get(id=options['embedding_model_id'])
+        except EmbeddingModel.DoesNotExist:
+            raise CommandError(f"Embedding model {options['embedding_model_id']} not found")
+        if not embedding_model.onnx_path:
+            raise CommandError('Model has no ONNX export; run export_onnx_model first')
+
+        texts = list(Chunk.objects.order_by('id').values_list('text', flat=True)[:options['texts']])
+        if len(texts) < options['texts']:
+            texts += [
+                f'Sample sentence {i} about retrieval-augmented generation over research papers.'
+                for i in range(options['texts'] - len(texts))
+            ]
+
+        # ONNX first: its footprint is measured before torch is pulled in
+        results = {}
+        for backend in ('onnx', 'torch'):
+            rss_before = self._max_rss_mb()
+            load_started = time.perf_counter()
+            model = EmbeddingService._load_model(embedding_model.model_path, backend, embedding_model.onnx_path)
+            load_seconds = time.perf_counter() - load_started
+            model.encode(texts[:options['batch_size']], batch_size=options['batch_size'])  # Warm up
+
+            started = time.perf_counter()
+            vectors = np.asarray(model.encode(texts, batch_size=options['batch_size']), dtype='float32')
+            seconds = time.perf_counter() - started
+            results[backend] = vectors
+            self.stdout.write(
+                f'{backend:>5}: {len(texts) / seconds:8.1f} texts/s, load {load_seconds:.1f}s, '
+                f'peak RSS +{self._max_rss_mb() - rss_before:.0f} MB'
+            )
+            del model
+
+        a, b = results['onnx'], results['torch']
+        cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        self.stdout.write(f'parity: mean cosine {cosine.mean():.4f}, min cosine {cosine.min():.4f}')
+
+    @staticmethod
+    def _max_rss_mb() -> float:
+        """Peak resident set size of this process in MB (Linux reports KB)."""
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
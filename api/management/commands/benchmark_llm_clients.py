@@ -0,0 +1,109 @@
+"""
+Management command to benchmark LLM client connection reuse against a mock provider.
+"""
+import time
+import asyncio
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from api.mock_llm_server import MockLLMServer
+from api.utils import LLMService, LLMClientRegistry, OPENAI_AVAILABLE, ANTHROPIC_AVAILABLE
+
+PROMPT = 'Summarize the retrieved context in one sentence.'
+
+
+class Command(BaseCommand):
+    help = 'Compare a fresh client per call with the pooled sync and async clients, offline against a mock provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', choices=['openai', 'anthropic'], default='openai')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--latency-ms', type=float, default=20, help='Mock provider latency per call')
+        parser.add_argument('--serve', action='store_true', help='Only run the mock provider (see --port)')
+        parser.add_argument('--port', type=int, default=8089)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            server = MockLLMServer(host='127.0.0.1', port=options['port'], latency_ms=options['latency_ms'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Mock LLM provider on {server.base_url} "
+                f"(OPENAI_BASE_URL={server.base_url}/v1, ANTHROPIC_BASE_URL={server.base_url})"
+            ))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.shutdown()
+            return
+
+        provider = options['provider']
+        if not {'openai': OPENAI_AVAILABLE, 'anthropic': ANTHROPIC_AVAILABLE}[provider]:
+            raise CommandError(f'{provider} SDK not installed')
+
+        server = MockLLMServer(latency_ms=options['latency_ms']).start()
+        try:
+            with override_settings(
+                OPENAI_API_KEY='mock', ANTHROPIC_API_KEY='mock',
+                OPENAI_BASE_URL=f'{server.base_url}/v1', ANTHROPIC_BASE_URL=server.base_url,
+                LLM_MAX_CONCURRENCY=options['concurrency']
+            ):
+                for mode in ('fresh', 'pooled', 'async'):
+                    LLMService.clients.clear()
+                    server.reset_stats()
+                    started = time.perf_counter()
+                    latencies = getattr(self, f'_run_{mode}')(provider, options['requests'], options['concurrency'])
+                    elapsed = time.perf_counter() - started
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{mode:7} {len(latencies) / elapsed:8.1f} req/s  "
+                        f"p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+                        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  "
+                        f"connections {server.connections}"
+                    )
+        finally:
+            LLMService.clients.clear()
+            server.shutdown()
+
+    @staticmethod
+    def _call(provider: str):
+        return LLMService._call_openai('mock', PROMPT) if provider == 'openai' else LLMService._call_anthropic('mock', PROMPT)
+
+    def _run_fresh(self, provider: str, requests: int, concurrency: int):
+        """The old behaviour: a new client (and connection pool) for every call."""
+        def call():
+            started = time.perf_counter()
+            registry = LLMClientRegistry()
+            client = registry.get(provider)
+            if provider == 'openai':
+                client.chat.completions.create(**LLMService._openai_request('mock', PROMPT))
+            else:
+                client.messages.create(**LLMService._anthropic_request('mock', PROMPT))
+            registry.clear()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(lambda _: call(), range(requests)))
+
+    def _run_pooled(self, provider: str, requests: int, concurrency: int):
+        def call():
+            started = time.perf_counter()
+            self._call(provider)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(lambda _: call(), range(requests)))
+
+    def _run_async(self, provider: str, requests: int, concurrency: int):
+        acall = LLMService._acall_openai if provider == 'openai' else LLMService._acall_anthropic
+
+        async def call():
+            started = time.perf_counter()
+            await acall('mock', PROMPT)
+            return time.perf_counter() - started
+
+        async def run():
+            # aslot bounds these to LLM_MAX_CONCURRENCY in flight
+            return await asyncio.gather(*(call() for _ in range(requests)))
+
+        return list(asyncio.run(run()))
@@ -0,0 +1,85 @@
+"""
+Management command to measure process startup cost.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'transformers', 'faiss', 'onnxruntime', 'openai', 'anthropic']
+
+# Each scenario runs in a fresh interpreter, the way that process type boots
+SCENARIOS = {
+    'check': (
+        "import django; django.setup()\n"
+        "from django.core.management import call_command; call_command('check', verbosity=0)"
+    ),
+    'web': "import paperbot.wsgi",
+    'worker': (
+        "import django; django.setup()\n"
+        "from paperbot.celery import app; app.loader.import_default_modules()"
+    ),
+}
+
+PROBE = """
+import sys, time, json, resource
+started = time.perf_counter()
+exec({code!r})
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure import time, memory and heavy modules loaded by manage.py check, gunicorn boot and worker boot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=list(SCENARIOS), action='append',
+                            help='Scenario to run (repeatable; default: all)')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario; the median is reported')
+        parser.add_argument('--top', type=int, default=0,
+                            help='Also list the N slowest imports (python -X importtime) per scenario')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'paperbot.settings'))
+
+        for name in options['scenario'] or list(SCENARIOS):
+            runs = [self._run(SCENARIOS[name], env) for _ in range(options['repeat'])]
+            self.stdout.write(self.style.SUCCESS(
+                f"{name:8} {statistics.median(run['seconds'] for run in runs):7.2f}s "
+                f"{statistics.median(run['rss_mb'] for run in runs):8.1f} MB max RSS  "
+                f"heavy imports: {', '.join(runs[0]['heavy']) or 'none'}"
+            ))
+            if options['top']:
+                for seconds, module in self._slowest_imports(SCENARIOS[name], env, options['top']):
+                    self.stdout.write(f"    {seconds:7.3f}s  {module}")
+
+    def _run(self, code: str, env: dict) -> dict:
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE.format(code=code, heavy=HEAVY_MODULES)],
+            env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'Scenario failed')
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    @staticmethod
+    def _slowest_imports(code: str, env: dict, top: int):
+        """Top-level packages by cumulative import time, from ``-X importtime``."""
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True)
+        packages = {}
+        for line in result.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line[len('import time:'):].split('|')
+            # Only count un-nested entries, so parents don't double-count their children
+            if len(module) - len(module.lstrip()) == 1:
+                package = module.strip().split('.')[0]
+                packages[package] = packages.get(package, 0) + int(cumulative) / 1e6
+        return sorted(((seconds, package) for package, seconds in packages.items()), reverse=True)[:top]
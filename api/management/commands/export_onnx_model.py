@@ -0,0 +1,37 @@
+"""
+Management command to export an embedding model to int8-quantized ONNX.
+"""
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.models import EmbeddingModel
+from api.utils import OnnxEmbeddingEncoder
+
+
+class Command(BaseCommand):
+    help = 'Export an EmbeddingModel to int8-quantized ONNX for the onnx backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('embedding_model_id', type=int)
+        parser.add_argument('--output', help='Output directory (default: <VECTOR_DB_PATH>/onnx/<name>-<version>)')
+        parser.add_argument('--use', action='store_true', help='Switch the model to the onnx backend afterwards')
+
+    def handle(self, *args, **options):
+        try:
+            embedding_model = EmbeddingModel.objects.get(id=options['embedding_model_id'])
+        except EmbeddingModel.DoesNotExist:
+            raise CommandError(f"Embedding model {options['embedding_model_id']} not found")
+
+        output = options['output'] or str(
+            Path(settings.VECTOR_DB_PATH) / 'onnx' / f'{embedding_model.name}-{embedding_model.version}'
+        )
+        self.stdout.write(f'Exporting {embedding_model.model_path} to {output} ...')
+        OnnxEmbeddingEncoder.export(embedding_model.model_path, output)
+
+        embedding_model.onnx_path = output
+        if options['use']:
+            embedding_model.backend = 'onnx'
+        embedding_model.save(update_fields=['onnx_path', 'backend'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {embedding_model} (backend: {embedding_model.backend})'
+        ))
@@ -0,0 +1,37 @@
+"""
+Management command to rebuild a workspace's vector index.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.models import EmbeddingModel, Workspace
+from api.utils import EmbeddingService
+from api.vector_index import VectorIndexStore
+
+
+class Command(BaseCommand):
+    help = "Rebuild one workspace's vector index from its stored embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('workspace_id', type=int)
+        parser.add_argument('--embedding-model', type=int, help="EmbeddingModel id (default: the workspace's serving model)")
+
+    def handle(self, *args, **options):
+        if not Workspace.objects.filter(id=options['workspace_id']).exists():
+            raise CommandError(f"Workspace {options['workspace_id']} not found")
+
+        if options['embedding_model']:
+            embedding_model = EmbeddingModel.objects.get(id=options['embedding_model'])
+        else:
+            embedding_model = EmbeddingService.get_serving_embedding_model(options['workspace_id'])
+        if not embedding_model:
+            raise CommandError('No active embedding model found')
+
+        def report(progress):
+            self.stdout.write(
+                f"{progress['done']}/{progress['total']} vectors "
+                f"({progress['vectors_per_second']} vectors/s)"
+            )
+
+        stats = VectorIndexStore.rebuild(embedding_model, options['workspace_id'], on_progress=report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reindexed {stats['done']} vectors in {stats['seconds']}s"
+        ))
@@ -0,0 +1,38 @@
+"""
+Management command to run the host's shared embedding server.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.embedding_server import EmbeddingServer
+from api.utils import EmbeddingService
+
+
+class Command(BaseCommand):
+    help = 'Serve embeddings to every web and worker process on this host over a Unix socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.EMBEDDING_SERVER_SOCKET, help='Unix socket path')
+        parser.add_argument('--max-batch', type=int, default=settings.EMBEDDING_SERVER_MAX_BATCH,
+                            help='Maximum texts per micro-batch')
+        parser.add_argument('--max-wait-ms', type=float, default=settings.EMBEDDING_SERVER_MAX_WAIT_MS,
+                            help='How long the first request of a batch waits for others')
+        parser.add_argument('--no-preload', action='store_true', help='Load the active model on first request')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('Set EMBEDDING_SERVER_SOCKET or pass --socket')
+
+        if not options['no_preload']:
+            self.stdout.write('Loading active embedding model ...')
+            EmbeddingService.get_model()
+
+        server = EmbeddingServer(options['socket'], options['max_batch'], options['max_wait_ms'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedding server on {options['socket']} "
+            f"(max batch {server.max_batch_size}, max wait {options['max_wait_ms']} ms)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Served {server.texts} texts in {server.batches} batches')
@@ -0,0 +1,39 @@
+"""
+Management command to generate ingest-time summaries for already indexed documents.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Document, DocumentSummary
+from api.utils import LLMService
+from api.tasks import summarize_document
+
+
+class Command(BaseCommand):
+    help = 'Queue (or run) summary generation for indexed documents without a current summary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workspace', type=int, help='Only documents in this workspace')
+        parser.add_argument('--all', action='store_true', help='Regenerate summaries that already exist')
+        parser.add_argument('--sync', action='store_true', help='Summarize in this process instead of queueing tasks')
+
+    def handle(self, *args, **options):
+        generation_model = LLMService.get_active_generation_model()
+        if not generation_model:
+            raise CommandError('No active generation model found')
+
+        documents = Document.objects.filter(status='indexed')
+        if options['workspace']:
+            documents = documents.filter(workspace_id=options['workspace'])
+        if not options['all']:
+            # Re-chunked documents with an outdated summary are left to --all
+            summarized = DocumentSummary.objects.filter(generation_model=generation_model).values('document_id')
+            documents = documents.exclude(id__in=summarized)
+
+        document_ids = list(documents.values_list('id', flat=True))
+        for document_id in document_ids:
+            if options['sync']:
+                self.stdout.write(summarize_document.apply(args=(document_id,)).get())
+            else:
+                summarize_document.delay(document_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Summarized' if options['sync'] else 'Queued'} {len(document_ids)} documents for {generation_model}"
+        ))
@@ -0,0 +1,158 @@
+"""
+Local OpenAI/Anthropic-compatible server for benchmarking LLM client behaviour offline.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+MOCK_ANSWER = 'Mock answer based on [Document: Example, Page: 1] with enough words to stream as several tokens.'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self.server.stats_lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+
+        if self.path.endswith('/chat/completions'):
+            response, events = self._openai(body)
+        elif self.path.endswith('/messages'):
+            response, events = self._anthropic(body)
+        else:
+            self._send(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        if body.get('stream'):
+            self._send_events(events)
+        else:
+            self._send(200, response)
+
+    def _send(self, status: int, payload: Dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events: Iterator[Tuple[str, object]]):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event, data in events:
+            line = (f'event: {event}\n' if event else '') + f'data: {data if isinstance(data, str) else json.dumps(data)}\n\n'
+            encoded = line.encode()
+            self.wfile.write(f'{len(encoded):x}\r\n'.encode() + encoded + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    @staticmethod
+    def _words():
+        return [word + ' ' for word in MOCK_ANSWER.split(' ')]
+
+    def _openai(self, body: Dict):
+        model, created = body.get('model', 'mock'), int(time.time())
+        response = {
+            'id': 'chatcmpl-mock', 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': MOCK_ANSWER}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': len(self._words()), 'total_tokens': 1 + len(self._words())},
+        }
+
+        def events():
+            for word in self._words():
+                yield None, {
+                    'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}],
+                }
+            yield None, '[DONE]'
+
+        return response, events()
+
+    def _anthropic(self, body: Dict):
+        model = body.get('model', 'mock')
+        usage = {'input_tokens': 1, 'output_tokens': len(self._words())}
+        response = {
+            'id': 'msg_mock', 'type': 'message', 'role': 'assistant', 'model': model,
+            'content': [{'type': 'text', 'text': MOCK_ANSWER}],
+            'stop_reason': 'end_turn', 'stop_sequence': None, 'usage': usage,
+        }
+
+        def events():
+            yield 'message_start', {'type': 'message_start', 'message': {**response, 'content': [], 'stop_reason': None}}
+            yield 'content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}
+            for word in self._words():
+                yield 'content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word}}
+            yield 'content_block_stop', {'type': 'content_block_stop', 'index': 0}
+            yield 'message_delta', {
+                'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                'usage': {'output_tokens': usage['output_tokens']},
+            }
+            yield 'message_stop', {'type': 'message_stop'}
+
+        return response, events()
+
+
+class MockLLMServer:
+    """
+    Serve ``/v1/chat/completions`` (OpenAI) and ``/v1/messages`` (Anthropic),
+    with or without streaming, after a fixed ``latency_ms``.
+
+    ``connections`` counts accepted TCP connections and ``requests`` counts
+    completions, so ``requests / connections`` shows how well a client reuses
+    connections. Point ``OPENAI_BASE_URL`` at ``base_url + '/v1'`` and
+    ``ANTHROPIC_BASE_URL`` at ``base_url``.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 20):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency = latency_ms / 1000
+        self._server.stats_lock = threading.Lock()
+        self._server.connections = 0
+        self._server.requests = 0
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def reset_stats(self):
+        with self._server.stats_lock:
+            self._server.connections = 0
+            self._server.requests = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-llm-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
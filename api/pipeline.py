@@ -0,0 +1,350 @@
+"""
+Streaming ingestion pipeline that overlaps extraction, chunking and embedding.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from core.models import Document, Section, Chunk, ChunkEmbedding, EmbeddingModel, DocumentSummary
+from .utils import PDFProcessor, HierarchicalChunker, EmbeddingService, LLMService
+from .vector_index import VectorIndexStore
+
+# End-of-stream marker passed through the pipeline queues
+_DONE = object()
+
+
+class IngestionPipeline:
+    """
+    Run one document through extract -> chunk -> embed as a stream.
+
+    Pages are extracted in a worker thread and handed over through a bounded
+    queue. The calling thread chunks them inline and persists sections and
+    chunks, and every full batch of chunks goes to an embedding thread while
+    extraction carries on. Finished batches are stored as they come back.
+    All database access stays on the calling thread. Indexing is left to
+    ``index_document_embeddings`` so it can be resumed on its own.
+    """
+
+    def __init__(self, document: Document, embedding_model: EmbeddingModel,
+                 on_stage: Optional[Callable[[str], None]] = None,
+                 on_progress: Optional[Callable[[], None]] = None):
+        self.document = document
+        self.embedding_model = embedding_model
+        self.on_stage = on_stage or (lambda stage: None)
+        self.on_progress = on_progress or (lambda: None)  # Called after each stored batch
+        self.batch_size = settings.EMBEDDING_BATCH_SIZE
+        self.chunker = HierarchicalChunker(
+            chunk_size=settings.CHUNK_SIZE,
+            overlap=settings.CHUNK_OVERLAP,
+            section_max_chars=settings.SECTION_MAX_CHARS
+        )
+        self.timings = {'extract': 0.0, 'chunk': 0.0, 'embed': 0.0, 'store': 0.0}
+        self.section_count = 0
+        self.chunk_count = 0
+        self._pages = queue.Queue(maxsize=settings.INGESTION_PAGE_QUEUE_SIZE)
+        self._batches = queue.Queue(maxsize=settings.INGESTION_EMBED_QUEUE_SIZE)
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._pending = []
+
+    def run(self, file_path: Optional[str] = None, pages: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Process the file and return pipeline statistics.
+
+        Already extracted ``pages`` can be given instead of a file path to skip
+        PDF parsing (e.g. when resuming a run after its extract checkpoint).
+        """
+        started = time.perf_counter()
+
+        source = iter(pages) if pages is not None else PDFProcessor.iter_pages(file_path)
+        extractor = threading.Thread(target=self._extract, args=(source,), name='ingest-extract', daemon=True)
+        embedder = threading.Thread(target=self._embed, name='ingest-embed', daemon=True)
+        extractor.start()
+        embedder.start()
+
+        try:
+            # Chunk pages as they arrive; full batches are handed to the embedder
+            while True:
+                page = self._get(self._pages)
+                if page is _DONE:
+                    break
+                if isinstance(page, BaseException):
+                    raise page
+
+                chunk_started = time.perf_counter()
+                sections = self.chunker.feed(page)
+                self._persist(sections)
+                self.timings['chunk'] += time.perf_counter() - chunk_started
+                self._drain_results(block=False)
+
+            if self._stop.is_set():
+                self._raise_stopped()
+
+            chunk_started = time.perf_counter()
+            self._persist(self.chunker.finish())
+            self._flush_batch()
+            self.timings['chunk'] += time.perf_counter() - chunk_started
+            self._finish_extraction()
+
+            self.on_stage('embed')
+            self._send(_DONE)
+            self._drain_results(block=True)
+
+            self.document.status = 'embedded'
+            self.document.save(update_fields=['status', 'updated_at'])
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            extractor.join(timeout=5)
+            embedder.join(timeout=5)
+
+        return {
+            'pages': self.chunker.page_count,
+            'sections': self.section_count,
+            'chunks': self.chunk_count,
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            'wall_seconds': round(time.perf_counter() - started, 3),
+        }
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Put with backpressure, giving up once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _send(self, batch):
+        """Hand a batch (or the end marker) to the embedder, raising its error if it has stopped."""
+        if not self._put(self._batches, batch):
+            self._raise_stopped()
+
+    def _raise_stopped(self):
+        """Raise the worker error that stopped the pipeline."""
+        self._drain_results(block=False)  # Raises the embedder's error once it is reached
+        raise RuntimeError('Ingestion pipeline stopped')
+
+    def _get(self, q: queue.Queue):
+        """Blocking get that returns the end marker once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _extract(self, pages: Iterator[str]):
+        """Extraction worker: push page texts into the bounded page queue."""
+        try:
+            while True:
+                extract_started = time.perf_counter()
+                page = next(pages, _DONE)
+                self.timings['extract'] += time.perf_counter() - extract_started
+                if page is _DONE or not self._put(self._pages, page):
+                    break
+        except BaseException as e:
+            self._put(self._pages, e)
+            return
+        self._put(self._pages, _DONE)
+
+    def _embed(self):
+        """Embedding worker: encode chunk batches as soon as they are full."""
+        try:
+            while True:
+                batch = self._get(self._batches)
+                if batch is _DONE:
+                    break
+                embed_started = time.perf_counter()
+                vectors = EmbeddingService.create_embeddings(
+                    [text for _, text in batch], embedding_model=self.embedding_model
+                )
+                self.timings['embed'] += time.perf_counter() - embed_started
+                self._results.put(([chunk_id for chunk_id, _ in batch], vectors))
+        except BaseException as e:
+            self._results.put(e)
+            # Stop the chunker from blocking on a batch queue no one drains any more
+            self._stop.set()
+        self._results.put(_DONE)
+
+    def _persist(self, sections: List[Dict]):
+        """Store completed sections and their leaf chunks, queueing chunks for embedding."""
+        chunks = save_sections(self.document, sections)
+        self.section_count += len(sections)
+        self.chunk_count += len(chunks)
+        self._pending.extend((chunk.id, chunk.text) for chunk in chunks)
+        while len(self._pending) >= self.batch_size:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            self._send(batch)
+
+    def _flush_batch(self):
+        """Hand the last partial batch to the embedder."""
+        if self._pending:
+            self._send(self._pending)
+            self._pending = []
+
+    def _drain_results(self, block: bool):
+        """Store embedded batches; block until the embedder is done if asked."""
+        while True:
+            try:
+                item = self._results.get() if block else self._results.get_nowait()
+            except queue.Empty:
+                return
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+
+            chunk_ids, vectors = item
+            store_started = time.perf_counter()
+            save_embeddings(self.embedding_model, chunk_ids, vectors)
+            self.timings['store'] += time.perf_counter() - store_started
+            self.on_progress()
+
+    def _finish_extraction(self):
+        """Record the extracted text and metadata once every page has been chunked."""
+        save_extraction(self.document, self.chunker.text, self.chunker.page_count, self.chunker.headings)
+        self.document.status = 'chunked'
+        self.document.save(update_fields=['status', 'updated_at'])
+
+
+def resolve_file_path(document: Document) -> str:
+    """Return a local path for the document's uploaded file."""
+    file_path = document.file_path
+    if not os.path.exists(file_path):
+        # Try to get from storage
+        if hasattr(default_storage, 'url'):
+            file_path = default_storage.path(document.file_path)
+        else:
+            raise FileNotFoundError(f"Document file not found: {document.file_path}")
+    return file_path
+
+
+def save_extraction(document: Document, text: str, page_count: int, headings: List[Dict]):
+    """Store extracted text and extraction metadata on the document."""
+    document.extracted_text = text
+    document.page_count = page_count
+    document.metadata = {
+        **(document.metadata or {}),
+        'pages': page_count,
+        'char_count': len(text),
+        'sections': headings,
+    }
+    document.status = 'extracted'
+    document.save()
+
+
+def save_sections(document: Document, sections: List[Dict]) -> List[Chunk]:
+    """Store sections and their leaf chunks; returns the created chunks."""
+    created = []
+    for section_data in sections:
+        section = Section.objects.create(
+            document=document,
+            section_index=section_data['section_index'],
+            title=section_data['title'],
+            text=section_data['text'],
+            start_char=section_data['start_char'],
+            end_char=section_data['end_char'],
+            token_count=PDFProcessor.estimate_token_count(section_data['text'])
+        )
+        created.extend(Chunk.objects.bulk_create([
+            Chunk(
+                document=document,
+                section=section,
+                chunk_index=chunk_data['chunk_index'],
+                text=chunk_data['text'],
+                start_char=chunk_data['start_char'],
+                end_char=chunk_data['end_char'],
+                token_count=PDFProcessor.estimate_token_count(chunk_data['text']),
+                page_number=chunk_data['page_number']
+            )
+            for chunk_data in section_data['chunks']
+        ]))
+    return created
+
+
+def save_embeddings(embedding_model: EmbeddingModel, chunk_ids: List[int], vectors: np.ndarray):
+    """Store one batch of chunk embeddings; chunks already embedded under the model are left alone."""
+    ChunkEmbedding.objects.bulk_create([
+        ChunkEmbedding(chunk_id=chunk_id, embedding_model=embedding_model, vector=vector.tolist())
+        for chunk_id, vector in zip(chunk_ids, vectors)
+    ], ignore_conflicts=True)
+
+
+def embed_missing_chunks(document: Document, embedding_model: EmbeddingModel,
+                         chunk_ids: Optional[List[int]] = None) -> int:
+    """Embed the document's chunks that have no embedding under the model yet; safe to re-run."""
+    pending = Chunk.objects.filter(document=document).exclude(embeddings__embedding_model=embedding_model)
+    if chunk_ids is not None:
+        pending = pending.filter(id__in=chunk_ids)
+    pending = list(pending.order_by('chunk_index').values_list('id', 'text'))
+
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        vectors = EmbeddingService.create_embeddings([text for _, text in batch], embedding_model=embedding_model)
+        save_embeddings(embedding_model, [chunk_id for chunk_id, _ in batch], vectors)
+    return len(pending)
+
+
+def index_document_embeddings(document: Document, embedding_model: EmbeddingModel) -> int:
+    """Log the document's stored embeddings for the workspace index; the index writer applies them."""
+    chunk_ids = list(ChunkEmbedding.objects.filter(
+        chunk__document=document,
+        embedding_model=embedding_model
+    ).order_by('chunk__chunk_index').values_list('chunk_id', flat=True))
+    if chunk_ids:
+        VectorIndexStore.append(embedding_model, document.workspace_id, 'add', chunk_ids)
+        VectorIndexStore.request_checkpoint(embedding_model, document.workspace_id)
+    return len(chunk_ids)
+
+
+def index_for_serving_model(document: Document, embedding_model: EmbeddingModel) -> int:
+    """
+    Index a document for the model ingestion used and, if different, for its workspace's serving model.
+
+    While a re-embedding migration is running, a workspace keeps serving queries
+    from the previous model, so new documents are embedded under both.
+    """
+    indexed = index_document_embeddings(document, embedding_model)
+    serving_model = document.workspace.embedding_model
+    if serving_model and serving_model.id != embedding_model.id:
+        embed_missing_chunks(document, serving_model)
+        index_document_embeddings(document, serving_model)
+    return indexed
+
+
+def save_document_summary(document: Document) -> Optional[DocumentSummary]:
+    """
+    Store a summary and methodology digest of the document for the active generation model.
+
+    The summary is embedded with the workspace's serving model. Returns None
+    when no generation model is active or the document has no chunks.
+    """
+    generation_model = LLMService.get_active_generation_model()
+    chunks = list(Chunk.objects.filter(document=document).select_related('document').order_by('chunk_index'))
+    if not generation_model or not chunks:
+        return None
+
+    summary, methodology = LLMService.generate_document_summary(chunks, generation_model)
+    embedding_model = EmbeddingService.get_serving_embedding_model(document.workspace_id)
+    vector = EmbeddingService.create_embedding(summary, embedding_model) if embedding_model else None
+    document_summary, _ = DocumentSummary.objects.update_or_create(
+        document=document,
+        generation_model=generation_model,
+        defaults={
+            'summary': summary,
+            'methodology': methodology,
+            'chunk_digest': LLMService.chunk_digest(chunks),
+            'embedding_model': embedding_model,
+            'vector': vector.tolist() if vector is not None else [],
+        }
+    )
+    return document_summary
@@ -0,0 +1,125 @@
+"""
+Background re-embedding of the corpus when the active embedding model changes.
+"""
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.models import Workspace, Chunk, EmbeddingModel, EmbeddingMigration
+from .utils import EmbeddingService
+from .pipeline import save_embeddings
+from .vector_index import VectorIndexStore
+
+
+class EmbeddingMigrator:
+    """
+    Move every workspace onto a new embedding model without a search outage.
+
+    ``start`` activates the new model for ingestion, pins each workspace to
+    the model it is currently served from, and queues the migration. Each
+    ``step`` embeds one batch of ``EMBEDDING_MIGRATION_BATCH_SIZE`` chunks
+    from the first workspace not yet on the new model. The
+    ``migrate_embeddings`` task reschedules itself after
+    ``EMBEDDING_MIGRATION_THROTTLE_SECONDS``, so foreground ingestion keeps
+    the embed workers. Once every chunk of a workspace has a vector under the
+    new model, that workspace's index is rebuilt and its serving model is
+    switched in a single update.
+    """
+
+    @classmethod
+    def start(cls, embedding_model: EmbeddingModel) -> EmbeddingMigration:
+        """Activate ``embedding_model`` and queue re-embedding of all workspaces onto it."""
+        from .tasks import migrate_embeddings
+
+        with transaction.atomic():
+            previous_model = EmbeddingModel.objects.filter(is_active=True).exclude(id=embedding_model.id).first()
+            if previous_model:
+                # Keep serving from the old vectors until each workspace is covered
+                Workspace.objects.filter(embedding_model__isnull=True).update(embedding_model=previous_model)
+            EmbeddingModel.objects.exclude(id=embedding_model.id).update(is_active=False)
+            EmbeddingModel.objects.filter(id=embedding_model.id).update(is_active=True)
+
+            EmbeddingMigration.objects.filter(status='running').update(status='cancelled', completed_at=timezone.now())
+            migration = EmbeddingMigration.objects.create(
+                embedding_model=embedding_model,
+                previous_model=previous_model,
+                total_chunks=cls._pending_chunks(embedding_model).count(),
+                total_workspaces=cls._pending_workspaces(embedding_model).count()
+            )
+            transaction.on_commit(lambda: migrate_embeddings.delay(migration.id))
+        return migration
+
+    @classmethod
+    def step(cls, migration: EmbeddingMigration) -> bool:
+        """Do one throttled unit of work; returns False once the migration is finished."""
+        embedding_model = migration.embedding_model
+        workspace = cls._pending_workspaces(embedding_model).order_by('id').first()
+        if workspace is None:
+            migration.status = 'completed'
+            migration.completed_at = timezone.now()
+            migration.save(update_fields=['status', 'completed_at', 'updated_at'])
+            return False
+
+        batch = list(
+            cls._pending_chunks(embedding_model, workspace.id)
+            .order_by('id')
+            .values_list('id', 'text')[:settings.EMBEDDING_MIGRATION_BATCH_SIZE]
+        )
+        if batch:
+            vectors = EmbeddingService.create_embeddings([text for _, text in batch], embedding_model=embedding_model)
+            save_embeddings(embedding_model, [chunk_id for chunk_id, _ in batch], vectors)
+            EmbeddingMigration.objects.filter(id=migration.id).update(
+                embedded_chunks=F('embedded_chunks') + len(batch), updated_at=timezone.now()
+            )
+        else:
+            cls.switch_workspace(migration, workspace)
+        return True
+
+    @staticmethod
+    def switch_workspace(migration: EmbeddingMigration, workspace: Workspace):
+        """Build the workspace's index under the new model, then serve queries from it."""
+        VectorIndexStore.rebuild(migration.embedding_model, workspace.id)
+        Workspace.objects.filter(id=workspace.id).update(embedding_model=migration.embedding_model)
+        EmbeddingMigration.objects.filter(id=migration.id).update(
+            switched_workspaces=F('switched_workspaces') + 1, updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def progress(migration: EmbeddingMigration) -> Dict:
+        """Completion fraction, throughput and estimated time remaining."""
+        elapsed = ((migration.completed_at or timezone.now()) - migration.started_at).total_seconds()
+        rate = migration.embedded_chunks / elapsed if elapsed > 0 else 0.0
+        remaining = max(migration.total_chunks - migration.embedded_chunks, 0)
+        eta_seconds: Optional[float] = None
+        if migration.status == 'running' and rate > 0:
+            eta_seconds = round(remaining / rate, 1)
+        return {
+            'id': migration.id,
+            'embedding_model': str(migration.embedding_model),
+            'previous_model': str(migration.previous_model) if migration.previous_model else None,
+            'status': migration.status,
+            'embedded_chunks': migration.embedded_chunks,
+            'total_chunks': migration.total_chunks,
+            'switched_workspaces': migration.switched_workspaces,
+            'total_workspaces': migration.total_workspaces,
+            'fraction_done': round(migration.embedded_chunks / migration.total_chunks, 4) if migration.total_chunks else 1.0,
+            'chunks_per_second': round(rate, 2),
+            'eta_seconds': eta_seconds,
+            'started_at': migration.started_at,
+            'completed_at': migration.completed_at,
+        }
+
+    @staticmethod
+    def _pending_workspaces(embedding_model: EmbeddingModel):
+        return Workspace.objects.exclude(embedding_model=embedding_model)
+
+    @staticmethod
+    def _pending_chunks(embedding_model: EmbeddingModel, workspace_id: Optional[int] = None):
+        chunks = Chunk.objects.exclude(embeddings__embedding_model=embedding_model)
+        if workspace_id is not None:
+            chunks = chunks.filter(document__workspace_id=workspace_id)
+        else:
+            chunks = chunks.exclude(document__workspace__embedding_model=embedding_model)
+        return chunks
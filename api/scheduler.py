@@ -0,0 +1,203 @@
+"""
+Fair, priority-aware scheduling of document ingestion across users and workspaces.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from core.models import Document, IngestionJob, PipelineRun
+
+
+class IngestionScheduler:
+    """
+    Keep per-user and per-workspace ingestion queues and dispatch them fairly.
+
+    Uploads are recorded as queued IngestionJob rows instead of going straight
+    to Celery. ``dispatch`` keeps at most ``INGESTION_MAX_IN_FLIGHT`` documents
+    processing at once and fills free slots by weighted fair sharing: first the
+    user with the fewest documents in flight, then that user's workspace with
+    the lowest in-flight count relative to its weight, then the best job in it.
+    Interactive uploads and small documents go first. A job's priority improves
+    as it waits, so bulk loads are never starved.
+    """
+
+    @classmethod
+    def submit(cls, documents: List[Document], user, interactive: bool = False) -> List[IngestionJob]:
+        """Queue documents for ingestion and trigger a dispatch pass."""
+        jobs = IngestionJob.objects.bulk_create([
+            IngestionJob(
+                document=document,
+                workspace_id=document.workspace_id,
+                user=user,
+                priority=cls.classify(document.file_size, interactive),
+                size_bytes=document.file_size
+            )
+            for document in documents
+        ])
+        cls.kick()
+        return jobs
+
+    @staticmethod
+    def classify(size_bytes: int, interactive: bool) -> int:
+        """Priority class for a document: interactive, small, or bulk."""
+        if interactive:
+            return IngestionJob.PRIORITY_INTERACTIVE
+        if size_bytes <= settings.INGESTION_SMALL_DOCUMENT_BYTES:
+            return IngestionJob.PRIORITY_SMALL
+        return IngestionJob.PRIORITY_BULK
+
+    @staticmethod
+    def kick():
+        """Ask a worker to run a dispatch pass."""
+        from .tasks import dispatch_ingestion
+        dispatch_ingestion.delay()
+
+    @classmethod
+    def dispatch(cls) -> int:
+        """Send queued jobs to Celery while there are free processing slots."""
+        from .tasks import process_document
+
+        with transaction.atomic():
+            cls._requeue_stale()
+            # Lock the queue before counting free slots: a concurrent pass waits here and
+            # then sees the jobs the first one dispatched, instead of reusing its capacity
+            queued = list(IngestionJob.objects.select_for_update().filter(status='queued'))
+            in_flight = list(IngestionJob.objects.filter(status='dispatched').values('user_id', 'workspace_id'))
+            capacity = settings.INGESTION_MAX_IN_FLIGHT - len(in_flight)
+            if capacity <= 0:
+                return 0
+
+            selected = cls.select(queued, in_flight, capacity)
+            if not selected:
+                return 0
+
+            IngestionJob.objects.filter(id__in=[job.id for job in selected]).update(
+                status='dispatched', dispatched_at=timezone.now()
+            )
+            transaction.on_commit(lambda: [
+                process_document.apply_async(
+                    args=(job.document_id,),
+                    priority=settings.INGESTION_CELERY_PRIORITIES[job.priority]
+                )
+                for job in selected
+            ])
+        return len(selected)
+
+    @classmethod
+    def select(cls, queued: List[IngestionJob], in_flight: List[Dict], capacity: int) -> List[IngestionJob]:
+        """Pick up to ``capacity`` jobs by weighted fair sharing across users, then workspaces."""
+        now = timezone.now()
+        weights = settings.INGESTION_WORKSPACE_WEIGHTS
+        user_load = Counter(job['user_id'] for job in in_flight)
+        workspace_load = Counter(job['workspace_id'] for job in in_flight)
+
+        by_user = defaultdict(list)
+        for job in queued:
+            by_user[job.user_id].append(job)
+
+        def effective_priority(job):
+            waited_minutes = (now - job.enqueued_at).total_seconds() / 60
+            return (job.priority - waited_minutes / settings.INGESTION_AGING_MINUTES, job.size_bytes, job.enqueued_at)
+
+        selected = []
+        while by_user and len(selected) < capacity:
+            user_id = min(
+                by_user,
+                key=lambda uid: (user_load[uid], min(job.enqueued_at for job in by_user[uid]))
+            )
+            jobs = by_user[user_id]
+
+            workspace_ids = {job.workspace_id for job in jobs}
+            workspace_id = min(
+                workspace_ids,
+                key=lambda wid: (
+                    workspace_load[wid] / float(weights.get(str(wid), 1.0)),
+                    min(job.enqueued_at for job in jobs if job.workspace_id == wid)
+                )
+            )
+            job = min((job for job in jobs if job.workspace_id == workspace_id), key=effective_priority)
+
+            selected.append(job)
+            jobs.remove(job)
+            if not jobs:
+                del by_user[user_id]
+            user_load[user_id] += 1
+            workspace_load[workspace_id] += 1
+        return selected
+
+    @staticmethod
+    def _requeue_stale():
+        """
+        Put jobs whose worker vanished back in the queue; the rerun resumes from its checkpoint.
+
+        A job counts as abandoned once it was dispatched more than
+        ``INGESTION_JOB_TIMEOUT_SECONDS`` ago and its run has not reported
+        progress (``PipelineRun.heartbeat_at``) within that time either, so a
+        large document that is still being processed is left alone.
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT_SECONDS)
+        alive = PipelineRun.objects.filter(status='running', heartbeat_at__gte=cutoff).values('document_id')
+        IngestionJob.objects.filter(status='dispatched', dispatched_at__lt=cutoff).exclude(
+            document_id__in=alive
+        ).update(status='queued', dispatched_at=None)
+
+    @classmethod
+    def finish(cls, document: Document, succeeded: bool):
+        """Release the document's processing slot and fill free slots."""
+        finished = IngestionJob.objects.filter(document=document, status='dispatched').update(
+            status='completed' if succeeded else 'failed',
+            completed_at=timezone.now()
+        )
+        if finished:
+            cls.dispatch()
+
+    @staticmethod
+    def stats(recent_minutes: int = 60) -> Dict:
+        """Queue depth and wait times per workspace/user, for operators."""
+        now = timezone.now()
+        recent_cutoff = now - timedelta(minutes=recent_minutes)
+        jobs = IngestionJob.objects.filter(
+            status__in=['queued', 'dispatched']
+        ) | IngestionJob.objects.filter(dispatched_at__gte=recent_cutoff)
+        rows = jobs.values(
+            'workspace_id', 'workspace__name', 'user_id', 'user__username',
+            'status', 'priority', 'enqueued_at', 'dispatched_at'
+        )
+
+        tenants = {}
+        for row in rows:
+            key = (row['workspace_id'], row['user_id'])
+            tenant = tenants.setdefault(key, {
+                'workspace_id': row['workspace_id'],
+                'workspace_name': row['workspace__name'],
+                'user_id': row['user_id'],
+                'username': row['user__username'],
+                'queued': 0,
+                'queued_by_priority': {label: 0 for _, label in IngestionJob.PRIORITY_CHOICES},
+                'in_flight': 0,
+                'oldest_wait_seconds': 0.0,
+                'recent_waits': [],
+            })
+            if row['status'] == 'queued':
+                tenant['queued'] += 1
+                tenant['queued_by_priority'][dict(IngestionJob.PRIORITY_CHOICES)[row['priority']]] += 1
+                wait = (now - row['enqueued_at']).total_seconds()
+                tenant['oldest_wait_seconds'] = max(tenant['oldest_wait_seconds'], round(wait, 1))
+            elif row['status'] == 'dispatched':
+                tenant['in_flight'] += 1
+            if row['dispatched_at'] and row['dispatched_at'] >= recent_cutoff:
+                tenant['recent_waits'].append((row['dispatched_at'] - row['enqueued_at']).total_seconds())
+
+        for tenant in tenants.values():
+            waits = tenant.pop('recent_waits')
+            tenant['avg_wait_seconds'] = round(sum(waits) / len(waits), 1) if waits else None
+
+        return {
+            'max_in_flight': settings.INGESTION_MAX_IN_FLIGHT,
+            'in_flight': sum(t['in_flight'] for t in tenants.values()),
+            'queued': sum(t['queued'] for t in tenants.values()),
+            'tenants': sorted(tenants.values(), key=lambda t: -t['queued']),
+        }
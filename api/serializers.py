@@ -1,6 +1,7 @@
 """
 Serializers for API endpoints.
 """
+from django.core.validators import URLValidator
 from rest_framework import serializers
 from core.models import Document, ChatSession, ChatMessage
 
@@ -12,12 +13,26 @@ class DocumentUploadSerializer(serializers.Serializer):
     title = serializers.CharField(max_length=500, required=False)
 
 
+class DocumentBulkUploadSerializer(serializers.Serializer):
+    """Serializer for bulk upload of several PDFs or one zip/tar archive of PDFs."""
+    workspace_id = serializers.IntegerField()
+    files = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('files') and not attrs.get('archive'):
+            raise serializers.ValidationError("Provide 'files' or an 'archive'")
+        return attrs
+
+
 class QuerySerializer(serializers.Serializer):
     """Serializer for RAG query."""
     workspace_id = serializers.IntegerField()
     query = serializers.CharField()
     top_k = serializers.IntegerField(default=5, min_value=1, max_value=20)
     include_citations = serializers.BooleanField(default=True)
+    min_score = serializers.FloatField(required=False, min_value=-1.0, max_value=1.0)
+    stream = serializers.BooleanField(default=False)  # Server-sent events instead of one JSON response
 
 
 class SummarizeSerializer(serializers.Serializer):
@@ -28,9 +43,13 @@ class SummarizeSerializer(serializers.Serializer):
         min_length=1
     )
     summary_type = serializers.ChoiceField(
-        choices=['short', 'detailed', 'related_work'],
+        choices=['short', 'detailed', 'related_work', 'extractive'],  # extractive: TextRank, no LLM
         default='short'
     )
+    background = serializers.BooleanField(default=False)  # Return a job id instead of waiting
+    webhook_url = serializers.URLField(  # POSTed the job when it finishes
+        required=False, allow_blank=True, validators=[URLValidator(schemes=['http', 'https'])]
+    )
 
 
 class ChatMessageCreateSerializer(serializers.Serializer):
@@ -39,6 +58,7 @@ class ChatMessageCreateSerializer(serializers.Serializer):
     workspace_id = serializers.IntegerField()
     message = serializers.CharField()
     top_k = serializers.IntegerField(default=5, min_value=1, max_value=20)
+    stream = serializers.BooleanField(default=False)  # Server-sent events instead of one JSON response
 
 
 class CitationSerializer(serializers.Serializer):
@@ -0,0 +1,86 @@
+"""
+Request coalescing: concurrent identical calls share one execution across workers.
+"""
+import time
+import uuid
+import hashlib
+from typing import Any, Callable, Tuple
+from django.conf import settings
+from django.core.cache import cache
+
+
+class SingleFlight:
+    """
+    Run a function once for a key while identical callers wait for its result.
+
+    The first caller takes a lock in the shared cache (``cache.add``, a Redis
+    ``SET NX`` when ``REDIS_URL`` is set) holding a token for this flight. It
+    runs the function and publishes the result under that token. Callers that
+    find the lock taken poll for the result of the flight they joined. Results
+    are never shared with later flights: a request arriving after the leader
+    finished starts a new flight.
+
+    If the leader fails or dies (its lock expires after
+    ``SINGLE_FLIGHT_LOCK_SECONDS``) without publishing, waiters try to become
+    the next leader. A waiter that has waited ``SINGLE_FLIGHT_WAIT_SECONDS``
+    runs the function itself.
+    """
+
+    PREFIX = 'single_flight'
+
+    @classmethod
+    def key(cls, *parts) -> str:
+        """Stable key for the given request parameters."""
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    @classmethod
+    def run(cls, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, shared), where shared is True when another caller did the work."""
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return fn(), False
+
+        lock_key = f'{cls.PREFIX}:lock:{key}'
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, settings.SINGLE_FLIGHT_LOCK_SECONDS):
+                return cls._lead(lock_key, token, fn), False
+
+            leader = cache.get(lock_key)
+            if leader is None:
+                continue  # Released between add() and get(); race for the next flight
+            found, result = cls._wait(lock_key, leader, deadline)
+            if found:
+                return result, True
+
+        return fn(), False
+
+    @classmethod
+    def _lead(cls, lock_key: str, token: str, fn: Callable[[], Any]):
+        try:
+            result = fn()
+            # Publish before releasing, so a waiter that sees the lock gone finds the result
+            cache.set(cls._result_key(lock_key, token), {'result': result}, settings.SINGLE_FLIGHT_RESULT_TTL_SECONDS)
+            return result
+        finally:
+            # get+delete is not atomic; at worst it frees a successor's lock early, costing a duplicate call
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    @classmethod
+    def _wait(cls, lock_key: str, token: str, deadline: float) -> Tuple[bool, Any]:
+        """Poll for the result of flight ``token``; (False, None) if it ended without one."""
+        result_key = cls._result_key(lock_key, token)
+        while time.monotonic() < deadline:
+            entry = cache.get(result_key)
+            if entry is not None:
+                return True, entry['result']
+            if cache.get(lock_key) != token:
+                entry = cache.get(result_key)
+                return (True, entry['result']) if entry is not None else (False, None)
+            time.sleep(settings.SINGLE_FLIGHT_POLL_MS / 1000)
+        return False, None
+
+    @staticmethod
+    def _result_key(lock_key: str, token: str) -> str:
+        return f'{lock_key}:result:{token}'
@@ -0,0 +1,208 @@
+"""
+Background multi-document summarization with polling and webhook delivery.
+"""
+import hashlib
+import hmac
+import json
+import socket
+import ipaddress
+import urllib.request
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from core.models import Chunk, Document, SummaryJob, User, Workspace
+from .utils import LLMService
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Refuse redirects, which could send a webhook past the host checks."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class _PinnedAddress:
+    """
+    Connect to an already-checked address instead of resolving the URL's host
+    again, so DNS can't change between the check and the request. The Host
+    header and TLS server name still use the hostname.
+    """
+
+    def __init__(self, address: str):
+        super().__init__()
+        self.address = address
+
+    def do_open(self, http_class, req, **kwargs):
+        address = self.address
+
+        class PinnedConnection(http_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self._create_connection = lambda target, *rest: socket.create_connection((address, target[1]), *rest)
+
+        return super().do_open(PinnedConnection, req, **kwargs)
+
+
+class _PinnedHTTPHandler(_PinnedAddress, urllib.request.HTTPHandler):
+    pass
+
+
+class _PinnedHTTPSHandler(_PinnedAddress, urllib.request.HTTPSHandler):
+    pass
+
+
+class WebhookNotAllowed(ValueError):
+    """The webhook URL is not an allowed destination; retrying won't help."""
+
+
+class SummaryJobs:
+    """
+    Run ``/api/summarize/`` on a Celery worker instead of a web worker.
+
+    ``submit`` records a ``SummaryJob`` and queues ``run_summary_job``. The
+    client polls ``/api/summarize/jobs/{id}/`` or, with a ``webhook_url``,
+    is POSTed the same body when the job finishes. When
+    ``SUMMARY_WEBHOOK_SECRET`` is set, the body is signed with HMAC-SHA256 in
+    the ``X-Paperbot-Signature`` header.
+
+    Webhooks only go to http(s) URLs whose host resolves to public addresses,
+    whatever ``SUMMARY_WEBHOOK_ALLOWED_HOSTS`` says. The request connects to
+    the address that was checked and redirects are not followed, so a webhook
+    can't be pointed at the server's own network.
+    """
+
+    @staticmethod
+    def summarize(documents: List[Document], summary_type: str) -> Dict:
+        """Summarize documents into the body of a ``/api/summarize/`` response; LookupError if they have no chunks."""
+        chunks = list(
+            Chunk.objects.filter(document__in=documents).select_related('document').order_by('document', 'chunk_index')
+        )
+        if not chunks:
+            raise LookupError('No chunks found in documents')
+
+        summary, related_work, citations = LLMService.generate_summary(chunks, summary_type=summary_type)
+        return {
+            'summary': summary,
+            'related_work': related_work if summary_type == 'related_work' else None,
+            'citations': citations,
+            'document_ids': [document.id for document in documents]
+        }
+
+    @classmethod
+    def webhook_allowed(cls, url: str) -> bool:
+        """
+        Whether a webhook may be sent to ``url``: http(s), a public host, and
+        listed in ``SUMMARY_WEBHOOK_ALLOWED_HOSTS`` when that is set.
+        """
+        return cls._webhook_address(url) is not None
+
+    @classmethod
+    def _webhook_address(cls, url: str) -> Optional[str]:
+        """The checked address to send a webhook for ``url`` to, or None if it may not be sent."""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            return None
+        allowed = settings.SUMMARY_WEBHOOK_ALLOWED_HOSTS
+        if allowed and parsed.hostname not in allowed:
+            return None
+        addresses = cls._public_addresses(parsed.hostname)
+        return addresses[0] if addresses else None
+
+    @staticmethod
+    def _public_addresses(hostname: str) -> List[str]:
+        """
+        The addresses the host resolves to, or an empty list unless every one
+        is public (not loopback, private, link-local or reserved).
+        """
+        try:
+            addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(hostname, None)))
+        except (socket.gaierror, UnicodeError):
+            return []
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])  # Drop an IPv6 zone id
+            if (ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_reserved
+                    or ip.is_multicast or ip.is_unspecified):
+                return []
+        return addresses
+
+    @classmethod
+    def submit(cls, user: User, workspace: Workspace, documents: List[Document], summary_type: str,
+               webhook_url: str = '') -> SummaryJob:
+        """Record a job and queue it once the surrounding transaction commits."""
+        from .tasks import run_summary_job
+
+        job = SummaryJob.objects.create(
+            user=user,
+            workspace=workspace,
+            document_ids=[document.id for document in documents],
+            summary_type=summary_type,
+            webhook_url=webhook_url
+        )
+        transaction.on_commit(lambda: run_summary_job.delay(job.id))
+        return job
+
+    @classmethod
+    def run(cls, job: SummaryJob) -> SummaryJob:
+        """Generate the job's summary, recording the result or the error."""
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+
+        documents = list(Document.objects.filter(id__in=job.document_ids, workspace=job.workspace, status='indexed'))
+        try:
+            if not documents:
+                raise LookupError('No valid documents found')
+            job.result = cls.summarize(documents, job.summary_type)
+            job.status = 'completed'
+        except Exception as e:
+            job.status = 'failed'
+            job.error_message = str(e)
+        job.completed_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error_message', 'completed_at'])
+        return job
+
+    @staticmethod
+    def payload(job: SummaryJob) -> Dict:
+        """Status body for polling and webhooks; ``result`` is set once completed."""
+        return {
+            'job_id': job.id,
+            'status': job.status,
+            'summary_type': job.summary_type,
+            'document_ids': job.document_ids,
+            'result': job.result,
+            'error': job.error_message or None,
+            'created_at': job.created_at.isoformat(),
+            'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        }
+
+    @classmethod
+    def deliver(cls, job: SummaryJob):
+        """
+        POST the job's payload to its webhook; raises if the receiver doesn't
+        answer 2xx, and WebhookNotAllowed if the URL is no longer allowed.
+        """
+        # Checked again at delivery: the host's DNS may have changed since the job was created
+        address = cls._webhook_address(job.webhook_url)
+        if address is None:
+            raise WebhookNotAllowed('webhook_url is not allowed')
+        body = json.dumps(cls.payload(job)).encode()
+        request = urllib.request.Request(job.webhook_url, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'paperbot-webhook',
+        })
+        if settings.SUMMARY_WEBHOOK_SECRET:
+            signature = hmac.new(settings.SUMMARY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            request.add_header('X-Paperbot-Signature', f'sha256={signature}')
+
+        # No proxies, which would resolve the host themselves. Raises HTTPError for
+        # non-2xx responses, redirects included
+        opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({}), _NoRedirects, _PinnedHTTPHandler(address), _PinnedHTTPSHandler(address)
+        )
+        with opener.open(request, timeout=settings.SUMMARY_WEBHOOK_TIMEOUT_SECONDS):
+            pass
+        job.webhook_delivered_at = timezone.now()
+        job.webhook_error = ''
+        job.save(update_fields=['webhook_delivered_at', 'webhook_error'])
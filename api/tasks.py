@@ -1,169 +1,385 @@
 """
 Celery tasks for async document processing.
 """
-import os
-import numpy as np
-from celery import shared_task
+import time
+from typing import Dict, List, Optional
+from celery import shared_task, chain, chord, group
 from django.conf import settings
 from django.utils import timezone
-from django.core.files.storage import default_storage
-from core.models import Document, Chunk, ChunkEmbedding, EmbeddingModel, PipelineRun
-from api.utils import PDFProcessor, EmbeddingService
+from core.models import (
+    Document, Section, Chunk, EmbeddingModel, EmbeddingMigration, PipelineRun, SummaryJob
+)
+from api.utils import PDFProcessor, HierarchicalChunker, EmbeddingService
+from api.scheduler import IngestionScheduler
+from api.vector_index import VectorIndexStore
+from api.reembedding import EmbeddingMigrator
+from api.summary_jobs import SummaryJobs, WebhookNotAllowed
+from api.pipeline import (
+    IngestionPipeline, resolve_file_path, save_extraction, save_sections,
+    embed_missing_chunks, index_for_serving_model, save_document_summary
+)
+
+
+def _get_embedding_model() -> EmbeddingModel:
+    """Return the active embedding model, creating the default one if none exists."""
+    embedding_model = EmbeddingService.get_active_embedding_model()
+    if not embedding_model:
+        # Create default embedding model if none exists
+        embedding_model = EmbeddingModel.objects.create(
+            name='default',
+            version='1.0',
+            model_path=settings.EMBEDDING_MODEL,
+            dimension=384,  # Default for all-MiniLM-L6-v2
+            is_active=True
+        )
+    return embedding_model
+
+
+def _fail_ingestion(task, document: Document, pipeline_run: PipelineRun, exc: Exception,
+                    retry_kwargs: Optional[Dict] = None):
+    """
+    Mark the document and run as failed, then retry the task if retries remain.
+    
+    The run keeps its checkpoint, so the retry resumes at the failed stage.
+    """
+    document.status = 'failed'
+    document.error_message = str(exc)
+    document.save()
+    
+    pipeline_run.status = 'failed'
+    pipeline_run.error_message = str(exc)
+    pipeline_run.completed_at = timezone.now()
+    pipeline_run.save()
+    
+    # Retry if not max retries
+    if task.request.retries < task.max_retries:
+        raise task.retry(exc=exc, countdown=60 * (task.request.retries + 1), kwargs=retry_kwargs)
+    
+    IngestionScheduler.finish(document, succeeded=False)
+    raise exc
+
+
+def _start_run(document: Document, run_id: Optional[int] = None, restart: bool = False) -> PipelineRun:
+    """
+    Return the run to execute: the given or latest unfinished run of the
+    document (resumed from its checkpoint), or a new one.
+    """
+    pipeline_run = None
+    if run_id is not None:
+        pipeline_run = PipelineRun.objects.filter(id=run_id, document=document).first()
+    elif not restart:
+        pipeline_run = document.pipeline_runs.exclude(status='completed').order_by('-started_at').first()
+    
+    if pipeline_run is None or restart:
+        return PipelineRun.objects.create(
+            document=document, status='running', stage='extract', heartbeat_at=timezone.now()
+        )
+    
+    pipeline_run.attempts += 1
+    pipeline_run.status = 'running'
+    pipeline_run.stage = pipeline_run.resume_stage
+    pipeline_run.error_message = ''
+    pipeline_run.completed_at = None
+    pipeline_run.heartbeat_at = timezone.now()
+    pipeline_run.save()
+    return pipeline_run
+
+
+def _complete_ingestion(document: Document, pipeline_run: PipelineRun, stats: Dict):
+    """Mark the document as indexed and the run as completed."""
+    document.status = 'indexed'
+    document.error_message = ''
+    document.processed_at = timezone.now()
+    document.save()
+    
+    pipeline_run.status = 'completed'
+    pipeline_run.checkpoint = 'index'
+    pipeline_run.completed_at = timezone.now()
+    pipeline_run.metadata = {**pipeline_run.metadata, 'pipeline': stats}
+    pipeline_run.save()
+    
+    IngestionScheduler.finish(document, succeeded=True)
+    
+    if settings.INGESTION_SUMMARIES:
+        # Final, optional stage; the document is already searchable, so it runs off the ingestion slot
+        summarize_document.delay(document.id)
+
+
+def _stage_chain(document_id: int, run_id: int, embedding_model_id: int, resume_stage: str):
+    """Build the staged task chain starting at ``resume_stage``."""
+    stages = [
+        ('extract', extract_document.si(document_id, run_id)),
+        ('chunk', chunk_document.si(document_id, run_id)),
+        ('embed', embed_document.si(document_id, run_id, embedding_model_id)),
+    ]
+    if resume_stage == 'index':
+        return chain(index_document.si(document_id, run_id, embedding_model_id))
+    names = [name for name, _ in stages]
+    return chain(*[signature for _, signature in stages[names.index(resume_stage):]])
 
 
 @shared_task(bind=True, max_retries=3)
-def process_document(self, document_id: int):
-    """Process document: extract text, chunk, embed, and index."""
+def process_document(self, document_id: int, run_id: Optional[int] = None, restart: bool = False):
+    """
+    Process document: extract text, chunk, embed, and index.
+    
+    With ``INGESTION_MODE = 'chain'`` the stages run as separate tasks on
+    dedicated queues; otherwise they are overlapped in this worker by the
+    streaming IngestionPipeline. Retries and manual re-runs resume the latest
+    unfinished run from its checkpoint unless ``restart`` is set.
+    """
     document = Document.objects.get(id=document_id)
-    pipeline_run = PipelineRun.objects.create(
-        document=document,
-        status='running',
-        stage='extract'
-    )
+    pipeline_run = _start_run(document, run_id=run_id, restart=restart)
+    resume_stage = pipeline_run.resume_stage
     
     try:
-        # Stage 1: Extract text
         document.status = 'processing'
         document.save()
         
-        file_path = document.file_path
-        if not os.path.exists(file_path):
-            # Try to get from storage
-            if hasattr(default_storage, 'url'):
-                file_path = default_storage.path(document.file_path)
+        embedding_model = _get_embedding_model()
+        
+        if settings.INGESTION_MODE == 'chain':
+            _stage_chain(document_id, pipeline_run.id, embedding_model.id, resume_stage).apply_async()
+            return f"Document {document_id} queued for staged processing from '{resume_stage}'"
+        
+        stats = {'resumed_from': resume_stage, 'attempt': pipeline_run.attempts}
+        if resume_stage in ('extract', 'chunk'):
+            # Delete existing chunks if any (for reprocessing)
+            Chunk.objects.filter(document=document).delete()
+            Section.objects.filter(document=document).delete()
+            
+            # Extract, chunk and embed, overlapped as a stream; extracted text is reused if checkpointed
+            pipeline = IngestionPipeline(
+                document, embedding_model, on_stage=pipeline_run.advance_to, on_progress=pipeline_run.beat
+            )
+            if resume_stage == 'chunk':
+                stats.update(pipeline.run(pages=PDFProcessor.split_pages(document.extracted_text)))
             else:
-                raise FileNotFoundError(f"Document file not found: {document.file_path}")
+                stats.update(pipeline.run(resolve_file_path(document)))
+        elif resume_stage == 'embed':
+            stats['embedded'] = embed_missing_chunks(document, embedding_model)
         
-        text, metadata = PDFProcessor.extract_text_from_pdf(file_path)
-        document.extracted_text = text
-        document.page_count = metadata.get('pages', 0)
-        document.metadata = metadata
-        document.status = 'extracted'
-        document.save()
+        pipeline_run.advance_to('index')
+        stats['indexed'] = index_for_serving_model(document, embedding_model)
         
-        pipeline_run.stage = 'chunk'
-        pipeline_run.save()
+        _complete_ingestion(document, pipeline_run, stats)
+        return f"Document {document_id} processed successfully"
+    
+    except Exception as e:
+        _fail_ingestion(self, document, pipeline_run, e, retry_kwargs={'run_id': pipeline_run.id})
+
+
+@shared_task(bind=True, max_retries=3)
+def extract_document(self, document_id: int, run_id: int):
+    """Chain stage 1: extract page text from the PDF."""
+    document = Document.objects.get(id=document_id)
+    pipeline_run = PipelineRun.objects.get(id=run_id)
+    try:
+        started = time.perf_counter()
+        pages = list(PDFProcessor.iter_pages(resolve_file_path(document)))
+        text = ''.join(pages)
+        save_extraction(document, text, len(pages), [])
+        
+        pipeline_run.metadata = {**pipeline_run.metadata, 'extract_seconds': round(time.perf_counter() - started, 3)}
+        pipeline_run.save(update_fields=['metadata'])
+        pipeline_run.advance_to('chunk')
+        return document_id
+    except Exception as e:
+        _fail_ingestion(self, document, pipeline_run, e)
+
+
+@shared_task(bind=True, max_retries=3)
+def chunk_document(self, document_id: int, run_id: int):
+    """Chain stage 2: chunk the extracted text into sections and leaf chunks."""
+    document = Document.objects.get(id=document_id)
+    pipeline_run = PipelineRun.objects.get(id=run_id)
+    try:
+        started = time.perf_counter()
         
-        # Stage 2: Chunk text
         # Delete existing chunks if any (for reprocessing)
         Chunk.objects.filter(document=document).delete()
+        Section.objects.filter(document=document).delete()
         
-        chunks_data = PDFProcessor.chunk_text(text)
-        chunks = []
-        for chunk_data in chunks_data:
-            chunk = Chunk.objects.create(
-                document=document,
-                chunk_index=chunk_data['chunk_index'],
-                text=chunk_data['text'],
-                start_char=chunk_data['start_char'],
-                end_char=chunk_data['end_char'],
-                page_number=None  # Will be estimated if needed
-            )
-            chunks.append(chunk)
+        chunker = HierarchicalChunker(
+            chunk_size=settings.CHUNK_SIZE,
+            overlap=settings.CHUNK_OVERLAP,
+            section_max_chars=settings.SECTION_MAX_CHARS
+        )
+        chunk_count = 0
+        for page_text in PDFProcessor.split_pages(document.extracted_text):
+            chunk_count += len(save_sections(document, chunker.feed(page_text)))
+        chunk_count += len(save_sections(document, chunker.finish()))
         
+        document.metadata = {**document.metadata, 'sections': chunker.headings}
         document.status = 'chunked'
         document.save()
         
-        pipeline_run.stage = 'embed'
-        pipeline_run.save()
-        
-        # Stage 3: Create embeddings
-        embedding_model = EmbeddingService.get_active_embedding_model()
-        if not embedding_model:
-            # Create default embedding model if none exists
-            embedding_model = EmbeddingModel.objects.create(
-                name='default',
-                version='1.0',
-                model_path=settings.EMBEDDING_MODEL,
-                dimension=384,  # Default for all-MiniLM-L6-v2
-                is_active=True
-            )
-        
-        embedding_service = EmbeddingService()
-        model = embedding_service.get_model()
-        
-        for chunk in chunks:
-            embedding_vector = embedding_service.create_embedding(chunk.text)
-            
-            # Store embedding
-            ChunkEmbedding.objects.create(
-                chunk=chunk,
-                embedding_model=embedding_model,
-                vector=embedding_vector.tolist()
-            )
-        
+        pipeline_run.metadata = {
+            **pipeline_run.metadata,
+            'chunk_seconds': round(time.perf_counter() - started, 3),
+            'chunks': chunk_count,
+        }
+        pipeline_run.save(update_fields=['metadata'])
+        pipeline_run.advance_to('embed')
+        return document_id
+    except Exception as e:
+        _fail_ingestion(self, document, pipeline_run, e)
+
+
+@shared_task(bind=True, max_retries=3)
+def embed_document(self, document_id: int, run_id: int, embedding_model_id: int):
+    """Chain stage 3: fan out embedding of the not-yet-embedded chunks, then index."""
+    pending_ids = list(Chunk.objects.filter(
+        document_id=document_id
+    ).exclude(
+        embeddings__embedding_model_id=embedding_model_id
+    ).order_by('chunk_index').values_list('id', flat=True))
+    
+    index_task = index_document.si(document_id, run_id, embedding_model_id)
+    if not pending_ids:
+        raise self.replace(index_task)
+    
+    batch_size = settings.EMBEDDING_TASK_BATCH_SIZE
+    embed_tasks = group(
+        embed_chunks.si(document_id, run_id, embedding_model_id, pending_ids[i:i + batch_size])
+        for i in range(0, len(pending_ids), batch_size)
+    )
+    raise self.replace(chord(embed_tasks, index_task))
+
+
+@shared_task(bind=True, max_retries=3)
+def embed_chunks(self, document_id: int, run_id: int, embedding_model_id: int, chunk_ids: List[int]):
+    """Chain stage 3 (fanned out): embed one batch of chunks."""
+    document = Document.objects.get(id=document_id)
+    try:
+        embedding_model = EmbeddingModel.objects.get(id=embedding_model_id)
+        embedded = embed_missing_chunks(document, embedding_model, chunk_ids=chunk_ids)
+        PipelineRun.objects.filter(id=run_id).update(heartbeat_at=timezone.now())
+        return embedded
+    except Exception as e:
+        _fail_ingestion(self, document, PipelineRun.objects.get(id=run_id), e)
+
+
+@shared_task(bind=True, max_retries=3)
+def index_document(self, document_id: int, run_id: int, embedding_model_id: int):
+    """Chain stage 4: add the document's embeddings to the vector index."""
+    document = Document.objects.get(id=document_id)
+    pipeline_run = PipelineRun.objects.get(id=run_id)
+    try:
         document.status = 'embedded'
         document.save()
+        pipeline_run.advance_to('index')
         
-        pipeline_run.stage = 'index'
-        pipeline_run.save()
-        
-        # Stage 4: Index in vector DB
-        index = embedding_service.get_or_create_index(embedding_model.dimension)
-        
-        # Add embeddings to index
-        for chunk in chunks:
-            embedding = chunk.embedding
-            vector = np.array(embedding.vector).astype('float32').reshape(1, -1)
-            index.add(vector)
-        
-        # Save index
-        embedding_service.save_index()
-        
-        document.status = 'indexed'
-        document.save()
-        
-        pipeline_run.status = 'completed'
-        pipeline_run.completed_at = timezone.now()
-        pipeline_run.save()
+        embedding_model = EmbeddingModel.objects.get(id=embedding_model_id)
+        indexed = index_for_serving_model(document, embedding_model)
         
+        _complete_ingestion(document, pipeline_run, {'mode': 'chain', 'indexed': indexed})
         return f"Document {document_id} processed successfully"
+    except Exception as e:
+        _fail_ingestion(self, document, pipeline_run, e)
+
+
+@shared_task(bind=True, max_retries=3)
+def summarize_document(self, document_id: int):
+    """Final stage: store the document's summary and methodology digest for the active generation model."""
+    document = Document.objects.get(id=document_id)
+    try:
+        document_summary = save_document_summary(document)
+    except Exception as e:
+        raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
+    if document_summary is None:
+        return f"Document {document_id} not summarized: no active generation model or no chunks"
+    return f"Document {document_id} summarized by {document_summary.generation_model}"
+
+
+@shared_task
+def run_summary_job(job_id: int):
+    """Generate a background summary, then hand it to the webhook if one was given."""
+    job = SummaryJobs.run(SummaryJob.objects.get(id=job_id))
+    if job.webhook_url:
+        deliver_summary_webhook.delay(job.id)
+    return f"Summary job {job_id} {job.status}"
+
+
+@shared_task(bind=True, max_retries=5)
+def deliver_summary_webhook(self, job_id: int):
+    """POST a finished summary job to its webhook, retrying with backoff."""
+    job = SummaryJob.objects.get(id=job_id)
+    try:
+        SummaryJobs.deliver(job)
+    except WebhookNotAllowed as e:
+        # Permanent: the URL won't become allowed by retrying
+        job.webhook_error = str(e)
+        job.save(update_fields=['webhook_error'])
+        return f"Summary job {job_id} webhook not allowed"
+    except Exception as e:
+        job.webhook_error = str(e)
+        job.save(update_fields=['webhook_error'])
+        raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+    return f"Summary job {job_id} delivered"
+
+
+@shared_task
+def dispatch_ingestion():
+    """Fill free ingestion slots from the fair scheduler's queues."""
+    return f"Dispatched {IngestionScheduler.dispatch()} documents"
+
+
+@shared_task(bind=True, max_retries=3)
+def migrate_embeddings(self, migration_id: int):
+    """Re-embed one batch for a running embedding migration, then reschedule after a pause."""
+    migration = EmbeddingMigration.objects.select_related('embedding_model').get(id=migration_id)
+    if migration.status != 'running':
+        return f"Embedding migration {migration_id} is {migration.status}"
     
+    try:
+        more = EmbeddingMigrator.step(migration)
     except Exception as e:
-        document.status = 'failed'
-        document.error_message = str(e)
-        document.save()
-        
-        pipeline_run.status = 'failed'
-        pipeline_run.error_message = str(e)
-        pipeline_run.completed_at = timezone.now()
-        pipeline_run.save()
-        
-        # Retry if not max retries
         if self.request.retries < self.max_retries:
             raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
-        
+        migration.status = 'failed'
+        migration.error_message = str(e)
+        migration.completed_at = timezone.now()
+        migration.save(update_fields=['status', 'error_message', 'completed_at', 'updated_at'])
         raise
+    
+    if more:
+        migrate_embeddings.apply_async((migration_id,), countdown=settings.EMBEDDING_MIGRATION_THROTTLE_SECONDS)
+    migration.refresh_from_db()
+    progress = EmbeddingMigrator.progress(migration)
+    return f"Embedding migration {migration_id}: {progress['embedded_chunks']}/{progress['total_chunks']} chunks"
 
 
 @shared_task
-def reindex_workspace(workspace_id: int):
-    """Reindex all documents in a workspace."""
-    from core.models import Workspace
-    
-    workspace = Workspace.objects.get(id=workspace_id)
-    documents = workspace.documents.filter(status='indexed')
-    
-    embedding_model = EmbeddingService.get_active_embedding_model()
+def checkpoint_vector_index(embedding_model_id: int, workspace_id: int):
+    """Index writer: fold pending log entries into a workspace's snapshot."""
+    embedding_model = EmbeddingModel.objects.get(id=embedding_model_id)
+    applied = VectorIndexStore.checkpoint(embedding_model, workspace_id)
+    return f"Applied {applied} log entries to workspace {workspace_id}"
+
+
+@shared_task
+def checkpoint_vector_indexes():
+    """Periodically checkpoint every index that is behind its log."""
+    keys = VectorIndexStore.pending_keys()
+    for embedding_model_id, workspace_id in keys:
+        checkpoint_vector_index.delay(embedding_model_id, workspace_id)
+    return f"Requested {len(keys)} checkpoints"
+
+
+@shared_task(bind=True)
+def reindex_workspace(self, workspace_id: int):
+    """Rebuild a workspace's vector index, reporting progress through the task state."""
+    embedding_model = EmbeddingService.get_serving_embedding_model(workspace_id)
     if not embedding_model:
         return "No active embedding model found"
     
-    embedding_service = EmbeddingService()
-    index = embedding_service.get_or_create_index(embedding_model.dimension)
-    
-    # Clear and rebuild index
-    index.reset()
+    def report(progress: Dict):
+        if self.request.id and not self.request.is_eager:
+            self.update_state(state='PROGRESS', meta={'workspace_id': workspace_id, **progress})
     
-    for document in documents:
-        chunks = document.chunks.all()
-        for chunk in chunks:
-            try:
-                embedding = chunk.embedding
-                vector = np.array(embedding.vector).astype('float32').reshape(1, -1)
-                index.add(vector)
-            except ChunkEmbedding.DoesNotExist:
-                continue
-    
-    embedding_service.save_index()
-    return f"Reindexed {documents.count()} documents"
-
+    stats = VectorIndexStore.rebuild(embedding_model, workspace_id, on_progress=report)
+    return (
+        f"Reindexed {stats['done']} vectors in workspace {workspace_id} "
+        f"in {stats['seconds']}s ({stats['vectors_per_second']} vectors/s)"
+    )
@@ -1,11 +1,40 @@
 """
 Tests for API endpoints.
 """
-from django.test import TestCase
+import io
+import os
+import time
+import shutil
+import tempfile
+import zipfile
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
-from core.models import Workspace, Document, EmbeddingModel, GenerationModel
+from core.models import (
+    Workspace, Document, Section, Chunk, ChunkEmbedding, EmbeddingModel, GenerationModel, PipelineRun,
+    IngestionJob, VectorIndexLog, ChatSession, ChatMessage, DocumentSummary, SummaryJob
+)
+from api.utils import (
+    PDFProcessor, EmbeddingService, EmbeddingModelPool, OnnxEmbeddingEncoder, LLMService, LLMClientRegistry,
+    ContextPacker, ExtractiveAnswerer, TextRankSummarizer, EmbeddingBackendUnavailable,
+    SENTENCE_TRANSFORMERS_AVAILABLE, ONNXRUNTIME_AVAILABLE
+)
+from api.pipeline import IngestionPipeline, index_document_embeddings, save_document_summary
+from api.scheduler import IngestionScheduler
+from api.vector_index import VectorIndexStore, FAISS_AVAILABLE
+from api.embedding_server import EmbeddingServer, EmbeddingServerError
+from api.warmup import ProcessWarmup
+from api.lazy import LazyModule
+from api.mock_llm_server import MockLLMServer
+from api.answer_cache import AnswerCache
+from api.single_flight import SingleFlight
+from api.summary_jobs import SummaryJobs, WebhookNotAllowed
 
 User = get_user_model()
 
@@ -51,6 +80,110 @@ class DocumentUploadTestCase(TestCase):
         self.assertEqual(doc.workspace, self.workspace)
 
 
+class BulkUploadTestCase(TestCase):
+    """Test the multi-file / archive bulk upload endpoint."""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.workspace = Workspace.objects.create(
+            name='Test Workspace',
+            owner=self.user
+        )
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+    
+    def test_bulk_upload_archive_and_files(self):
+        """PDFs from a zip and loose files become documents enqueued in one batch."""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('papers/a.pdf', b'%PDF-1.4 a')
+            zf.writestr('papers/b.pdf', b'%PDF-1.4 b')
+            zf.writestr('papers/notes.txt', b'not a pdf')
+        archive = SimpleUploadedFile('library.zip', buffer.getvalue(), content_type='application/zip')
+        loose = SimpleUploadedFile('c.pdf', b'%PDF-1.4 c', content_type='application/pdf')
+        
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch('api.scheduler.IngestionScheduler.kick') as kick:
+            response = self.client.post('/api/documents/bulk_upload/', {
+                'workspace_id': self.workspace.id,
+                'archive': archive,
+                'files': [loose],
+            }, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(Document.objects.values_list('filename', flat=True)), ['a.pdf', 'b.pdf', 'c.pdf']
+        )
+        jobs = IngestionJob.objects.filter(user=self.user)
+        self.assertEqual(jobs.count(), 3)
+        self.assertFalse(jobs.filter(priority=IngestionJob.PRIORITY_INTERACTIVE).exists())
+        kick.assert_called_once()
+    
+    def test_bulk_upload_filters_loose_files(self):
+        """Loose files get the same PDF and size checks as archive members."""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        
+        files = [
+            SimpleUploadedFile('a.pdf', b'%PDF-1.4 a', content_type='application/pdf'),
+            SimpleUploadedFile('notes.txt', b'not a pdf', content_type='text/plain'),
+            SimpleUploadedFile('big.pdf', b'%PDF-1.4 ' + b'x' * 64, content_type='application/pdf'),
+        ]
+        with override_settings(MEDIA_ROOT=self.media_root, BULK_UPLOAD_MAX_FILE_SIZE=32), \
+                mock.patch('api.scheduler.IngestionScheduler.kick'):
+            response = self.client.post('/api/documents/bulk_upload/', {
+                'workspace_id': self.workspace.id,
+                'files': files,
+            }, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Document.objects.values_list('filename', flat=True)), ['a.pdf'])
+        self.assertEqual(
+            {s['filename']: s['reason'] for s in response.data['skipped']},
+            {'notes.txt': 'not a PDF', 'big.pdf': 'file too large'}
+        )
+    
+    def test_bulk_upload_corrupt_archive_leaves_no_files(self):
+        """An archive that breaks partway through is rejected and its stored members removed."""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('a.pdf', b'%PDF-1.4 ' + b'a' * 1000)
+            zf.writestr('b.pdf', b'%PDF-1.4 ' + b'b' * 1000)
+        data = bytearray(buffer.getvalue())
+        # Corrupt the second member's compressed data; the central directory stays readable
+        second = data.find(b'b.pdf') + len('b.pdf')
+        data[second:second + 8] = b'\xff' * 8
+        archive = SimpleUploadedFile('library.zip', bytes(data), content_type='application/zip')
+        
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch('api.scheduler.IngestionScheduler.kick'):
+            response = self.client.post('/api/documents/bulk_upload/', {
+                'workspace_id': self.workspace.id,
+                'archive': archive,
+            }, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Document.objects.exists())
+        stored = [f for _, _, names in os.walk(self.media_root) for f in names]
+        self.assertEqual(stored, [])
+    
+    def test_bulk_upload_requires_files(self):
+        """An empty bulk upload is rejected."""
+        response = self.client.post('/api/documents/bulk_upload/', {
+            'workspace_id': self.workspace.id,
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class QueryTestCase(TestCase):
     """Test RAG query endpoint."""
     
@@ -89,6 +222,31 @@ class QueryTestCase(TestCase):
             response.status_code,
             [status.HTTP_200_OK, status.HTTP_404_NOT_FOUND]
         )
+    
+    def test_query_below_min_score_skips_llm(self):
+        """Chunks under the cutoff never reach the LLM; those above carry their score into citations."""
+        document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        chunk = Chunk.objects.create(document=document, chunk_index=0, text='Machine learning is a field of study.')
+        chunk.score = 0.15
+        
+        with mock.patch.object(EmbeddingService, 'create_embedding', return_value=np.zeros(384)), \
+                mock.patch.object(EmbeddingService, 'search_similar_chunks', return_value=[(chunk, 0.15)]), \
+                mock.patch.object(LLMService, 'generate_answer') as generate_answer:
+            response = self.client.post('/api/query/', {
+                'workspace_id': self.workspace.id, 'query': 'What is machine learning?', 'min_score': 0.3
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            generate_answer.assert_not_called()
+            
+            generate_answer.side_effect = lambda query, chunks, **kwargs: LLMService._generate_fallback_answer(query, chunks)
+            response = self.client.post('/api/query/', {
+                'workspace_id': self.workspace.id, 'query': 'What is machine learning?', 'min_score': 0.1
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['citations'][0]['score'], 0.15)
 
 
 class SummarizeTestCase(TestCase):
@@ -150,6 +308,1600 @@ class AuthenticationTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class HierarchicalChunkingTestCase(TestCase):
+    """Test section/leaf chunking and parent-level context building."""
+    
+    TEXT = (
+        "A Study of Things\n\n"
+        "1 Introduction\n" + "Intro sentence about things. " * 40 + "\n\n"
+        "2 Related Work\n" + "Prior work sentence. " * 30 + "\n"
+    )
+    
+    def test_detect_headings(self):
+        """Numbered headings are detected with their offsets."""
+        headings = PDFProcessor.detect_headings(self.TEXT)
+        titles = [h['title'] for h in headings]
+        self.assertEqual(titles, ['1 Introduction', '2 Related Work'])
+        for heading in headings:
+            self.assertTrue(self.TEXT[heading['start_char']:].startswith(heading['title']))
+    
+    def test_chunk_hierarchical(self):
+        """Leaf chunks stay inside their section and are indexed document-wide."""
+        sections = PDFProcessor.chunk_hierarchical(self.TEXT, chunk_size=300, overlap=50)
+        self.assertEqual([s['title'] for s in sections], ['', '1 Introduction', '2 Related Work'])
+        indices = [c['chunk_index'] for s in sections for c in s['chunks']]
+        self.assertEqual(indices, list(range(len(indices))))
+        for section in sections:
+            self.assertTrue(section['chunks'])
+            for chunk in section['chunks']:
+                self.assertGreaterEqual(chunk['start_char'], section['start_char'])
+                self.assertLessEqual(chunk['end_char'], section['end_char'])
+    
+    def test_context_deduplicates_parents(self):
+        """Several hits from one section put that section in the prompt once."""
+        user = User.objects.create_user(username='u', email='u@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='W', owner=user)
+        document = Document.objects.create(
+            workspace=workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        section = Section.objects.create(document=document, section_index=0, title='1 Intro', text='Full section text.')
+        chunks = [
+            Chunk.objects.create(document=document, section=section, chunk_index=i, text=f'leaf {i}')
+            for i in range(3)
+        ]
+        context = LLMService._build_context(chunks)
+        self.assertEqual(context.count('Full section text.'), 1)
+        self.assertIn('Section: 1 Intro', context)
+        self.assertNotIn('leaf 1', context)
 
 
+class IngestionPipelineTestCase(TestCase):
+    """Test the streaming extract/chunk/embed/index pipeline."""
+    
+    def test_pipeline_streams_pages_to_embeddings(self):
+        """Every chunk produced from the streamed pages is embedded."""
+        user = User.objects.create_user(username='u', email='u@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='W', owner=user)
+        document = Document.objects.create(
+            workspace=workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        embedding_model = EmbeddingModel.objects.create(
+            name='test-model', version='1.0', model_path='test', dimension=4, is_active=True
+        )
+        pages = [
+            "1 Introduction\n" + "Intro text. " * 100 + "\f",
+            "2 Method\n" + "Method text. " * 100 + "\f",
+        ]
+        
+        with mock.patch('api.pipeline.PDFProcessor.iter_pages', return_value=iter(pages)), \
+                mock.patch('api.pipeline.EmbeddingService.create_embeddings',
+                           side_effect=lambda texts, **kwargs: np.ones((len(texts), 4))):
+            stats = IngestionPipeline(document, embedding_model).run('p.pdf')
+        
+        chunks = Chunk.objects.filter(document=document)
+        self.assertEqual(stats['pages'], 2)
+        self.assertEqual(stats['chunks'], chunks.count())
+        self.assertEqual(chunks.filter(embeddings__isnull=True).count(), 0)
+        self.assertEqual(set(chunks.values_list('page_number', flat=True)), {1, 2})
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'embedded')
+        self.assertEqual(document.page_count, 2)
+    
+    @override_settings(EMBEDDING_BATCH_SIZE=1, INGESTION_EMBED_QUEUE_SIZE=1)
+    def test_embedding_failure_stops_the_pipeline(self):
+        """An embedder error surfaces from run() even when one page fills the batch queue many times over."""
+        import threading
+        
+        user = User.objects.create_user(username='f', email='f@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='W', owner=user)
+        document = Document.objects.create(
+            workspace=workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        embedding_model = EmbeddingModel.objects.create(
+            name='test-model', version='1.0', model_path='test', dimension=4, is_active=True
+        )
+        pages = ["1 Introduction\n" + "Intro text. " * 500 + "\f"]
+        pipeline = IngestionPipeline(document, embedding_model)
+        # Safety net so a regression fails the test instead of hanging it
+        watchdog = threading.Timer(10, pipeline._stop.set)
+        watchdog.start()
+        self.addCleanup(watchdog.cancel)
+        
+        with mock.patch('api.pipeline.EmbeddingService.create_embeddings',
+                        side_effect=RuntimeError('embedding backend crashed')), \
+                self.assertRaisesMessage(RuntimeError, 'embedding backend crashed'):
+            pipeline.run(pages=pages)
+        self.assertTrue(watchdog.is_alive(), 'pipeline only stopped when the watchdog fired')
+    
+    @override_settings(INGESTION_MODE='chain')
+    def test_chain_mode_dispatches_stage_tasks(self):
+        """In chain mode process_document only enqueues the stage tasks."""
+        from api.tasks import process_document
+        from paperbot.celery import app
+        
+        user = User.objects.create_user(username='c', email='c@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='W', owner=user)
+        document = Document.objects.create(
+            workspace=workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        with mock.patch('api.tasks.chain') as chain:
+            process_document.apply(args=(document.id,))
+        
+        stages = [sig.task for sig in chain.call_args.args]
+        self.assertEqual(stages, ['api.tasks.extract_document', 'api.tasks.chunk_document', 'api.tasks.embed_document'])
+        chain.return_value.apply_async.assert_called_once()
+        self.assertEqual(app.amqp.router.route({}, 'api.tasks.embed_chunks')['queue'].name, 'embed')
+    
+    def test_retry_resumes_from_checkpoint(self):
+        """A run that failed after chunking only embeds the missing chunks and reuses its row."""
+        from api.tasks import process_document
+        
+        user = User.objects.create_user(username='r', email='r@example.com', password='pass12345')
+        workspace = Workspace.objects.create(name='W', owner=user)
+        document = Document.objects.create(
+            workspace=workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1, status='failed'
+        )
+        embedding_model = EmbeddingModel.objects.create(
+            name='test-model', version='1.0', model_path='test', dimension=4, is_active=True
+        )
+        chunks = [Chunk.objects.create(document=document, chunk_index=i, text=f'text {i}') for i in range(3)]
+        ChunkEmbedding.objects.create(chunk=chunks[0], embedding_model=embedding_model, vector=[0.0] * 4)
+        run = PipelineRun.objects.create(document=document, status='failed', stage='embed', checkpoint='chunk')
+        
+        with mock.patch('api.pipeline.EmbeddingService.create_embeddings',
+                        side_effect=lambda texts, **kwargs: np.ones((len(texts), 4))) as create_embeddings, \
+                mock.patch('api.tasks.index_for_serving_model', return_value=3), \
+                mock.patch('api.tasks.IngestionPipeline') as pipeline:
+            process_document.apply(args=(document.id,))
+        
+        pipeline.assert_not_called()
+        self.assertEqual(create_embeddings.call_args.args[0], ['text 1', 'text 2'])
+        self.assertEqual(PipelineRun.objects.filter(document=document).count(), 1)
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.checkpoint, run.attempts), ('completed', 'index', 2))
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'indexed')
+
 
+class IngestionSchedulerTestCase(TestCase):
+    """Test fair dispatching of queued ingestion jobs."""
+    
+    def setUp(self):
+        self.bulk_user = User.objects.create_user(username='bulk', email='bulk@example.com', password='pass12345')
+        self.other_user = User.objects.create_user(username='other', email='other@example.com', password='pass12345')
+        self.bulk_workspace = Workspace.objects.create(name='Library', owner=self.bulk_user)
+        self.other_workspace = Workspace.objects.create(name='Notes', owner=self.other_user)
+    
+    def _queue(self, workspace, user, count, interactive=False, size=1024):
+        documents = [
+            Document.objects.create(
+                workspace=workspace, title=f'Paper {i}', filename=f'{i}.pdf', file_path=f'{i}.pdf', file_size=size
+            )
+            for i in range(count)
+        ]
+        with mock.patch.object(IngestionScheduler, 'kick'):
+            return IngestionScheduler.submit(documents, user, interactive=interactive)
+    
+    def test_bulk_load_does_not_starve_other_users(self):
+        """A single interactive upload is dispatched ahead of another user's bulk backlog."""
+        self._queue(self.bulk_workspace, self.bulk_user, 20, size=50 * 1024 * 1024)
+        self._queue(self.other_workspace, self.other_user, 1, interactive=True)
+        
+        with override_settings(INGESTION_MAX_IN_FLIGHT=2), \
+                mock.patch('api.tasks.process_document.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            dispatched = IngestionScheduler.dispatch()
+        
+        self.assertEqual(dispatched, 2)
+        in_flight = IngestionJob.objects.filter(status='dispatched')
+        self.assertEqual(sorted(in_flight.values_list('user__username', flat=True)), ['bulk', 'other'])
+        priorities = sorted(call.kwargs['priority'] for call in apply_async.call_args_list)
+        self.assertEqual(priorities, [0, 6])
+    
+    def test_finish_frees_slot(self):
+        """Completing a job dispatches the next queued one."""
+        self._queue(self.bulk_workspace, self.bulk_user, 2)
+        with override_settings(INGESTION_MAX_IN_FLIGHT=1), \
+                mock.patch('api.tasks.process_document.apply_async'), \
+                self.captureOnCommitCallbacks(execute=True):
+            IngestionScheduler.dispatch()
+            first = IngestionJob.objects.get(status='dispatched')
+            IngestionScheduler.finish(first.document, succeeded=True)
+        
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'completed')
+        self.assertEqual(IngestionJob.objects.filter(status='dispatched').count(), 1)
+        self.assertEqual(IngestionScheduler.stats()['queued'], 0)
+    
+    @override_settings(INGESTION_JOB_TIMEOUT_SECONDS=60)
+    def test_stale_jobs_requeued_unless_still_progressing(self):
+        """Only dispatched jobs whose run stopped reporting progress go back in the queue."""
+        from datetime import timedelta
+        from django.utils import timezone
+        
+        busy, abandoned = self._queue(self.bulk_workspace, self.bulk_user, 2)
+        long_ago = timezone.now() - timedelta(minutes=10)
+        IngestionJob.objects.update(status='dispatched', dispatched_at=long_ago)
+        PipelineRun.objects.create(document=busy.document, status='running', heartbeat_at=timezone.now())
+        PipelineRun.objects.create(document=abandoned.document, status='running', heartbeat_at=long_ago)
+        
+        with override_settings(INGESTION_MAX_IN_FLIGHT=1), \
+                mock.patch('api.tasks.process_document.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(IngestionScheduler.dispatch(), 0)  # The busy job still holds the only slot
+        
+        busy.refresh_from_db()
+        abandoned.refresh_from_db()
+        self.assertEqual(busy.status, 'dispatched')
+        self.assertEqual(abandoned.status, 'queued')
+        apply_async.assert_not_called()
+
+
+@skipUnless(FAISS_AVAILABLE, 'faiss not installed')
+class VectorIndexStoreTestCase(TestCase):
+    """Test the log-backed single-writer vector index."""
+    
+    def setUp(self):
+        self.vector_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.vector_root, ignore_errors=True)
+        override = override_settings(VECTOR_DB_PATH=self.vector_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        VectorIndexStore.clear_cache()
+        self.addCleanup(VectorIndexStore.clear_cache)
+        
+        user = User.objects.create_user(username='v', email='v@example.com', password='pass12345')
+        self.workspace = Workspace.objects.create(name='W', owner=user)
+        self.embedding_model = EmbeddingModel.objects.create(
+            name='test-model', version='1.0', model_path='test', dimension=2, is_active=True
+        )
+        self.document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        self.chunks = []
+        for i, vector in enumerate([[0.0, 0.0], [1.0, 0.0], [0.0, 5.0]]):
+            chunk = Chunk.objects.create(document=self.document, chunk_index=i, text=f'text {i}')
+            ChunkEmbedding.objects.create(chunk=chunk, embedding_model=self.embedding_model, vector=vector)
+            self.chunks.append(chunk)
+    
+    def _search(self, query):
+        return VectorIndexStore.search(self.embedding_model, self.workspace.id, np.array(query), top_k=3)
+    
+    def test_readers_see_log_tail_before_checkpoint(self):
+        """Logged additions are searchable before the writer has written a snapshot."""
+        index_document_embeddings(self.document, self.embedding_model)
+        
+        hits = self._search([0.9, 0.0])
+        self.assertEqual(hits[0][0], self.chunks[1].id)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.vector_root, f'model_{self.embedding_model.id}', f'workspace_{self.workspace.id}', 'manifest.json'
+        )))
+    
+    def test_checkpoint_and_delete(self):
+        """A checkpoint persists the index atomically; deletions replay on top of it."""
+        index_document_embeddings(self.document, self.embedding_model)
+        # Replaying the same document twice must not duplicate vectors
+        index_document_embeddings(self.document, self.embedding_model)
+        self.assertEqual(VectorIndexStore.checkpoint(self.embedding_model, self.workspace.id), 2)
+        self.assertEqual(VectorIndexStore.pending_keys(), [])
+        
+        VectorIndexStore.clear_cache()
+        self.assertEqual(VectorIndexStore.get_index(self.embedding_model, self.workspace.id).ntotal, 3)
+        
+        VectorIndexStore.append(self.embedding_model, self.workspace.id, 'delete', [self.chunks[1].id])
+        self.assertNotIn(self.chunks[1].id, [chunk_id for chunk_id, _ in self._search([0.9, 0.0])])
+        self.assertEqual(VectorIndexStore.pending_keys(), [(self.embedding_model.id, self.workspace.id)])
+    
+    def test_late_committed_entry_is_replayed(self):
+        """An entry whose lower id only becomes visible after a higher one was applied still gets replayed."""
+        first, late, last = [
+            VectorIndexStore.append(self.embedding_model, self.workspace.id, 'add', [chunk.id])
+            for chunk in self.chunks
+        ]
+        # Hide the middle entry as if its transaction had not committed yet
+        late_id = late.id
+        late.delete()
+        index = VectorIndexStore.get_index(self.embedding_model, self.workspace.id)
+        self.assertEqual(index.ntotal, 2)
+        
+        VectorIndexLog.objects.create(
+            id=late_id, embedding_model=self.embedding_model, workspace=self.workspace,
+            op='add', chunk_ids=[self.chunks[1].id]
+        )
+        self.assertEqual(self._search([0.9, 0.0])[0][0], self.chunks[1].id)
+        # The tail is applied to the cached copy rather than a clone of it
+        self.assertIs(VectorIndexStore.get_index(self.embedding_model, self.workspace.id), index)
+        self.assertEqual(index.ntotal, 3)
+    
+    def test_document_delete_logs_removal_after_rows_are_gone(self):
+        """The 'delete' entry is logged after the document's rows are deleted, then removes its vectors."""
+        index_document_embeddings(self.document, self.embedding_model)
+        VectorIndexStore.rebuild(self.embedding_model, self.workspace.id)
+        client = APIClient()
+        client.force_authenticate(user=self.workspace.owner)
+        
+        chunk_ids = [chunk.id for chunk in self.chunks]
+        original_append = VectorIndexStore.append
+        
+        def append(*args, **kwargs):
+            self.assertFalse(Chunk.objects.filter(id__in=chunk_ids).exists())
+            return original_append(*args, **kwargs)
+        
+        with mock.patch.object(VectorIndexStore, 'append', side_effect=append) as logged, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.delete(f'/api/documents/{self.document.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        logged.assert_called_once()
+        self.assertEqual(self._search([0.9, 0.0]), [])
+    
+    def test_rebuild_keeps_other_indexes_log(self):
+        """A rebuild only trims its own index's log entries."""
+        other = Workspace.objects.create(name='Other', owner=self.workspace.owner)
+        VectorIndexStore.append(self.embedding_model, other.id, 'add', [self.chunks[0].id])
+        index_document_embeddings(self.document, self.embedding_model)
+        
+        VectorIndexStore.rebuild(self.embedding_model, self.workspace.id)
+        self.assertEqual(VectorIndexStore.pending_keys(), [(self.embedding_model.id, other.id)])
+    
+    def test_legacy_l2_snapshot_is_rebuilt_for_inner_product(self):
+        """A snapshot without a recorded metric is rebuilt; scores are then inner products."""
+        import json
+        
+        index_document_embeddings(self.document, self.embedding_model)
+        VectorIndexStore.checkpoint(self.embedding_model, self.workspace.id)
+        manifest_path = os.path.join(
+            self.vector_root, f'model_{self.embedding_model.id}', f'workspace_{self.workspace.id}', 'manifest.json'
+        )
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest.pop('metric'), 'ip')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        VectorIndexStore.clear_cache()
+        
+        hits = self._search([0.0, 1.0])
+        self.assertEqual(hits[0], (self.chunks[2].id, 5.0))
+        with open(manifest_path) as f:
+            self.assertEqual(json.load(f)['metric'], 'ip')
+    
+    def test_rebuild_is_workspace_scoped(self):
+        """Reindexing streams one workspace's embeddings in batches and leaves others alone."""
+        other = Workspace.objects.create(name='Other', owner=self.workspace.owner)
+        other_document = Document.objects.create(
+            workspace=other, title='Other', filename='o.pdf', file_path='o.pdf', file_size=1
+        )
+        other_chunk = Chunk.objects.create(document=other_document, chunk_index=0, text='other')
+        ChunkEmbedding.objects.create(chunk=other_chunk, embedding_model=self.embedding_model, vector=[3.0, 3.0])
+        index_document_embeddings(other_document, self.embedding_model)
+        
+        progress = []
+        with override_settings(VECTOR_INDEX_REBUILD_BATCH=2):
+            stats = VectorIndexStore.rebuild(self.embedding_model, self.workspace.id, on_progress=progress.append)
+        
+        self.assertEqual((stats['done'], stats['total']), (3, 3))
+        self.assertEqual([p['done'] for p in progress], [2, 3])
+        self.assertEqual(self._search([0.0, 4.0])[0][0], self.chunks[2].id)
+        self.assertEqual(VectorIndexStore.get_index(self.embedding_model, self.workspace.id).ntotal, 3)
+        # The other workspace's pending log entry survives and is still searchable
+        self.assertTrue(VectorIndexLog.objects.filter(workspace=other).exists())
+        hits = VectorIndexStore.search(self.embedding_model, other.id, np.array([3.0, 3.0]), top_k=1)
+        self.assertEqual(hits[0][0], other_chunk.id)
+
+
+@skipUnless(FAISS_AVAILABLE, 'faiss not installed')
+class EmbeddingMigrationTestCase(TestCase):
+    """Test background re-embedding onto a newly activated model."""
+    
+    def setUp(self):
+        vector_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, vector_root, ignore_errors=True)
+        override = override_settings(VECTOR_DB_PATH=vector_root, EMBEDDING_MIGRATION_BATCH_SIZE=2)
+        override.enable()
+        self.addCleanup(override.disable)
+        VectorIndexStore.clear_cache()
+        self.addCleanup(VectorIndexStore.clear_cache)
+        
+        user = User.objects.create_user(username='m', email='m@example.com', password='pass12345')
+        self.old_model = EmbeddingModel.objects.create(
+            name='old', version='1.0', model_path='old', dimension=2, is_active=True
+        )
+        self.new_model = EmbeddingModel.objects.create(name='new', version='1.0', model_path='new', dimension=3)
+        self.workspaces = []
+        for name in ['A', 'B']:
+            workspace = Workspace.objects.create(name=name, owner=user)
+            document = Document.objects.create(
+                workspace=workspace, title=name, filename='p.pdf', file_path='p.pdf', file_size=1
+            )
+            for i in range(3):
+                chunk = Chunk.objects.create(document=document, chunk_index=i, text=f'{name} {i}')
+                ChunkEmbedding.objects.create(chunk=chunk, embedding_model=self.old_model, vector=[float(i), 0.0])
+            self.workspaces.append(workspace)
+    
+    def test_workspaces_switch_once_covered(self):
+        """Each workspace keeps the old model until all its chunks have new vectors."""
+        from api.reembedding import EmbeddingMigrator
+        
+        with mock.patch('api.tasks.migrate_embeddings.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            migration = EmbeddingMigrator.start(self.new_model)
+        delay.assert_called_once_with(migration.id)
+        self.assertEqual((migration.total_chunks, migration.total_workspaces), (6, 2))
+        self.assertEqual(EmbeddingService.get_serving_embedding_model(self.workspaces[0].id), self.old_model)
+        self.new_model.refresh_from_db()
+        self.assertTrue(self.new_model.is_active)
+        
+        steps = 0
+        with mock.patch('api.reembedding.EmbeddingService.create_embeddings',
+                        side_effect=lambda texts, **kwargs: np.ones((len(texts), 3))):
+            while EmbeddingMigrator.step(migration):
+                steps += 1
+                if steps == 3:
+                    # First workspace embedded (2 batches) and switched; the second is untouched
+                    self.assertEqual(EmbeddingService.get_serving_embedding_model(self.workspaces[0].id), self.new_model)
+                    self.assertEqual(EmbeddingService.get_serving_embedding_model(self.workspaces[1].id), self.old_model)
+        
+        migration.refresh_from_db()
+        progress = EmbeddingMigrator.progress(migration)
+        self.assertEqual((progress['status'], progress['embedded_chunks'], progress['switched_workspaces']),
+                         ('completed', 6, 2))
+        self.assertEqual(progress['fraction_done'], 1.0)
+        self.assertEqual(VectorIndexStore.get_index(self.new_model, self.workspaces[1].id).ntotal, 3)
+
+
+class EmbeddingModelPoolTestCase(TestCase):
+    """Test the LRU embedding model pool."""
+    
+    def setUp(self):
+        patcher = mock.patch.object(EmbeddingModelPool, '_model_bytes', side_effect=lambda model: model['bytes'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = EmbeddingModelPool()
+    
+    def test_concurrent_requests_load_once(self):
+        """Threads asking for the same model share a single load."""
+        import threading
+        import time
+        
+        calls = []
+        
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'bytes': 10}
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.pool.get(1, loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+    
+    @override_settings(EMBEDDING_MODEL_POOL_MAX_MB=2)
+    def test_evicts_least_recently_used(self):
+        """Loading past the memory ceiling evicts the least recently used model."""
+        mb = 1024 * 1024
+        self.pool.get('a', lambda: {'bytes': mb})
+        self.pool.get('b', lambda: {'bytes': mb})
+        self.pool.get('a', lambda: self.fail('a should still be resident'))
+        self.pool.get('c', lambda: {'bytes': mb})
+        
+        stats = self.pool.stats()
+        self.assertEqual([m['key'] for m in stats['models']], ['a', 'c'])
+        self.assertEqual((stats['resident_bytes'], stats['evictions']), (2 * mb, 1))
+        # A model bigger than the ceiling is still kept while it is the one in use
+        self.pool.get('d', lambda: {'bytes': 3 * mb})
+        self.assertEqual([m['key'] for m in self.pool.stats()['models']], ['d'])
+
+
+class OnnxEmbeddingEncoderTestCase(TestCase):
+    """Test the ONNX Runtime embedding backend."""
+    
+    def test_mean_pooling_matches_input_order(self):
+        """Masked mean pooling and normalization are applied per text, in the caller's order."""
+        class FakeTokenizer:
+            def __call__(self, texts, **kwargs):
+                length = max(len(text.split()) for text in texts)
+                mask = np.array([[1] * len(t.split()) + [0] * (length - len(t.split())) for t in texts])
+                return {'input_ids': mask.copy(), 'attention_mask': mask}
+        
+        class FakeSession:
+            def get_inputs(self):
+                return [SimpleNamespace(name='input_ids'), SimpleNamespace(name='attention_mask')]
+            
+            def run(self, outputs, feeds):
+                # Token embedding i = [i + 1, 1]; padding tokens are large and must be masked out
+                batch, length = feeds['input_ids'].shape
+                tokens = np.stack([np.arange(1, length + 1), np.ones(length)], axis=-1).astype('float32')
+                tokens = np.repeat(tokens[None], batch, axis=0)
+                tokens[feeds['attention_mask'] == 0] = 1000.0
+                return [tokens]
+        
+        encoder = OnnxEmbeddingEncoder(FakeSession(), FakeTokenizer(), pooling='mean', normalize=False)
+        vectors = encoder.encode(['one', 'one two three', 'one two'], batch_size=2)
+        np.testing.assert_allclose(vectors, [[1.0, 1.0], [2.0, 1.0], [1.5, 1.0]])
+        
+        encoder.normalize = True
+        single = encoder.encode('one two three')
+        self.assertEqual(single.shape, (2,))
+        self.assertAlmostEqual(float(np.linalg.norm(single)), 1.0, places=5)
+    
+    @skipUnless(SENTENCE_TRANSFORMERS_AVAILABLE and ONNXRUNTIME_AVAILABLE, 'needs sentence-transformers and onnxruntime')
+    def test_parity_with_pytorch(self):
+        """The int8 ONNX export stays within cosine 0.98 of the PyTorch embeddings."""
+        from sentence_transformers import SentenceTransformer
+        
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        OnnxEmbeddingEncoder.export(settings.EMBEDDING_MODEL, output_dir)
+        
+        texts = [
+            'Transformers use self-attention to model long-range dependencies.',
+            'We evaluate retrieval-augmented generation on scientific question answering.',
+            'short',
+        ]
+        expected = SentenceTransformer(settings.EMBEDDING_MODEL).encode(texts, convert_to_numpy=True)
+        actual = OnnxEmbeddingEncoder.load(output_dir).encode(texts)
+        cosine = (expected * actual).sum(axis=1) / (
+            np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+        )
+        self.assertGreater(cosine.min(), 0.98)
+
+
+class EmbeddingServerTestCase(TestCase):
+    """Test the shared embedding server and its client."""
+    
+    def test_concurrent_requests_are_micro_batched(self):
+        """Concurrent create_embedding calls from many threads share encode calls and get their own rows."""
+        import threading
+        
+        encode_sizes = []
+        
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                encode_sizes.append(len(texts))
+                return np.array([[float(len(text)), 1.0] for text in texts])
+        
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir, ignore_errors=True)
+        socket_path = os.path.join(socket_dir, 'embed.sock')
+        
+        with mock.patch.object(EmbeddingServer, '_get_model', return_value=FakeModel()), \
+                override_settings(EMBEDDING_SERVER_SOCKET=socket_path, EMBEDDING_SERVER_FALLBACK=False):
+            server = EmbeddingServer(socket_path, max_batch_size=64, max_wait_ms=100)
+            server.start()
+            self.addCleanup(server.shutdown)
+            
+            results = {}
+            
+            def embed(i):
+                results[i] = EmbeddingService.create_embedding('x' * i)
+            
+            threads = [threading.Thread(target=embed, args=(i,)) for i in range(1, 9)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            batch = EmbeddingService.create_embeddings(['a', 'bbb'])
+        
+        for i, vector in results.items():
+            np.testing.assert_allclose(vector, EmbeddingService.normalize([float(i), 1.0]), rtol=1e-6)
+        np.testing.assert_allclose(batch, EmbeddingService.normalize([[1.0, 1.0], [3.0, 1.0]]), rtol=1e-6)
+        self.assertEqual(sum(encode_sizes), 10)
+        self.assertLess(len(encode_sizes), 9)
+    
+    def test_missing_backend_is_reported_to_the_client(self):
+        """A server without an embedding backend raises EmbeddingBackendUnavailable in the client, not a bare error."""
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir, ignore_errors=True)
+        socket_path = os.path.join(socket_dir, 'embed.sock')
+        
+        with mock.patch.object(EmbeddingServer, '_get_model',
+                               side_effect=EmbeddingBackendUnavailable('sentence-transformers not installed')), \
+                override_settings(EMBEDDING_SERVER_SOCKET=socket_path, EMBEDDING_SERVER_FALLBACK=False):
+            server = EmbeddingServer(socket_path, max_wait_ms=0)
+            server.start()
+            self.addCleanup(server.shutdown)
+            
+            with self.assertRaisesMessage(EmbeddingBackendUnavailable, 'sentence-transformers not installed'):
+                EmbeddingService.create_embeddings(['a'])
+        
+        with mock.patch.object(EmbeddingServer, '_get_model', side_effect=RuntimeError('CUDA out of memory')), \
+                override_settings(EMBEDDING_SERVER_SOCKET=socket_path, EMBEDDING_SERVER_FALLBACK=False):
+            with self.assertRaises(EmbeddingServerError) as raised:
+                EmbeddingService.create_embeddings(['a'])
+        self.assertEqual(raised.exception.error_type, 'RuntimeError')
+
+
+class ProcessWarmupTestCase(TestCase):
+    """Test preloading models and indexes before workers fork."""
+    
+    def setUp(self):
+        import gc
+        
+        self.addCleanup(gc.unfreeze)
+        user = User.objects.create_user(username='warmup', password='testpass123')
+        self.old_model = EmbeddingModel.objects.create(
+            name='old-model', version='1.0', model_path='old', dimension=4
+        )
+        self.active_model = EmbeddingModel.objects.create(
+            name='new-model', version='2.0', model_path='new', dimension=4, is_active=True
+        )
+        self.pinned = Workspace.objects.create(name='Pinned', owner=user, embedding_model=self.old_model)
+        self.unpinned = Workspace.objects.create(name='Unpinned', owner=user)
+    
+    @override_settings(EMBEDDING_SERVER_SOCKET='')
+    def test_preload_loads_serving_models_and_indexes(self):
+        """Each serving model is loaded once and each workspace's index from the model it is served by."""
+        import gc
+        
+        with mock.patch.object(EmbeddingService, 'get_model') as get_model, \
+                mock.patch.object(VectorIndexStore, 'get_index') as get_index, \
+                mock.patch('api.warmup.FAISS_AVAILABLE', True):
+            stats = ProcessWarmup.preload()
+        
+        self.assertEqual(
+            sorted(call.args[0].id for call in get_model.call_args_list),
+            sorted([self.old_model.id, self.active_model.id])
+        )
+        self.assertEqual(
+            sorted((call.args[0].id, call.args[1]) for call in get_index.call_args_list),
+            sorted([(self.old_model.id, self.pinned.id), (self.active_model.id, self.unpinned.id)])
+        )
+        self.assertEqual((stats['models'], stats['indexes'], stats['errors']), (2, 2, []))
+        self.assertGreater(gc.get_freeze_count(), 0)
+    
+    @override_settings(EMBEDDING_SERVER_SOCKET='/run/paperbot/embed.sock')
+    def test_preload_skips_models_served_elsewhere_and_reports_failures(self):
+        """Models stay in the embedding server; an index failure doesn't stop the warm-up."""
+        with mock.patch.object(EmbeddingService, 'get_model') as get_model, \
+                mock.patch.object(VectorIndexStore, 'get_index', side_effect=[Exception('corrupt'), None]), \
+                mock.patch('api.warmup.FAISS_AVAILABLE', True):
+            stats = ProcessWarmup.preload()
+        
+        get_model.assert_not_called()
+        self.assertEqual(stats['indexes'], 1)
+        self.assertEqual(len(stats['errors']), 1)
+
+
+class LazyImportTestCase(TestCase):
+    """Test that heavy dependencies stay off the startup path."""
+    
+    def test_lazy_module_imports_on_first_use(self):
+        """The module is imported on first attribute access; missing packages are reported, not raised."""
+        module = LazyModule('colorsys')
+        self.assertTrue(module.available)
+        self.assertFalse(module.loaded)
+        self.assertEqual(module.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertTrue(module.loaded)
+        
+        missing = LazyModule('paperbot_no_such_package')
+        self.assertFalse(missing.available)
+        with self.assertRaises(ImportError):
+            missing.load()
+    
+    def test_importing_views_and_tasks_skips_heavy_modules(self):
+        """Web and worker processes don't import torch, faiss or the LLM SDKs just by loading the app."""
+        import subprocess
+        import sys
+        
+        code = (
+            "import sys, django; django.setup()\n"
+            "import api.views, api.tasks\n"
+            "print(','.join(m for m in ('torch', 'sentence_transformers', 'faiss', 'openai', 'anthropic', 'onnxruntime')"
+            " if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='paperbot.settings')
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class StreamingAnswerTestCase(TestCase):
+    """Test server-sent-event answers for query and chat."""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='stream', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        self.chunk = Chunk.objects.create(document=document, chunk_index=0, text='Transformers use attention.')
+        self.chunk.score = 0.8
+        GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True
+        )
+        for target, kwargs in [
+            ('create_embedding', {'return_value': np.zeros(4)}),
+            ('search_similar_chunks', {'return_value': [(self.chunk, 0.8)]}),
+        ]:
+            patcher = mock.patch.object(EmbeddingService, target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(LLMService, '_stream_openai', return_value=iter(['Transformers ', 'use ', 'attention.']))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+    
+    @staticmethod
+    def _events(response):
+        import json
+        
+        events = []
+        for block in b''.join(response.streaming_content).decode().strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+    
+    def test_query_streams_tokens_then_citations(self):
+        """Tokens arrive as they are generated; citations and timing come last."""
+        response = self.client.post('/api/query/', {
+            'workspace_id': self.workspace.id, 'query': 'What do transformers use?', 'stream': True
+        }, format='json')
+        
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self._events(response)
+        self.assertEqual([name for name, _ in events], ['token', 'token', 'token', 'citations', 'done'])
+        self.assertEqual(''.join(data['text'] for name, data in events if name == 'token'), 'Transformers use attention.')
+        self.assertEqual(events[3][1]['retrieved_chunks'], [self.chunk.id])
+        self.assertEqual(events[3][1]['citations'][0]['score'], 0.8)
+        self.assertIsNotNone(events[4][1]['time_to_first_token_ms'])
+    
+    def test_chat_message_is_saved_when_stream_completes(self):
+        """The assistant message holds the full streamed answer once the stream is consumed."""
+        session = ChatSession.objects.create(user=self.user, workspace=self.workspace, title='Chat')
+        response = self.client.post(f'/api/chat/{session.id}/message/', {
+            'workspace_id': self.workspace.id, 'message': 'What do transformers use?', 'stream': True
+        }, format='json')
+        self.assertFalse(ChatMessage.objects.filter(session=session, role='assistant').exists())
+        
+        events = self._events(response)
+        assistant = ChatMessage.objects.get(session=session, role='assistant')
+        self.assertEqual(assistant.content, 'Transformers use attention.')
+        self.assertEqual(events[-2][1]['message_id'], assistant.id)
+        self.assertEqual(list(assistant.retrieved_chunks.all()), [self.chunk])
+
+
+@override_settings(OPENAI_API_KEY='test-key', OPENAI_BASE_URL='', LLM_MAX_CONCURRENCY=1, LLM_QUEUE_TIMEOUT_SECONDS=0.05)
+class LLMClientRegistryTestCase(TestCase):
+    """Test the shared, pooled LLM clients."""
+    
+    def setUp(self):
+        for name in ('openai', 'httpx'):
+            patcher = mock.patch(f'api.utils.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.openai.OpenAI.side_effect = lambda **kwargs: mock.Mock()
+        self.registry = LLMClientRegistry()
+    
+    def test_clients_are_reused_until_fork(self):
+        """One client per provider and process, over a keep-alive connection pool."""
+        client = self.registry.get('openai')
+        self.assertIs(self.registry.get('openai'), client)
+        self.openai.OpenAI.assert_called_once()
+        self.assertIs(self.openai.OpenAI.call_args.kwargs['http_client'], self.httpx.Client.return_value)
+        self.assertEqual(self.httpx.Limits.call_args.kwargs['max_keepalive_connections'], settings.LLM_POOL_CONNECTIONS)
+        
+        self.registry._pid = -1  # As seen from a forked child
+        self.assertIsNot(self.registry.get('openai'), client)
+        self.assertEqual(self.openai.OpenAI.call_count, 2)
+    
+    def test_async_clients_are_per_event_loop(self):
+        """Async clients are bound to the loop that created them."""
+        import asyncio
+        
+        async def get():
+            return self.registry.get('openai', is_async=True), self.registry.get('openai', is_async=True)
+        
+        first, again = asyncio.run(get())
+        second, _ = asyncio.run(get())
+        self.assertIs(first, again)
+        self.assertEqual(self.openai.AsyncOpenAI.call_count, 2)
+    
+    def test_clear_closes_async_clients_on_their_loop(self):
+        """Pooled async clients are closed too, on the loop that owns their connections."""
+        import asyncio
+        
+        self.openai.AsyncOpenAI.side_effect = lambda **kwargs: mock.Mock(close=mock.AsyncMock())
+        
+        async def get():
+            return self.registry.get('openai', is_async=True)
+        
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        idle = loop.run_until_complete(get())
+        sync = self.registry.get('openai')
+        
+        async def clear_while_running():
+            running = await get()
+            self.registry.clear()
+            await asyncio.sleep(0)  # Let the scheduled close run
+            return running
+        
+        running = asyncio.run(clear_while_running())
+        sync.close.assert_called_once()
+        idle.close.assert_awaited_once()
+        running.close.assert_awaited_once()
+        self.assertIsNot(self.registry.get('openai'), sync)
+    
+    def test_concurrency_is_bounded(self):
+        """A caller that can't get a slot in time fails fast instead of queueing forever."""
+        with self.registry.slot('openai'):
+            with self.assertRaisesMessage(Exception, 'Too many concurrent openai requests'):
+                with self.registry.slot('openai'):
+                    pass
+        with self.registry.slot('openai'):
+            pass
+    
+    @override_settings(OPENAI_API_KEY='')
+    def test_missing_key_keeps_fallback_message(self):
+        """generate_answer's fallback still recognises an unconfigured provider."""
+        with self.assertRaisesMessage(Exception, 'API key not configured'):
+            self.registry.get('openai')
+
+
+class MockLLMServerTestCase(TestCase):
+    """Test the offline mock provider used for benchmarking."""
+    
+    def test_keep_alive_requests_share_a_connection(self):
+        """Requests over one HTTP/1.1 connection count once; both provider shapes are served."""
+        import http.client
+        import json
+        
+        server = MockLLMServer(latency_ms=0).start()
+        self.addCleanup(server.shutdown)
+        connection = http.client.HTTPConnection(*server.base_url[len('http://'):].split(':'))
+        self.addCleanup(connection.close)
+        
+        for path, body in [
+            ('/v1/chat/completions', {'model': 'gpt', 'messages': []}),
+            ('/v1/messages', {'model': 'claude', 'messages': []}),
+            ('/v1/chat/completions', {'model': 'gpt', 'messages': [], 'stream': True}),
+        ]:
+            connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read().decode()
+            self.assertEqual(response.status, 200)
+        
+        self.assertTrue(data.rstrip().endswith('data: [DONE]'))
+        self.assertEqual((server.connections, server.requests), (1, 3))
+
+
+class AnswerCacheTestCase(TestCase):
+    """Test exact and semantic reuse of LLM answers."""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cache', password='testpass123')
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        self.chunks = [Chunk.objects.create(document=document, chunk_index=0, text='Transformers use attention.')]
+        self.embedding_model = EmbeddingModel.objects.create(name='e', version='1', dimension=4)
+        GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True
+        )
+        patcher = mock.patch.object(LLMService, '_call_openai', return_value='Attention [Document: Paper, Page: 1].')
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(VectorIndexStore, 'version', return_value=1)
+        self.version = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def _ask(self, query, embedding=None):
+        scope = AnswerCache.scope(self.workspace.id, self.embedding_model, embedding)
+        return LLMService.generate_answer(query, self.chunks, cache_scope=scope), scope
+    
+    def test_repeated_prompt_is_served_from_cache(self):
+        """The second identical question does not reach the LLM."""
+        (answer, citations), scope = self._ask('What do transformers use?')
+        self.assertIsNone(scope.hit)
+        self.assertEqual(self._ask('What do transformers use?')[0], (answer, citations))
+        self.call.assert_called_once()
+        
+        stats = AnswerCache.stats()
+        self.assertEqual((stats['exact_hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+        self.assertGreater(stats['saved_tokens'], 0)
+    
+    def test_similar_question_over_same_chunks_is_served_from_cache(self):
+        """A paraphrase whose embedding is close enough reuses the answer; a different one does not."""
+        first = EmbeddingService.normalize(np.array([1, 0, 0, 0], dtype='float32'))
+        close = EmbeddingService.normalize(np.array([1, 0.1, 0, 0], dtype='float32'))
+        far = EmbeddingService.normalize(np.array([0, 1, 0, 0], dtype='float32'))
+        self._ask('What do transformers use?', first)
+        
+        _, scope = self._ask('Which mechanism do transformers rely on?', close)
+        self.assertEqual(scope.hit, 'semantic')
+        _, scope = self._ask('How are transformers trained?', far)
+        self.assertIsNone(scope.hit)
+        self.assertEqual(self.call.call_count, 2)
+    
+    def test_index_writes_invalidate_answers(self):
+        """Answers cached before the workspace's index changed are not reused."""
+        self._ask('What do transformers use?')
+        self.version.return_value = 2
+        _, scope = self._ask('What do transformers use?')
+        self.assertIsNone(scope.hit)
+        self.assertEqual(self.call.call_count, 2)
+    
+    def test_async_answers_use_the_cache(self):
+        """agenerate_answer stores and reuses answers like generate_answer, exact and semantic."""
+        from asgiref.sync import async_to_sync
+        
+        first = EmbeddingService.normalize(np.array([1, 0, 0, 0], dtype='float32'))
+        close = EmbeddingService.normalize(np.array([1, 0.1, 0, 0], dtype='float32'))
+        
+        def ask(query, embedding):
+            scope = AnswerCache.scope(self.workspace.id, self.embedding_model, embedding)
+            return async_to_sync(LLMService.agenerate_answer)(query, self.chunks, cache_scope=scope), scope
+        
+        with mock.patch.object(LLMService, '_acall_openai', new_callable=mock.AsyncMock,
+                               return_value='Attention [Document: Paper, Page: 1].') as acall:
+            answer, scope = ask('What do transformers use?', first)
+            self.assertIsNone(scope.hit)
+            again, scope = ask('What do transformers use?', first)
+            self.assertEqual((again, scope.hit), (answer, 'exact'))
+            _, scope = ask('Which mechanism do transformers rely on?', close)
+            self.assertEqual(scope.hit, 'semantic')
+        acall.assert_called_once()
+        # The sync path shares the entries
+        self.assertEqual(self._ask('What do transformers use?', first)[0], answer)
+        self.call.assert_not_called()
+    
+    @override_settings(ANSWER_CACHE_ENABLED=False)
+    def test_disabled(self):
+        """With the cache off every question reaches the LLM."""
+        self.assertIsNone(AnswerCache.scope(self.workspace.id, self.embedding_model))
+
+
+@override_settings(SINGLE_FLIGHT_ENABLED=True, SINGLE_FLIGHT_POLL_MS=5)
+class SingleFlightTestCase(TestCase):
+    """Test coalescing of concurrent identical requests."""
+    
+    def setUp(self):
+        cache.clear()
+        self.key = SingleFlight.key('query', 1, 'What is attention?', 5)
+        self.follower_calls = []
+    
+    def _lead_with_follower(self, outcome):
+        """Run as leader; a duplicate request arrives while the leader is working."""
+        import threading
+        
+        results = []
+        
+        def follower():
+            self.follower_calls.append(1)
+            return 'own answer'
+        
+        def leader():
+            thread = threading.Thread(target=lambda: results.append(SingleFlight.run(self.key, follower)))
+            thread.start()
+            time.sleep(0.1)  # Let the follower find the lock and start waiting
+            self.follower_thread = thread
+            return outcome()
+        
+        try:
+            leader_result = SingleFlight.run(self.key, leader)
+        except RuntimeError:
+            leader_result = None
+        self.follower_thread.join(5)
+        return leader_result, results[0]
+    
+    def test_waiter_shares_the_leaders_result(self):
+        """A duplicate request in flight gets the first one's answer without doing the work."""
+        leader_result, follower_result = self._lead_with_follower(lambda: 'answer')
+        self.assertEqual(leader_result, ('answer', False))
+        self.assertEqual(follower_result, ('answer', True))
+        self.assertEqual(self.follower_calls, [])
+    
+    def test_waiter_takes_over_when_leader_fails(self):
+        """If the leader raises, a waiter runs the work itself rather than failing with it."""
+        def fail():
+            raise RuntimeError('LLM unavailable')
+        
+        leader_result, follower_result = self._lead_with_follower(fail)
+        self.assertIsNone(leader_result)
+        self.assertEqual(follower_result, ('own answer', False))
+        self.assertEqual(self.follower_calls, [1])
+    
+    def test_waiters_get_the_result_of_the_flight_in_progress(self):
+        """Every request that joins a running flight returns its result; the work runs once."""
+        import threading
+        
+        release = threading.Event()
+        calls, results = [], []
+        waiting = threading.Semaphore(0)
+        original_wait = SingleFlight._wait
+        
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return 'answer'
+        
+        def wait(*args):
+            waiting.release()  # This caller found the flight running and is now polling for it
+            return original_wait(*args)
+        
+        def request():
+            results.append(SingleFlight.run(self.key, work))
+        
+        with mock.patch.object(SingleFlight, '_wait', side_effect=wait):
+            leader = threading.Thread(target=request)
+            leader.start()
+            while not calls:
+                time.sleep(0.01)
+            waiters = [threading.Thread(target=request) for _ in range(3)]
+            for thread in waiters:
+                thread.start()
+            for _ in waiters:
+                self.assertTrue(waiting.acquire(timeout=5))
+            self.assertEqual(results, [])  # All joined while the leader is still working
+            
+            release.set()
+            for thread in [leader] + waiters:
+                thread.join(5)
+        
+        self.assertEqual(calls, [1])
+        self.assertEqual(sorted(results), [('answer', False)] + [('answer', True)] * 3)
+    
+    def test_finished_flights_are_not_reused(self):
+        """Coalescing only joins requests in flight; it is not a cache."""
+        self.assertEqual(SingleFlight.run(self.key, lambda: 'first'), ('first', False))
+        self.assertEqual(SingleFlight.run(self.key, lambda: 'second'), ('second', False))
+
+
+@override_settings(SUMMARY_CONTEXT_TOKENS=250, SUMMARY_MAP_CONCURRENCY=2)
+class MapReduceSummaryTestCase(TestCase):
+    """Test hierarchical summarization of chunks that exceed one prompt."""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='summary', password='testpass123')
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True
+        )
+        patcher = mock.patch.object(LLMService, '_call_openai', side_effect=self._respond)
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.partial = 'Part summary.'
+    
+    def _respond(self, model_id, prompt):
+        if prompt.startswith('Summarize this part'):
+            return self.partial
+        if prompt.startswith('Combine these summaries'):
+            return 'Combined.'
+        return 'Final summary.'
+    
+    def _chunks(self, documents, per_document=3, tokens=100):
+        chunks = []
+        for n in range(documents):
+            document = Document.objects.create(
+                workspace=self.workspace, title=f'Paper {n}', filename='p.pdf', file_path='p.pdf', file_size=1
+            )
+            chunks += [
+                Chunk.objects.create(document=document, chunk_index=i, text=f'Text {i}.', token_count=tokens)
+                for i in range(per_document)
+            ]
+        return chunks
+    
+    def _prompts(self, prefix):
+        return [c.args[1] for c in self.call.call_args_list if c.args[1].startswith(prefix)]
+    
+    def test_small_selection_uses_one_call(self):
+        """Chunks within the token budget are summarized in a single prompt."""
+        summary, _, citations = LLMService.generate_summary(self._chunks(1, per_document=2), 'short')
+        self.assertEqual(summary, 'Final summary.')
+        self.assertEqual(self.call.call_count, 1)
+        self.assertEqual(len(citations), 1)
+    
+    def test_large_selection_is_mapped_per_document_and_cached(self):
+        """Groups fit the budget by token_count; partial summaries are reused on the next request."""
+        chunks = self._chunks(2)
+        summary, _, citations = LLMService.generate_summary(chunks, 'short')
+        
+        self.assertEqual(summary, 'Final summary.')
+        self.assertEqual(len(self._prompts('Summarize this part')), 4)  # 2 documents x (200 + 100 tokens)
+        final = self._prompts('Provide a brief summary')[0]
+        self.assertIn('[Document: Paper 0]\nPart summary.\nPart summary.', final)
+        self.assertEqual([c['document_title'] for c in citations], ['Paper 0', 'Paper 1'])
+        
+        self.call.reset_mock()
+        LLMService.generate_summary(chunks, 'related_work')
+        self.assertEqual(self.call.call_count, 1)
+    
+    def test_partials_over_budget_are_reduced(self):
+        """Partial summaries that together exceed the budget are merged before the final call."""
+        self.partial = 'x' * 400  # ~100 tokens per document
+        LLMService.generate_summary(self._chunks(3, per_document=1, tokens=200), 'detailed')
+        self.assertEqual(len(self._prompts('Combine these summaries')), 1)
+        self.assertIn('Combined.', self._prompts('Provide a detailed summary')[0])
+
+
+class DocumentSummaryTestCase(TestCase):
+    """Test ingest-time document summaries and their use by /api/summarize/."""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='digest', password='testpass123')
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        self.documents = [
+            Document.objects.create(
+                workspace=self.workspace, title=f'Paper {n}', filename='p.pdf', file_path='p.pdf',
+                file_size=1, status='indexed'
+            )
+            for n in range(2)
+        ]
+        for document in self.documents:
+            Chunk.objects.create(document=document, chunk_index=0, text=f'Raw text of {document.title}.')
+        self.generation_model = GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True
+        )
+        EmbeddingModel.objects.create(name='e', version='1', dimension=4, is_active=True)
+        patcher = mock.patch.object(
+            LLMService, '_call_openai', return_value='Summary: Short summary.\nMethodology: Trained on data.'
+        )
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(EmbeddingService, 'create_embedding', return_value=np.ones(4) / 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def _chunks(self):
+        return list(Chunk.objects.filter(document__in=self.documents).select_related('document'))
+    
+    def test_summary_is_stored_and_embedded(self):
+        """The digest is split into summary and methodology and stored per generation model."""
+        document_summary = save_document_summary(self.documents[0])
+        self.assertEqual(document_summary.summary, 'Short summary.')
+        self.assertEqual(document_summary.methodology, 'Trained on data.')
+        self.assertEqual(document_summary.generation_model, self.generation_model)
+        self.assertEqual(document_summary.vector, [0.5] * 4)
+        
+        save_document_summary(self.documents[0])
+        self.assertEqual(DocumentSummary.objects.filter(document=self.documents[0]).count(), 1)
+    
+    def test_summarize_uses_digests(self):
+        """With a current digest per document, summarizing N documents is one call over the digests."""
+        for document in self.documents:
+            save_document_summary(document)
+        self.call.reset_mock()
+        
+        LLMService.generate_summary(self._chunks(), 'short')
+        self.call.assert_called_once()
+        prompt = self.call.call_args.args[1]
+        self.assertIn('[Document: Paper 1]\nShort summary.\nMethodology: Trained on data.', prompt)
+        self.assertNotIn('Raw text', prompt)
+    
+    def test_rechunked_document_falls_back_to_chunks(self):
+        """A digest built from other chunks is ignored until regenerated."""
+        for document in self.documents:
+            save_document_summary(document)
+        Chunk.objects.create(document=self.documents[1], chunk_index=1, text='New text.')
+        self.call.reset_mock()
+        
+        LLMService.generate_summary(self._chunks(), 'short')
+        self.assertIn('Raw text of Paper 0.', self.call.call_args.args[1])
+
+
+class SummaryJobTestCase(TestCase):
+    """Test background summarization jobs."""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='jobs', email='jobs@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        self.document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1, status='indexed'
+        )
+        Chunk.objects.create(document=self.document, chunk_index=0, text='Transformers use attention.')
+        GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True
+        )
+        patcher = mock.patch.object(LLMService, '_call_openai', return_value='A short summary.')
+        self.call = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def _submit(self, **extra):
+        with mock.patch('api.tasks.run_summary_job.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/summarize/', {
+                'workspace_id': self.workspace.id, 'document_ids': [self.document.id], 'background': True, **extra
+            }, format='json')
+        return response, delay
+    
+    def test_background_request_returns_job_and_result_is_polled(self):
+        """The request returns before any LLM call; the status endpoint serves the result."""
+        response, delay = self._submit()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = SummaryJob.objects.get(id=response.data['job_id'])
+        delay.assert_called_once_with(job.id)
+        self.assertTrue(response.data['status_url'].endswith(f'/api/summarize/jobs/{job.id}/'))
+        self.call.assert_not_called()
+        
+        self.assertEqual(self.client.get(response.data['status_url']).data['status'], 'queued')
+        SummaryJobs.run(job)
+        data = self.client.get(response.data['status_url']).data
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual(data['result']['summary'], 'A short summary.')
+        self.assertEqual(data['result']['document_ids'], [self.document.id])
+    
+    def test_jobs_are_private(self):
+        """Another user's job is not found."""
+        job = SummaryJob.objects.create(user=self.user, workspace=self.workspace, document_ids=[self.document.id])
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(f'/api/summarize/jobs/{job.id}/').status_code, status.HTTP_404_NOT_FOUND)
+    
+    @override_settings(SUMMARY_WEBHOOK_ALLOWED_HOSTS=['hooks.example.com'])
+    def test_webhook_host_must_be_allowed(self):
+        """Webhooks only go to configured hosts."""
+        response, delay = self._submit(webhook_url='http://10.0.0.1/hook')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        delay.assert_not_called()
+    
+    def test_webhook_to_internal_address_is_rejected(self):
+        """Loopback, private and link-local hosts and non-http schemes are refused even without an allowlist."""
+        for url in ['http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://169.254.169.254/latest',
+                    'http://192.168.1.10/hook', 'ftp://hooks.example.com/hook']:
+            response, delay = self._submit(webhook_url=url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+            delay.assert_not_called()
+        
+        job = SummaryJob.objects.create(
+            user=self.user, workspace=self.workspace, document_ids=[self.document.id],
+            webhook_url='http://127.0.0.1/hook'
+        )
+        with self.assertRaises(WebhookNotAllowed):
+            SummaryJobs.deliver(job)
+    
+    def test_disallowed_webhook_is_not_retried(self):
+        """A webhook URL that is not allowed fails delivery once, recording why, instead of retrying."""
+        from api.tasks import deliver_summary_webhook
+        
+        job = SummaryJob.objects.create(
+            user=self.user, workspace=self.workspace, document_ids=[self.document.id],
+            webhook_url='http://127.0.0.1/hook'
+        )
+        with mock.patch.object(deliver_summary_webhook, 'retry') as retry:
+            deliver_summary_webhook.apply(args=(job.id,))
+        retry.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.webhook_error, 'webhook_url is not allowed')
+        self.assertIsNone(job.webhook_delivered_at)
+    
+    def test_webhook_connects_to_the_checked_address(self):
+        """Delivery connects to the address that passed the checks, keeping the hostname in the Host header."""
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        
+        received = {}
+        
+        class Receiver(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received['host'] = self.headers['Host']
+                self.send_response(204)
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        server = HTTPServer(('127.0.0.1', 0), Receiver)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        self.addCleanup(server.server_close)
+        
+        port = server.server_address[1]
+        job = SummaryJobs.run(SummaryJob.objects.create(
+            user=self.user, workspace=self.workspace, document_ids=[self.document.id],
+            webhook_url=f'http://hooks.invalid:{port}/hook'
+        ))
+        # .invalid never resolves, so resolving the host again would fail delivery
+        with mock.patch.object(SummaryJobs, '_public_addresses', return_value=['127.0.0.1']):
+            SummaryJobs.deliver(job)
+        
+        self.assertEqual(received['host'], f'hooks.invalid:{port}')
+        job.refresh_from_db()
+        self.assertIsNotNone(job.webhook_delivered_at)
+    
+    def test_webhook_redirects_are_not_followed(self):
+        """A receiver answering with a redirect fails delivery instead of forwarding the body."""
+        import threading
+        from urllib.error import HTTPError
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        
+        requests = []
+        
+        class Redirector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests.append(self.path)
+                self.send_response(307)
+                self.send_header('Location', '/internal')
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        server = HTTPServer(('127.0.0.1', 0), Redirector)
+        server.timeout = 1
+        threading.Thread(target=lambda: [server.handle_request() for _ in range(2)], daemon=True).start()
+        self.addCleanup(server.server_close)
+        
+        job = SummaryJobs.run(SummaryJob.objects.create(
+            user=self.user, workspace=self.workspace, document_ids=[self.document.id],
+            webhook_url=f'http://127.0.0.1:{server.server_address[1]}/hook'
+        ))
+        # The test receiver is on loopback; only the redirect handling is under test here
+        with mock.patch.object(SummaryJobs, '_public_addresses', return_value=['127.0.0.1']), \
+                self.assertRaises(HTTPError):
+            SummaryJobs.deliver(job)
+        
+        self.assertEqual(requests, ['/hook'])
+        job.refresh_from_db()
+        self.assertIsNone(job.webhook_delivered_at)
+    
+    @override_settings(SUMMARY_WEBHOOK_SECRET='s3cret')
+    def test_webhook_receives_signed_result(self):
+        """A finished job is POSTed to its webhook with an HMAC signature of the body."""
+        import hashlib
+        import hmac
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        
+        received = {}
+        
+        class Receiver(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received['body'] = self.rfile.read(int(self.headers['Content-Length']))
+                received['signature'] = self.headers['X-Paperbot-Signature']
+                self.send_response(204)
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        server = HTTPServer(('127.0.0.1', 0), Receiver)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        self.addCleanup(server.server_close)
+        
+        job = SummaryJobs.run(SummaryJob.objects.create(
+            user=self.user, workspace=self.workspace, document_ids=[self.document.id],
+            webhook_url=f'http://127.0.0.1:{server.server_address[1]}/hook'
+        ))
+        # The test receiver is on loopback
+        with mock.patch.object(SummaryJobs, '_public_addresses', return_value=['127.0.0.1']):
+            SummaryJobs.deliver(job)
+        
+        expected = hmac.new(b's3cret', received['body'], hashlib.sha256).hexdigest()
+        self.assertEqual(received['signature'], f'sha256={expected}')
+        self.assertEqual(json.loads(received['body'])['result']['summary'], 'A short summary.')
+        job.refresh_from_db()
+        self.assertIsNotNone(job.webhook_delivered_at)
+
+
+class ContextPackerTestCase(TestCase):
+    """Test token-budgeted packing of retrieved chunks into prompt context."""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='packer', email='packer@example.com', password='testpass123')
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        self.document = self._document('Paper')
+    
+    def _document(self, title):
+        return Document.objects.create(
+            workspace=self.workspace, title=title, filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+    
+    def _chunk(self, document, index, text, score, **kwargs):
+        chunk = Chunk.objects.create(document=document, chunk_index=index, text=text, **kwargs)
+        chunk.score = score
+        return chunk
+    
+    def test_adjacent_chunks_are_merged_without_overlap(self):
+        """Consecutive hits become one passage and the repeated overlap appears once."""
+        chunks = [
+            self._chunk(self.document, 1, 'the encoder stacks six layers. Decoders mirror it.', 0.7, page_number=3),
+            self._chunk(self.document, 0, 'Attention is all you need: the encoder stacks six layers.', 0.9, page_number=2),
+        ]
+        context, used = ContextPacker.pack(chunks)
+        self.assertEqual(context, (
+            '[Document: Paper, Page: 2]\n'
+            'Attention is all you need: the encoder stacks six layers. Decoders mirror it.'
+        ))
+        self.assertEqual(used, chunks)
+    
+    def test_passages_are_ordered_by_score_within_budget(self):
+        """The best passages come first; lower-scoring ones that don't fit are left out and not citable."""
+        weak = self._chunk(self.document, 0, 'w' * 400, 0.3)
+        strong = self._chunk(self._document('Other'), 0, 's' * 400, 0.8)
+        context, used = ContextPacker.pack([weak, strong])
+        self.assertLess(context.index('Other'), context.index('Paper'))
+        
+        context, used = ContextPacker.pack([weak, strong], token_budget=150)
+        self.assertEqual(used, [strong])
+        self.assertNotIn('w' * 10, context)
+    
+    def test_oversized_section_falls_back_to_its_hits(self):
+        """A section over the remaining budget is replaced by the chunks that matched."""
+        section = Section.objects.create(document=self.document, section_index=0, title='2 Method', text='x' * 4000)
+        hit = self._chunk(self.document, 0, 'The method in brief.', 0.9, section=section)
+        context, used = ContextPacker.pack([hit], token_budget=200)
+        self.assertIn('The method in brief.', context)
+        self.assertNotIn('x' * 10, context)
+    
+    def test_answer_prompt_respects_model_budget(self):
+        """generate_answer packs context to the active model's context_token_budget."""
+        GenerationModel.objects.create(
+            name='gpt', version='1', provider='openai', model_id='gpt-4o-mini', is_active=True, context_token_budget=120
+        )
+        chunks = [self._chunk(self._document(f'Paper {n}'), 0, f'{n}' * 400, 0.9 - n / 10) for n in range(3)]
+        with mock.patch.object(LLMService, '_call_openai', return_value='Answer from Paper 0.') as call:
+            _, citations = LLMService.generate_answer('What?', chunks)
+        prompt = call.call_args.args[1]
+        self.assertIn('[Document: Paper 0, Page: N/A]', prompt)
+        self.assertNotIn('Paper 1', prompt)
+        self.assertEqual([c['document_title'] for c in citations], ['Paper 0'])
+
+
+@override_settings(FALLBACK_ANSWER_SENTENCES=2)
+class ExtractiveAnswerTestCase(TestCase):
+    """Test LLM-free answers built from the most similar sentences."""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='extract', email='extract@example.com', password='testpass123')
+        self.workspace = Workspace.objects.create(name='W', owner=self.user)
+        document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1
+        )
+        self.chunks = [
+            Chunk.objects.create(document=document, chunk_index=0, page_number=1, text=(
+                'We study sequence transduction models. The model relies entirely on attention mechanisms.'
+            )),
+            Chunk.objects.create(document=document, chunk_index=1, page_number=2, text=(
+                'The model relies entirely on attention mechanisms. Training took three days on eight GPUs. '
+                'Self-attention relates positions of a single sequence.'
+            )),
+        ]
+        patcher = mock.patch.object(EmbeddingService, 'create_embeddings', side_effect=self._embed)
+        self.create_embeddings = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    @staticmethod
+    def _embed(texts, **kwargs):
+        """Topic vectors: attention, training, anything else."""
+        vectors = [[1, 0, 0] if 'attention' in t else [0, 1, 0] if 'Training' in t else [0, 0, 1] for t in texts]
+        return EmbeddingService.normalize(np.array(vectors, dtype='float32'))
+    
+    def test_top_sentences_are_quoted_with_exact_citations(self):
+        """The most similar sentences are returned once each, cited to their chunk and page."""
+        self.assertEqual(len(ExtractiveAnswerer.sentences(self.chunks)), 4)  # The overlapping sentence counts once
+        
+        answer, citations = LLMService._generate_fallback_answer(
+            'How does the model work?', self.chunks, query_embedding=np.array([1, 0, 0], dtype='float32')
+        )
+        self.assertEqual([c['snippet'] for c in citations], [
+            'The model relies entirely on attention mechanisms.',
+            'Self-attention relates positions of a single sequence.',
+        ])
+        self.assertEqual([c['page_number'] for c in citations], [1, 2])
+        self.assertIn('- The model relies entirely on attention mechanisms. [Document: Paper, Page: 1]', answer)
+        self.assertNotIn('three days', answer)
+        self.create_embeddings.assert_called_once()
+    
+    def test_query_is_embedded_with_the_sentences(self):
+        """Without a retrieval vector, the query is embedded in the same batch."""
+        _, citations = LLMService._generate_fallback_answer('How long did Training take?', self.chunks)
+        self.assertEqual(citations[0]['snippet'], 'Training took three days on eight GPUs.')
+        self.assertEqual(self.create_embeddings.call_args.args[0][0], 'How long did Training take?')
+    
+    def test_snippets_without_embedding_backend(self):
+        """If sentences can't be embedded, the answer falls back to leading snippets."""
+        self.create_embeddings.side_effect = EmbeddingBackendUnavailable('sentence-transformers not installed')
+        with self.assertLogs('api.utils', 'WARNING'):
+            answer, citations = LLMService._generate_fallback_answer('How does the model work?', self.chunks)
+        self.assertIn('**Paper**', answer)
+        self.assertEqual(len(citations), 1)
+    
+    def test_other_errors_are_not_hidden(self):
+        """Only a missing embedding backend falls back; other failures propagate."""
+        self.create_embeddings.side_effect = ValueError('shapes (2,3) and (4,) not aligned')
+        with self.assertRaises(ValueError):
+            LLMService._generate_fallback_answer('How does the model work?', self.chunks)
+
+
+class TextRankSummaryTestCase(TestCase):
+    """Test LLM-free summaries ranked by TextRank over stored chunk embeddings."""
+    
+    VECTORS = [[1.0, 0.0, 0.0], [0.9, 0.1, 0.0], [0.95, 0.05, 0.0], [0.0, 0.0, 1.0]]
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='textrank', email='textrank@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.embedding_model = EmbeddingModel.objects.create(
+            name='test-model', version='1.0', model_path='test', dimension=3, is_active=True
+        )
+        self.workspace = Workspace.objects.create(name='W', owner=self.user, embedding_model=self.embedding_model)
+        self.document = Document.objects.create(
+            workspace=self.workspace, title='Paper', filename='p.pdf', file_path='p.pdf', file_size=1, status='indexed'
+        )
+        self.chunks = []
+        for i, vector in enumerate(self.VECTORS):
+            chunk = Chunk.objects.create(document=self.document, chunk_index=i, page_number=i + 1, text=f'Passage {i}.')
+            ChunkEmbedding.objects.create(chunk=chunk, embedding_model=self.embedding_model, vector=vector)
+            self.chunks.append(chunk)
+        patcher = mock.patch.object(EmbeddingService, 'create_embeddings')
+        self.create_embeddings = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_rank_favours_central_chunks(self):
+        """Chunks similar to many others outrank an unrelated one; scores sum to 1."""
+        scores = TextRankSummarizer.rank(TextRankSummarizer.chunk_vectors(self.chunks))
+        self.assertAlmostEqual(float(scores.sum()), 1.0, places=4)
+        self.assertEqual(int(np.argmin(scores)), 3)
+        self.create_embeddings.assert_not_called()  # Every vector was stored
+    
+    @override_settings(SUMMARY_EXTRACTIVE_PASSAGES=2, SUMMARY_EXTRACTIVE_DIVERSITY=1.0)
+    def test_redundant_passages_are_skipped(self):
+        """With a diversity penalty the second pick is the unrelated chunk, not a near-duplicate."""
+        summary, related_work, citations = TextRankSummarizer.summarize(self.chunks)
+        self.assertEqual(related_work, '')
+        self.assertEqual(len(citations), 2)
+        self.assertIn(self.chunks[3].id, [c['chunk_id'] for c in citations])
+        self.assertIn('- Passage 3. [Document: Paper, Page: 4]', summary)
+        
+        with self.settings(SUMMARY_EXTRACTIVE_DIVERSITY=0.0):
+            _, _, citations = TextRankSummarizer.summarize(self.chunks)
+        self.assertNotIn(self.chunks[3].id, [c['chunk_id'] for c in citations])
+    
+    def test_missing_vectors_are_embedded_in_one_batch(self):
+        """Only chunks without a stored vector are embedded."""
+        ChunkEmbedding.objects.filter(chunk=self.chunks[3]).delete()
+        self.create_embeddings.return_value = np.array([[0.0, 0.0, 1.0]], dtype='float32')
+        scores = TextRankSummarizer.rank(TextRankSummarizer.chunk_vectors(self.chunks))
+        self.create_embeddings.assert_called_once()
+        self.assertEqual(self.create_embeddings.call_args.args[0], ['Passage 3.'])
+        self.assertEqual(int(np.argmin(scores)), 3)
+    
+    def test_extractive_summary_type_needs_no_llm(self):
+        """summary_type=extractive works with no generation model configured."""
+        self.assertFalse(GenerationModel.objects.filter(is_active=True).exists())
+        response = self.client.post('/api/summarize/', {
+            'workspace_id': self.workspace.id,
+            'document_ids': [self.document.id],
+            'summary_type': 'extractive'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['summary'].startswith('**Paper**:'))
+        self.assertEqual(len(response.data['citations']), settings.SUMMARY_EXTRACTIVE_PASSAGES)
+        self.assertIsNone(response.data['related_work'])
+    
+    def test_fallback_summary_quotes_central_passages(self):
+        """Without an LLM, related_work summaries put each document's next picks in the related work section."""
+        summary, related_work, citations = LLMService._generate_fallback_summary(self.chunks, 'related_work')
+        self.assertIn('extractive summary', summary)
+        self.assertEqual(summary.count('- Passage'), 1)
+        self.assertEqual(related_work.count('- Passage'), settings.SUMMARY_EXTRACTIVE_PASSAGES - 1)
+        self.assertEqual(len(citations), settings.SUMMARY_EXTRACTIVE_PASSAGES)
+    
+    def test_fallback_summary_without_embedding_model(self):
+        """With no embedding model to rank with, the fallback quotes leading excerpts and logs why."""
+        Workspace.objects.filter(id=self.workspace.id).update(embedding_model=None)
+        EmbeddingModel.objects.update(is_active=False)
+        with self.assertLogs('api.utils', 'WARNING'):
+            summary, _, citations = LLMService._generate_fallback_summary(self.chunks, 'short')
+        self.assertIn('fallback summary', summary)
+        self.assertEqual(len(citations), 1)
+    
+    def test_ranking_errors_are_not_hidden(self):
+        """Failures other than a missing embedding model propagate from the fallback."""
+        with mock.patch.object(TextRankSummarizer, 'rank', side_effect=ValueError('bad graph')), \
+                self.assertRaises(ValueError):
+            LLMService._generate_fallback_summary(self.chunks, 'short')
@@ -3,7 +3,10 @@ URLs for API app.
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DocumentViewSet, ChatSessionViewSet, query, summarize
+from .views import (
+    DocumentViewSet, ChatSessionViewSet, query, summarize, summary_job, ingestion_queues, embedding_migrations,
+    answer_cache_stats
+)
 
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet, basename='document')
@@ -12,6 +15,10 @@ router.register(r'chat', ChatSessionViewSet, basename='chat')
 urlpatterns = [
     path('query/', query, name='query'),
     path('summarize/', summarize, name='summarize'),
+    path('summarize/jobs/<int:job_id>/', summary_job, name='summary-job'),
+    path('ingestion/queues/', ingestion_queues, name='ingestion-queues'),
+    path('embeddings/migrations/', embedding_migrations, name='embedding-migrations'),
+    path('cache/answers/', answer_cache_stats, name='answer-cache-stats'),
     path('', include(router.urls)),
 ]
 
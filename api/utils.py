@@ -2,65 +2,81 @@
 Utility functions for PDF processing, embeddings, and LLM interactions.
 """
 import os
+import re
 import json
+import logging
+import hashlib
+import bisect
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import asyncio
+import itertools
+import threading
+import weakref
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
-from pdfminer.high_level import extract_text
-from pdfminer.layout import LAParams
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
-    SentenceTransformer = None
-
-try:
-    import faiss
-    FAISS_AVAILABLE = True
-except ImportError:
-    FAISS_AVAILABLE = False
-    faiss = None
-
+from typing import Callable, List, Dict, Tuple, Optional, Iterator, IO
+from pdfminer.high_level import extract_text, extract_pages
+from pdfminer.layout import LAParams, LTTextContainer
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from core.models import EmbeddingModel, GenerationModel, Chunk, ChunkEmbedding
+from django.core.cache import cache
+from core.models import Workspace, EmbeddingModel, GenerationModel, Chunk, ChunkEmbedding, DocumentSummary
+from .lazy import LazyModule
+from .vector_index import VectorIndexStore
+from .embedding_server import EmbeddingClient
+
+# Heavy optional dependencies are imported on first use, not at startup
+sentence_transformers = LazyModule('sentence_transformers')
+SENTENCE_TRANSFORMERS_AVAILABLE = sentence_transformers.available
+
+onnxruntime = LazyModule('onnxruntime')
+ONNXRUNTIME_AVAILABLE = onnxruntime.available
+
+openai = LazyModule('openai')
+OPENAI_AVAILABLE = openai.available
+
+anthropic = LazyModule('anthropic')
+ANTHROPIC_AVAILABLE = anthropic.available
+
+httpx = LazyModule('httpx')  # Connection pools for the LLM SDKs, which depend on it
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    openai = None
+logger = logging.getLogger(__name__)
 
-try:
-    from anthropic import Anthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
-    Anthropic = None
+
+class EmbeddingBackendUnavailable(Exception):
+    """No embedding model can be loaded here (backend not installed or not exported)."""
 
 
 class PDFProcessor:
     """Handle PDF text extraction."""
     
+    # Heading patterns: numbered ("2.1 Related Work", "IV. RESULTS") or well-known section names
+    NUMBERED_HEADING_RE = re.compile(r'^(?:\d{1,2}(?:\.\d{1,2}){0,3}\.?|[IVX]{1,5}\.)\s+[A-Z][^\n]{1,80}$')
+    NAMED_HEADING_RE = re.compile(
+        r'^(?:abstract|introduction|background|related work|prior work|preliminaries|'
+        r'methods?|methodology|materials and methods|approach|experiments?|experimental setup|'
+        r'evaluation|results|discussion|limitations|future work|conclusions?|'
+        r'acknowledge?ments|references|bibliography|appendix(?: [A-Z0-9])?)$',
+        re.IGNORECASE
+    )
+    
     @staticmethod
     def extract_text_from_pdf(file_path: str) -> Tuple[str, Dict]:
         """Extract text and metadata from PDF."""
         try:
-            text = extract_text(
-                file_path,
-                laparams=LAParams(
-                    line_margin=0.5,
-                    word_margin=0.1,
-                    char_margin=2.0,
-                    boxes_flow=0.5
-                )
-            )
+            text = extract_text(file_path, laparams=PDFProcessor._laparams())
             
             # Basic metadata extraction
             metadata = {
                 'pages': PDFProcessor._count_pages(file_path),
                 'char_count': len(text),
+                'sections': PDFProcessor.detect_headings(text),
             }
             
             return text, metadata
@@ -104,27 +120,479 @@ class PDFProcessor:
                 'chunk_index': chunk_index,
             })
             
+            if end >= len(text):
+                break
             start = end - overlap
             chunk_index += 1
         
         return chunks
+    
+    @staticmethod
+    def estimate_token_count(text: str) -> int:
+        """Rough token estimate (~4 characters per token for English text)."""
+        return max(1, len(text) // 4) if text else 0
+    
+    @classmethod
+    def detect_headings(cls, text: str) -> List[Dict]:
+        """Detect section headings in extracted text, returning their titles and offsets."""
+        headings = []
+        offset = 0
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            line_start = offset + (len(line) - len(line.lstrip()))
+            offset += len(line)
+            if not stripped or len(stripped) > 100 or stripped.endswith(('.', ',', ';', ':')):
+                continue
+            words = stripped.split()
+            is_heading = (
+                (len(words) <= 12 and cls.NUMBERED_HEADING_RE.match(stripped) is not None)
+                or cls.NAMED_HEADING_RE.match(stripped) is not None
+                or (2 <= len(words) <= 8 and stripped.isupper() and sum(c.isalpha() for c in stripped) > len(stripped) * 0.6)
+            )
+            if is_heading:
+                headings.append({'title': stripped[:500], 'start_char': line_start})
+        return headings
+    
+    @staticmethod
+    def chunk_hierarchical(text: str, chunk_size: int = 500, overlap: int = 100,
+                           section_max_chars: int = 4000) -> List[Dict]:
+        """
+        Split text into section-level parents, each holding small overlapping leaf chunks.
+        
+        Pages are delimited by form feeds, as produced by pdfminer.
+        """
+        chunker = HierarchicalChunker(chunk_size=chunk_size, overlap=overlap, section_max_chars=section_max_chars)
+        sections = []
+        for page_text in PDFProcessor.split_pages(text):
+            sections.extend(chunker.feed(page_text))
+        sections.extend(chunker.finish())
+        return sections
+    
+    @staticmethod
+    def split_pages(text: str) -> List[str]:
+        """Split extracted text into pages, keeping each page's trailing form feed."""
+        return re.findall(r'[^\f]*\f|[^\f]+$', text)
+    
+    @staticmethod
+    def iter_archive_pdfs(archive: IO[bytes]) -> Iterator[Tuple[str, IO[bytes], int]]:
+        """
+        Yield ``(filename, file object, size)`` for each PDF in a zip or tar archive.
+        
+        Each member is decompressed into a spooled temporary file (in memory up
+        to ``FILE_UPLOAD_MAX_MEMORY_SIZE``, then on disk) before it is yielded.
+        A corrupt member therefore raises here, before the caller has written
+        any of it to storage.
+        """
+        if zipfile.is_zipfile(archive):
+            archive.seek(0)
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or info.filename.startswith('__MACOSX/') or not name.lower().endswith('.pdf'):
+                        continue
+                    with zf.open(info) as member, PDFProcessor._spool(member) as copy:
+                        yield name, copy, info.file_size
+            return
+        
+        archive.seek(0)
+        try:
+            tf = tarfile.open(fileobj=archive, mode='r:*')
+        except tarfile.TarError:
+            raise ValueError("Archive must be a zip or tar file")
+        with tf:
+            for info in tf:
+                name = os.path.basename(info.name)
+                if not info.isfile() or not name.lower().endswith('.pdf'):
+                    continue
+                member = tf.extractfile(info)
+                if member is not None:
+                    with PDFProcessor._spool(member) as copy:
+                        yield name, copy, info.size
+    
+    @staticmethod
+    def _spool(member: IO[bytes]) -> IO[bytes]:
+        """Fully read an archive member into a rewound temporary file."""
+        copy = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        shutil.copyfileobj(member, copy)
+        copy.seek(0)
+        return copy
+    
+    @staticmethod
+    def _laparams() -> LAParams:
+        """Layout analysis parameters shared by whole-document and per-page extraction."""
+        return LAParams(
+            line_margin=0.5,
+            word_margin=0.1,
+            char_margin=2.0,
+            boxes_flow=0.5
+        )
+    
+    @classmethod
+    def iter_pages(cls, file_path: str) -> Iterator[str]:
+        """Yield the text of each PDF page in order, terminated by a form feed."""
+        try:
+            for page_layout in extract_pages(file_path, laparams=cls._laparams()):
+                yield ''.join(
+                    element.get_text() for element in page_layout
+                    if isinstance(element, LTTextContainer)
+                ) + '\f'
+        except Exception as e:
+            raise Exception(f"PDF extraction failed: {str(e)}")
+
+
+class HierarchicalChunker:
+    """
+    Incremental section/leaf chunker.
+    
+    Text is fed page by page; a section is emitted (with its leaf chunks) as soon
+    as the next heading closes it, or once it grows past ``section_max_chars``,
+    so chunking can run while later pages are still being extracted. Leaf chunks
+    never cross a section boundary and get document-wide ``chunk_index`` values.
+    """
+    
+    def __init__(self, chunk_size: int = 500, overlap: int = 100, section_max_chars: int = 4000):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.section_max_chars = section_max_chars
+        self.headings = []
+        self.page_count = 0
+        self._pages = []
+        self._page_starts = []
+        self._length = 0
+        self._pending = ''  # Text of the open section
+        self._pending_start = 0
+        self._title = ''
+        self._section_index = 0
+        self._chunk_index = 0
+    
+    @property
+    def text(self) -> str:
+        """Full text fed so far."""
+        return ''.join(self._pages)
+    
+    def feed(self, page_text: str) -> List[Dict]:
+        """Add one page of text and return the sections it completed."""
+        base = self._length
+        self._pages.append(page_text)
+        self._page_starts.append(base)
+        self.page_count += 1
+        self._length += len(page_text)
+        
+        sections = []
+        cursor = 0
+        for heading in PDFProcessor.detect_headings(page_text):
+            self._pending += page_text[cursor:heading['start_char']]
+            cursor = heading['start_char']
+            sections.extend(self._close())
+            self._title = heading['title']
+            self.headings.append({'title': heading['title'], 'start_char': base + heading['start_char']})
+        self._pending += page_text[cursor:]
+        
+        # Split an oversized open section at paragraph breaks
+        while len(self._pending) > self.section_max_chars:
+            split = self._pending.rfind('\n\n', 0, self.section_max_chars)
+            if split <= self.section_max_chars // 2:
+                split = self.section_max_chars
+            sections.extend(self._close(split))
+        return sections
+    
+    def finish(self) -> List[Dict]:
+        """Close the last open section."""
+        return self._close()
+    
+    def _close(self, length: Optional[int] = None) -> List[Dict]:
+        """Emit the first ``length`` characters of the open section (all of it by default)."""
+        if length is None:
+            length = len(self._pending)
+        section_text = self._pending[:length]
+        start = self._pending_start
+        self._pending = self._pending[length:]
+        self._pending_start = start + length
+        if not section_text.strip():
+            return []
+        
+        leaves = []
+        for leaf in PDFProcessor.chunk_text(section_text, chunk_size=self.chunk_size, overlap=self.overlap):
+            if not leaf['text']:
+                continue
+            leaf_start = start + leaf['start_char']
+            leaves.append({
+                'text': leaf['text'],
+                'start_char': leaf_start,
+                'end_char': start + min(leaf['end_char'], len(section_text)),
+                'chunk_index': self._chunk_index,
+                'page_number': bisect.bisect_right(self._page_starts, leaf_start),
+            })
+            self._chunk_index += 1
+        
+        section = {
+            'title': self._title,
+            'text': section_text.strip(),
+            'start_char': start,
+            'end_char': start + length,
+            'section_index': self._section_index,
+            'page_number': bisect.bisect_right(self._page_starts, start),
+            'chunks': leaves,
+        }
+        self._section_index += 1
+        return [section]
+
+
+class OnnxEmbeddingEncoder:
+    """
+    Sentence embeddings from an int8-quantized ONNX export, run on ONNX Runtime.
+
+    This is a drop-in for ``SentenceTransformer.encode`` on CPU-only nodes.
+    The transformer runs in ONNX Runtime. Pooling, and normalization if the
+    source model had it, are done in numpy the same way sentence-transformers
+    does them. The model directory comes from ``export``, and torch is not
+    needed at inference time.
+    """
+    
+    MODEL_FILENAME = 'model-int8.onnx'
+    CONFIG_FILENAME = 'onnx_config.json'
+    
+    def __init__(self, session, tokenizer, pooling: str = 'mean', normalize: bool = False,
+                 max_seq_length: int = 256):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.pooling = pooling
+        self.normalize = normalize
+        self.max_seq_length = max_seq_length
+        self._input_names = [i.name for i in session.get_inputs()]
+    
+    @classmethod
+    def load(cls, onnx_dir: str) -> 'OnnxEmbeddingEncoder':
+        """Load an exported model directory."""
+        if not ONNXRUNTIME_AVAILABLE:
+            raise EmbeddingBackendUnavailable("onnxruntime not installed. Install with: pip install onnxruntime")
+        from transformers import AutoTokenizer
+        
+        onnx_dir = Path(onnx_dir)
+        with open(onnx_dir / cls.CONFIG_FILENAME) as f:
+            config = json.load(f)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.ONNX_INTRA_OP_THREADS:
+            options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+        session = onnxruntime.InferenceSession(
+            str(onnx_dir / cls.MODEL_FILENAME), options, providers=['CPUExecutionProvider']
+        )
+        return cls(session, AutoTokenizer.from_pretrained(str(onnx_dir)), **config)
+    
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Embed one text (1-D result) or a list of texts (2-D result)."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype='float32')
+        
+        # Longest first, so each batch pads to similar lengths
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            encoded = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors='np'
+            )
+            feeds = {name: np.asarray(encoded[name], dtype='int64') for name in self._input_names if name in encoded}
+            if 'token_type_ids' in self._input_names and 'token_type_ids' not in feeds:
+                feeds['token_type_ids'] = np.zeros_like(feeds['input_ids'])
+            token_embeddings = self.session.run(None, feeds)[0]
+            batches.append(self._pool(token_embeddings, np.asarray(encoded['attention_mask'])))
+        
+        embeddings = np.vstack(batches)[np.argsort(order, kind='stable')]
+        return embeddings[0] if single else embeddings
+    
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == 'cls':
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., None].astype('float32')
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype('float32')
+    
+    @classmethod
+    def export(cls, model_path: str, output_dir: str) -> Path:
+        """Export a sentence-transformers model to ONNX and quantize its weights to int8."""
+        if not SENTENCE_TRANSFORMERS_AVAILABLE or not ONNXRUNTIME_AVAILABLE:
+            raise Exception("Exporting needs sentence-transformers and onnxruntime installed")
+        import torch
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        st_model = sentence_transformers.SentenceTransformer(model_path, device='cpu')
+        module_names = [module.__class__.__name__ for module in st_model]
+        pooling_module = next((module for module in st_model if module.__class__.__name__ == 'Pooling'), None)
+        transformer = st_model[0].auto_model.eval()
+        tokenizer = st_model.tokenizer
+        
+        sample = tokenizer(['An example sentence for export.'], return_tensors='pt')
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['token_embeddings']}
+        
+        class TokenEmbeddings(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.transformer = transformer
+            
+            def forward(self, *inputs):
+                return self.transformer(**dict(zip(input_names, inputs)))[0]
+        
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        fp32_path = output_dir / 'model.onnx'
+        with torch.no_grad():
+            torch.onnx.export(
+                TokenEmbeddings(), tuple(sample[name] for name in input_names), str(fp32_path),
+                input_names=input_names, output_names=['token_embeddings'],
+                dynamic_axes=dynamic_axes, opset_version=14
+            )
+        quantize_dynamic(str(fp32_path), str(output_dir / cls.MODEL_FILENAME), weight_type=QuantType.QInt8)
+        fp32_path.unlink()
+        
+        tokenizer.save_pretrained(str(output_dir))
+        with open(output_dir / cls.CONFIG_FILENAME, 'w') as f:
+            json.dump({
+                'pooling': 'cls' if pooling_module is not None and pooling_module.pooling_mode_cls_token else 'mean',
+                'normalize': 'Normalize' in module_names,
+                'max_seq_length': st_model.max_seq_length,
+            }, f)
+        return output_dir
+
+
+class EmbeddingModelPool:
+    """
+    Process-wide pool of loaded embedding models keyed by EmbeddingModel id.
+
+    Models load lazily on first use and their resident size is recorded. When
+    the total exceeds ``EMBEDDING_MODEL_POOL_MAX_MB``, the least recently used
+    models are evicted. The model just requested is never evicted. Loading
+    holds a per-key lock, so concurrent requests for the same model wait for
+    a single load. Models that are already resident stay usable meanwhile.
+    """
+    
+    def __init__(self):
+        self._models = OrderedDict()  # key -> (model, size in bytes), least recently used first
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.loads = 0
+        self.evictions = 0
+    
+    def get(self, key, loader: Callable[[], object]):
+        """Return the model for ``key``, calling ``loader`` once if it is not resident."""
+        with self._lock:
+            model = self._touch(key)
+            if model is not None:
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self._lock:
+                model = self._touch(key)
+                if model is not None:
+                    return model
+            
+            rss_before = self._rss_bytes()
+            model = loader()
+            size = self._model_bytes(model) or max(self._rss_bytes() - rss_before, 0)
+            
+            with self._lock:
+                self._models[key] = (model, size)
+                self.loads += 1
+                self._evict(keep=key)
+            return model
+    
+    def evict(self, key) -> bool:
+        """Drop a model from the pool; returns whether it was resident."""
+        with self._lock:
+            return self._models.pop(key, None) is not None
+    
+    def clear(self):
+        """Drop every model."""
+        with self._lock:
+            self._models.clear()
+    
+    def stats(self) -> Dict:
+        """Resident models (least recently used first) and their sizes."""
+        with self._lock:
+            return {
+                'max_bytes': self._max_bytes(),
+                'resident_bytes': sum(size for _, size in self._models.values()),
+                'models': [{'key': key, 'bytes': size} for key, (_, size) in self._models.items()],
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+    
+    def _touch(self, key):
+        entry = self._models.get(key)
+        if entry is None:
+            return None
+        self._models.move_to_end(key)
+        return entry[0]
+    
+    def _evict(self, keep):
+        max_bytes = self._max_bytes()
+        resident = sum(size for _, size in self._models.values())
+        for key in list(self._models):
+            if resident <= max_bytes:
+                break
+            if key == keep:
+                continue
+            resident -= self._models.pop(key)[1]
+            self.evictions += 1
+    
+    @staticmethod
+    def _max_bytes() -> int:
+        return int(settings.EMBEDDING_MODEL_POOL_MAX_MB * 1024 * 1024)
+    
+    @staticmethod
+    def _model_bytes(model) -> int:
+        """Size of a torch model's parameters and buffers (0 if it is not a torch module)."""
+        if not hasattr(model, 'parameters'):
+            return 0
+        tensors = itertools.chain(model.parameters(), model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    
+    @staticmethod
+    def _rss_bytes() -> int:
+        """Current resident set size of this process (0 where /proc is unavailable)."""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return 0
 
 
 class EmbeddingService:
     """Handle embeddings and vector search."""
     
-    _model = None
-    _index = None
+    model_pool = EmbeddingModelPool()
+    _client = None
     
     @classmethod
-    def get_model(cls):
-        """Get or load embedding model."""
+    def get_model(cls, embedding_model: Optional[EmbeddingModel] = None):
+        """Get or load the model for an EmbeddingModel (default: the active one) from the pool."""
+        if embedding_model is None:
+            embedding_model = cls.get_active_embedding_model()
+        if embedding_model is None:
+            return cls.model_pool.get(None, lambda: cls._load_model(settings.EMBEDDING_MODEL))
+        return cls.model_pool.get(
+            (embedding_model.id, embedding_model.backend),
+            lambda: cls._load_model(embedding_model.model_path, embedding_model.backend, embedding_model.onnx_path)
+        )
+    
+    @staticmethod
+    def _load_model(model_path: str, backend: str = 'torch', onnx_path: str = ''):
+        """Load a model with the given backend; both expose ``encode``."""
+        if backend == 'onnx':
+            if not onnx_path:
+                raise EmbeddingBackendUnavailable(f"No ONNX export for {model_path}; run: python manage.py export_onnx_model")
+            return OnnxEmbeddingEncoder.load(onnx_path)
         if not SENTENCE_TRANSFORMERS_AVAILABLE:
-            raise Exception("sentence-transformers not installed. Install with: pip install sentence-transformers")
-        if cls._model is None:
-            model_name = settings.EMBEDDING_MODEL
-            cls._model = SentenceTransformer(model_name)
-        return cls._model
+            raise EmbeddingBackendUnavailable("sentence-transformers not installed. Install with: pip install sentence-transformers")
+        return sentence_transformers.SentenceTransformer(model_path)
     
     @classmethod
     def get_active_embedding_model(cls) -> Optional[EmbeddingModel]:
@@ -132,90 +600,572 @@ class EmbeddingService:
         return EmbeddingModel.objects.filter(is_active=True).first()
     
     @classmethod
-    def create_embedding(cls, text: str) -> np.ndarray:
+    def get_serving_embedding_model(cls, workspace_id: int) -> Optional[EmbeddingModel]:
+        """Model a workspace's queries are served from; stays on the old one until a migration covers it."""
+        workspace = Workspace.objects.select_related('embedding_model').filter(id=workspace_id).first()
+        if workspace and workspace.embedding_model:
+            return workspace.embedding_model
+        return cls.get_active_embedding_model()
+    
+    @classmethod
+    def create_embedding(cls, text: str, embedding_model: Optional[EmbeddingModel] = None) -> np.ndarray:
         """Create embedding for text."""
-        model = cls.get_model()
-        embedding = model.encode(text, convert_to_numpy=True)
-        return embedding
-    
-    @classmethod
-    def get_or_create_index(cls, dimension: int):
-        """Get or create FAISS index."""
-        if not FAISS_AVAILABLE:
-            raise Exception("faiss not installed. Install with: pip install faiss-cpu")
-        if cls._index is None:
-            index_path = Path(settings.VECTOR_DB_PATH) / 'faiss.index'
-            if index_path.exists():
-                cls._index = faiss.read_index(str(index_path))
-            else:
-                cls._index = faiss.IndexFlatL2(dimension)
-        return cls._index
+        return cls._encode([text], embedding_model)[0]
+    
+    @classmethod
+    def create_embeddings(cls, texts: List[str], batch_size: Optional[int] = None,
+                          embedding_model: Optional[EmbeddingModel] = None) -> np.ndarray:
+        """Create embeddings for many texts in one batched model call."""
+        return cls._encode(texts, embedding_model, batch_size)
+    
+    @classmethod
+    def _encode(cls, texts: List[str], embedding_model: Optional[EmbeddingModel] = None,
+                batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Encode on the host's embedding server when one is configured, otherwise in this process.
+        
+        Vectors come back L2-normalized, so they are stored normalized at ingest
+        and inner-product search over them ranks by cosine similarity.
+        """
+        client = cls._get_client()
+        if client is not None:
+            try:
+                return cls.normalize(client.encode(texts, embedding_model.id if embedding_model else None))
+            except OSError:
+                if not settings.EMBEDDING_SERVER_FALLBACK:
+                    raise
+        model = cls.get_model(embedding_model)
+        return cls.normalize(model.encode(
+            texts,
+            batch_size=batch_size or settings.EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True
+        ))
+    
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize each row in one vectorized pass; all-zero rows stay zero."""
+        vectors = np.asarray(vectors, dtype='float32')
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, np.finfo('float32').tiny)
     
     @classmethod
-    def save_index(cls, index_path: Optional[str] = None):
-        """Save FAISS index to disk."""
-        if cls._index is not None:
-            if index_path is None:
-                index_path = Path(settings.VECTOR_DB_PATH) / 'faiss.index'
-            Path(index_path).parent.mkdir(parents=True, exist_ok=True)
-            faiss.write_index(cls._index, str(index_path))
+    def _get_client(cls) -> Optional[EmbeddingClient]:
+        if not settings.EMBEDDING_SERVER_SOCKET:
+            return None
+        if cls._client is None or cls._client.socket_path != settings.EMBEDDING_SERVER_SOCKET:
+            cls._client = EmbeddingClient(settings.EMBEDDING_SERVER_SOCKET)
+        return cls._client
     
     @classmethod
-    def search_similar_chunks(cls, query_embedding: np.ndarray, top_k: int = 5, workspace_id: Optional[int] = None) -> List[Tuple[Chunk, float]]:
-        """Search for similar chunks using FAISS."""
-        # Get active embedding model
-        embedding_model = cls.get_active_embedding_model()
+    def search_similar_chunks(cls, query_embedding: np.ndarray, top_k: int = 5, workspace_id: Optional[int] = None,
+                              embedding_model: Optional[EmbeddingModel] = None) -> List[Tuple[Chunk, float]]:
+        """
+        Search for similar chunks in the workspace's vector index, best first.
+        
+        Returns (chunk, score) pairs, where score is the cosine similarity to
+        the query; each chunk also carries it as ``chunk.score``.
+        
+        ``query_embedding`` must come from ``embedding_model``, which defaults to
+        the workspace's serving model (the active model when searching everywhere).
+        """
+        if embedding_model is None:
+            embedding_model = (
+                cls.get_serving_embedding_model(workspace_id) if workspace_id else cls.get_active_embedding_model()
+            )
         if not embedding_model:
             raise Exception("No active embedding model found")
         
-        # Get all embeddings for the model (and optionally workspace)
-        embedding_query = ChunkEmbedding.objects.filter(embedding_model=embedding_model)
         if workspace_id:
-            embedding_query = embedding_query.filter(chunk__document__workspace_id=workspace_id)
+            workspace_ids = [workspace_id]
+        else:
+            workspace_ids = ChunkEmbedding.objects.filter(
+                embedding_model=embedding_model
+            ).values_list('chunk__document__workspace_id', flat=True).distinct()
         
-        embeddings_list = list(embedding_query.select_related('chunk'))
+        hits = []
+        for wid in workspace_ids:
+            hits.extend(VectorIndexStore.search(embedding_model, wid, query_embedding, top_k))
+        hits = sorted(hits, key=lambda hit: hit[1], reverse=True)[:top_k]
         
-        if not embeddings_list:
-            return []
+        # Get chunks from database; ids of chunks deleted since indexing are skipped
+        chunks = Chunk.objects.select_related('document', 'section').in_bulk([chunk_id for chunk_id, _ in hits])
+        results = []
+        for chunk_id, score in hits:
+            if chunk_id in chunks:
+                # Citations built from these chunks report it
+                chunks[chunk_id].score = score
+                results.append((chunks[chunk_id], score))
+        return results
+
+
+class ContextPacker:
+    """
+    Pack retrieved chunks into prompt context within a token budget.
+    
+    Hits from one section are replaced by that section, included once. Other
+    hits from the same document with consecutive ``chunk_index`` (or
+    overlapping offsets) are merged into one passage, without the text the
+    chunker repeated between them. Passages are ordered by their best hit's
+    ``score`` (retrieval order when unscored) and added while they fit the
+    budget. A section that doesn't fit is replaced by just its hit chunks.
+    """
+    
+    MIN_OVERLAP_CHARS = 10  # Shorter shared text is treated as coincidence, not chunk overlap
+    
+    @classmethod
+    def pack(cls, chunks: List[Chunk], token_budget: Optional[int] = None) -> Tuple[str, List[Chunk]]:
+        """Return the context text and the chunks it includes, best passages first."""
+        order = {chunk.id: position for position, chunk in enumerate(chunks)}
+        passages = cls._passages(chunks, order)
+        
+        parts, used, remaining = [], [], token_budget
+        for passage in passages:
+            for candidate in [passage] + passage['runs']:
+                tokens = PDFProcessor.estimate_token_count(candidate['text'])
+                if remaining is None or tokens <= remaining:
+                    parts.append(candidate['text'])
+                    used.extend(candidate['chunks'])
+                    if remaining is not None:
+                        remaining -= tokens
+                    break
+        
+        if not parts and passages:
+            # Even the best passage is over budget: send its beginning rather than no context
+            best = (passages[0]['runs'] or [passages[0]])[0]
+            parts.append(best['text'][:token_budget * 4])
+            used.extend(best['chunks'])
+        return "\n\n".join(parts), used
+    
+    @classmethod
+    def _passages(cls, chunks: List[Chunk], order: Dict[int, int]) -> List[Dict]:
+        by_section, by_document = OrderedDict(), OrderedDict()
+        for chunk in chunks:
+            if chunk.section_id is not None:
+                by_section.setdefault(chunk.section_id, []).append(chunk)
+            else:
+                # Documents processed before sections existed
+                by_document.setdefault(chunk.document_id, []).append(chunk)
+        
+        passages = []
+        for hits in by_section.values():
+            section = hits[0].section
+            heading = f", Section: {section.title}" if section.title else ""
+            passage = cls._passage(hits, order, f"{heading}, Page: {cls._page(hits)}", section.text)
+            passage['runs'] = cls._sorted(cls._runs(hits, order))
+            passages.append(passage)
+        for hits in by_document.values():
+            passages.extend(cls._runs(hits, order))
+        return cls._sorted(passages)
+    
+    @classmethod
+    def _runs(cls, hits: List[Chunk], order: Dict[int, int]) -> List[Dict]:
+        """Merge hits of one document that follow each other into passages."""
+        runs = []
+        for chunk in sorted(hits, key=lambda c: c.chunk_index):
+            last = runs[-1][-1] if runs else None
+            if last is not None and (
+                chunk.chunk_index == last.chunk_index + 1
+                or (chunk.start_char is not None and last.end_char is not None and chunk.start_char <= last.end_char)
+            ):
+                runs[-1].append(chunk)
+            else:
+                runs.append([chunk])
+        
+        passages = []
+        for run in runs:
+            text = run[0].text
+            for chunk in run[1:]:
+                text = cls._merge_text(text, chunk.text)
+            passages.append(cls._passage(run, order, f", Page: {cls._page(run)}", text))
+        return passages
+    
+    @classmethod
+    def _merge_text(cls, left: str, right: str) -> str:
+        """Join two neighbouring chunks, dropping the start of ``right`` that repeats the end of ``left``."""
+        longest = min(len(left), len(right), settings.CHUNK_OVERLAP * 2)
+        for size in range(longest, cls.MIN_OVERLAP_CHARS - 1, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return f"{left}\n{right}"
+    
+    @staticmethod
+    def _passage(chunks: List[Chunk], order: Dict[int, int], location: str, text: str) -> Dict:
+        scores = [chunk.score for chunk in chunks if getattr(chunk, 'score', None) is not None]
+        return {
+            'text': f"[Document: {chunks[0].document.title}{location}]\n{text}",
+            'chunks': sorted(chunks, key=lambda c: order[c.id]),
+            'score': max(scores) if scores else None,
+            'first': min(order[chunk.id] for chunk in chunks),
+            'runs': [],
+        }
+    
+    @staticmethod
+    def _page(chunks: List[Chunk]) -> str:
+        pages = [chunk.page_number for chunk in chunks if chunk.page_number]
+        return str(min(pages)) if pages else 'N/A'
+    
+    @staticmethod
+    def _sorted(passages: List[Dict]) -> List[Dict]:
+        return sorted(passages, key=lambda p: (p['score'] is None, -(p['score'] or 0), p['first']))
+
+
+class ExtractiveAnswerer:
+    """
+    Answer from the retrieved chunks' own sentences, without an LLM.
+    
+    The chunks are split into sentences, which are embedded in one batch and
+    scored against the query vector with a single matrix product. Vectors are
+    normalized, so the product gives cosine similarities. The top
+    ``FALLBACK_ANSWER_SENTENCES`` sentences are returned, in score order, each
+    cited to the chunk and page it came from.
+    """
+    
+    SENTENCE_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"(\[])|\n{2,}')
+    MIN_SENTENCE_CHARS = 25  # Shorter fragments (headings, figure labels) make poor answers
+    MAX_SENTENCE_CHARS = 600
+    
+    @classmethod
+    def sentences(cls, chunks: List[Chunk]) -> List[Tuple[str, Chunk]]:
+        """Sentences of the chunks in order, each once (chunk overlap repeats them), with their chunk."""
+        seen, sentences = set(), []
+        for chunk in chunks:
+            for sentence in cls.SENTENCE_RE.split(chunk.text):
+                sentence = ' '.join(sentence.split())
+                if len(sentence) < cls.MIN_SENTENCE_CHARS or sentence.lower() in seen:
+                    continue
+                seen.add(sentence.lower())
+                sentences.append((sentence[:cls.MAX_SENTENCE_CHARS], chunk))
+        return sentences
+    
+    @classmethod
+    def answer(cls, query: str, chunks: List[Chunk],
+               query_embedding: Optional[np.ndarray] = None) -> Optional[Tuple[str, List[Dict]]]:
+        """Return (answer, citations), or None if the chunks have no usable sentences."""
+        sentences = cls.sentences(chunks)
+        if not sentences:
+            return None
         
-        # Build FAISS index from current embeddings
-        dimension = embedding_model.dimension
-        index = faiss.IndexFlatL2(dimension)
+        # Embed with the model the query was searched with, so the vectors are comparable
+        embedding_model = EmbeddingService.get_serving_embedding_model(chunks[0].document.workspace_id)
+        texts = [sentence for sentence, _ in sentences]
+        if query_embedding is None:
+            vectors = EmbeddingService.create_embeddings([query] + texts, embedding_model=embedding_model)
+            query_embedding, vectors = vectors[0], vectors[1:]
+        else:
+            vectors = EmbeddingService.create_embeddings(texts, embedding_model=embedding_model)
+        scores = np.asarray(vectors, dtype='float32') @ np.asarray(query_embedding, dtype='float32')
         
-        # Add all embeddings to index
-        vectors = []
-        chunk_mapping = {}  # Map FAISS index position to ChunkEmbedding
-        for i, embedding_obj in enumerate(embeddings_list):
-            vector = np.array(embedding_obj.vector).astype('float32').reshape(1, -1)
-            vectors.append(vector)
-            chunk_mapping[i] = embedding_obj
+        top = np.argsort(-scores)[:settings.FALLBACK_ANSWER_SENTENCES]
+        lines, citations = [], []
+        for position in top:
+            sentence, chunk = sentences[position]
+            lines.append(f"- {sentence} [Document: {chunk.document.title}, Page: {chunk.page_number or 'N/A'}]")
+            citations.append({
+                'document_id': chunk.document.id,
+                'document_title': chunk.document.title,
+                'chunk_id': chunk.id,
+                'page_number': chunk.page_number,
+                'snippet': sentence,
+                'score': getattr(chunk, 'score', None)
+            })
         
-        if vectors:
-            all_vectors = np.vstack(vectors)
-            index.add(all_vectors)
+        answer = "Most relevant passages from your documents:\n\n" + "\n".join(lines)
+        answer += "\n\n*Note: This answer quotes your documents directly. Configure OPENAI_API_KEY or ANTHROPIC_API_KEY for AI-generated answers.*"
+        return answer, citations
+
+
+class TextRankSummarizer:
+    """
+    Extractive multi-document summaries from stored chunk embeddings, without an LLM.
+    
+    The chunks form a graph whose edge weights are the cosine similarities of
+    their vectors (one ``V @ V.T``, negatives dropped). Chunks are ranked by
+    TextRank, a PageRank power iteration with damping ``TEXTRANK_DAMPING``.
+    Each document then gets up to ``SUMMARY_EXTRACTIVE_PASSAGES`` passages,
+    picked greedily by rank minus ``SUMMARY_EXTRACTIVE_DIVERSITY`` times the
+    similarity to passages already picked, so near-duplicates are skipped.
+    
+    Vectors come from ``ChunkEmbedding`` under the workspace's serving model;
+    only chunks without one are embedded. Above ``TEXTRANK_MAX_NODES`` chunks,
+    each document is ranked on its own graph to bound memory.
+    """
+    
+    MAX_ITERATIONS = 100
+    TOLERANCE = 1e-6
+    PASSAGE_CHARS = 400
+    
+    @classmethod
+    def summarize(cls, chunks: List[Chunk], summary_type: str = 'extractive') -> Tuple[str, str, List[Dict]]:
+        """
+        Return (summary, related_work, citations) like ``LLMService.generate_summary``.
         
-        # Search
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        distances, indices = index.search(query_embedding, min(top_k, len(embeddings_list)))
+        ``short`` quotes each document's top passage. ``related_work`` does the
+        same and puts the document's other picks in the related work section.
+        Other types quote every pick.
+        """
+        if not chunks:
+            return "No documents available for summarization.", "", []
         
-        # Get chunks from database
-        results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            if idx < 0 or idx >= len(embeddings_list):  # FAISS returns -1 for empty slots
-                continue
-            try:
-                embedding_obj = chunk_mapping[idx]
-                chunk = embedding_obj.chunk
-                results.append((chunk, float(distance)))
-            except (IndexError, KeyError):
-                continue
+        vectors = cls.chunk_vectors(chunks)
+        documents: Dict[int, List[int]] = {}
+        for position, chunk in enumerate(chunks):
+            documents.setdefault(chunk.document_id, []).append(position)
         
-        return results
+        if len(chunks) <= settings.TEXTRANK_MAX_NODES:
+            scores = cls.rank(vectors)
+        else:
+            scores = np.zeros(len(chunks), dtype='float32')
+            for positions in documents.values():
+                scores[positions] = cls.rank(vectors[positions])
+        
+        summary_parts, related_parts, citations = [], [], []
+        for positions in documents.values():
+            picked = cls.select(vectors[positions], scores[positions], settings.SUMMARY_EXTRACTIVE_PASSAGES)
+            picked = [positions[i] for i in picked]
+            if summary_type in ('short', 'related_work'):
+                lead, rest = picked[:1], picked[1:]
+            else:
+                lead, rest = picked, []
+            
+            title = chunks[picked[0]].document.title
+            summary_parts.append(cls._section(title, chunks, sorted(lead)))
+            if summary_type == 'related_work' and rest:
+                related_parts.append(cls._section(title, chunks, sorted(rest)))
+            for position in lead + (rest if summary_type == 'related_work' else []):
+                chunk = chunks[position]
+                citations.append({
+                    'document_id': chunk.document.id,
+                    'document_title': chunk.document.title,
+                    'chunk_id': chunk.id,
+                    'page_number': chunk.page_number,
+                    'snippet': chunk.text[:200],
+                    'score': round(float(scores[position]), 6)
+                })
+        
+        summary = "\n\n".join(summary_parts)
+        related_work = ""
+        if summary_type == 'related_work':
+            related_work = "\n\n".join(related_parts) if related_parts else "No further passages found in the selected documents."
+        return summary, related_work, citations
+    
+    @staticmethod
+    def chunk_vectors(chunks: List[Chunk]) -> np.ndarray:
+        """Unit-length vectors for the chunks, in order: stored ones, plus one batch for any missing."""
+        embedding_model = EmbeddingService.get_serving_embedding_model(chunks[0].document.workspace_id)
+        if not embedding_model:
+            raise EmbeddingBackendUnavailable("No active embedding model found")
+        
+        stored = dict(ChunkEmbedding.objects.filter(
+            chunk_id__in=[chunk.id for chunk in chunks],
+            embedding_model=embedding_model
+        ).values_list('chunk_id', 'vector'))
+        missing = [chunk for chunk in chunks if chunk.id not in stored]
+        if missing:
+            new_vectors = EmbeddingService.create_embeddings(
+                [chunk.text for chunk in missing], embedding_model=embedding_model
+            )
+            stored.update(zip((chunk.id for chunk in missing), np.asarray(new_vectors).tolist()))
+        
+        vectors = np.array([stored[chunk.id] for chunk in chunks], dtype='float32')
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    
+    @classmethod
+    def rank(cls, vectors: np.ndarray) -> np.ndarray:
+        """TextRank scores (summing to 1) of unit vectors' similarity graph."""
+        n = len(vectors)
+        if n == 1:
+            return np.ones(1, dtype='float32')
+        
+        similarities = vectors @ vectors.T
+        np.clip(similarities, 0, None, out=similarities)
+        np.fill_diagonal(similarities, 0)
+        degree = similarities.sum(axis=1, keepdims=True)
+        # Row-stochastic transitions; a chunk similar to nothing links to every chunk evenly
+        transitions = np.divide(
+            similarities, degree, out=np.full_like(similarities, 1 / n), where=degree > 0
+        ).T
+        
+        damping = settings.TEXTRANK_DAMPING
+        scores = np.full(n, 1 / n, dtype='float32')
+        for _ in range(cls.MAX_ITERATIONS):
+            updated = (1 - damping) / n + damping * (transitions @ scores)
+            converged = np.abs(updated - scores).sum() < cls.TOLERANCE
+            scores = updated
+            if converged:
+                break
+        return scores
+    
+    @staticmethod
+    def select(vectors: np.ndarray, scores: np.ndarray, count: int) -> List[int]:
+        """Indices of up to ``count`` high-ranked, mutually dissimilar rows, best first."""
+        relevance = scores / scores.max() if scores.max() > 0 else scores
+        similarities = vectors @ vectors.T
+        redundancy = np.zeros(len(vectors), dtype='float32')
+        available = np.ones(len(vectors), dtype=bool)
+        picked = []
+        for _ in range(min(count, len(vectors))):
+            gains = np.where(available, relevance - settings.SUMMARY_EXTRACTIVE_DIVERSITY * redundancy, -np.inf)
+            best = int(np.argmax(gains))
+            picked.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, similarities[best])
+        return picked
+    
+    @classmethod
+    def _section(cls, title: str, chunks: List[Chunk], positions: List[int]) -> str:
+        lines = [
+            f"- {cls._excerpt(chunks[position].text)} [Document: {title}, Page: {chunks[position].page_number or 'N/A'}]"
+            for position in positions
+        ]
+        return f"**{title}**:\n" + "\n".join(lines)
+    
+    @classmethod
+    def _excerpt(cls, text: str) -> str:
+        """The passage cut at a sentence end near ``PASSAGE_CHARS``."""
+        text = ' '.join(text.split())
+        if len(text) <= cls.PASSAGE_CHARS:
+            return text
+        excerpt = text[:cls.PASSAGE_CHARS]
+        last_period = excerpt.rfind('.')
+        return excerpt[:last_period + 1] if last_period > cls.PASSAGE_CHARS // 2 else excerpt + "..."
+
+
+class LLMClientRegistry:
+    """
+    Process-wide LLM provider clients, reused across requests.
+    
+    Each provider gets one sync client per process, and one async client per
+    event loop. Clients are built over an httpx connection pool with up to
+    ``LLM_POOL_CONNECTIONS`` keep-alive connections, so repeated calls skip
+    the TCP and TLS handshakes. After a fork (gunicorn, Celery prefork) the
+    clients are rebuilt, because pooled sockets must not be shared between
+    processes. ``slot`` and ``aslot`` bound the calls in flight per provider
+    to ``LLM_MAX_CONCURRENCY``. A caller that waits longer than
+    ``LLM_QUEUE_TIMEOUT_SECONDS`` for a slot gets an error instead of piling
+    up behind a slow provider.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self._reset()
+    
+    def get(self, provider: str, is_async: bool = False):
+        """Return the shared client for ``provider``, creating it on first use."""
+        with self._lock:
+            self._check_fork()
+            clients = self._loop_state()['clients'] if is_async else self._clients
+            if provider not in clients:
+                clients[provider] = self._create(provider, is_async)
+                self.created += 1
+            return clients[provider]
+    
+    @contextmanager
+    def slot(self, provider: str):
+        """Hold one of the provider's concurrent-call slots."""
+        with self._lock:
+            self._check_fork()
+            semaphore = self._semaphores.setdefault(provider, threading.BoundedSemaphore(settings.LLM_MAX_CONCURRENCY))
+        if not semaphore.acquire(timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS):
+            raise Exception(f"Too many concurrent {provider} requests; try again later")
+        try:
+            yield
+        finally:
+            semaphore.release()
+    
+    @asynccontextmanager
+    async def aslot(self, provider: str):
+        """Async ``slot``; the limit applies per event loop."""
+        with self._lock:
+            self._check_fork()
+            semaphores = self._loop_state()['semaphores']
+            semaphore = semaphores.setdefault(provider, asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY))
+        try:
+            await asyncio.wait_for(semaphore.acquire(), settings.LLM_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise Exception(f"Too many concurrent {provider} requests; try again later")
+        try:
+            yield
+        finally:
+            semaphore.release()
+    
+    def clear(self):
+        """
+        Drop every client (e.g. after changing API keys or base URLs) and close their pools.
+        
+        Async clients are closed on the event loop that created them, since
+        their connections belong to it: right away if that loop is idle, or
+        scheduled on it if it is running.
+        """
+        with self._lock:
+            clients, loops = self._clients, self._loops
+            self._reset()
+        for client in clients.values():
+            client.close()
+        for loop, state in list(loops.items()):
+            for client in state['clients'].values():
+                self._aclose(loop, client)
+    
+    @staticmethod
+    def _aclose(loop: asyncio.AbstractEventLoop, client):
+        if loop.is_closed():
+            return  # Nothing can run on it any more; the connections go with the client
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+            return
+        # In a thread of its own, because clear() may be called from inside another running loop
+        closer = threading.Thread(target=loop.run_until_complete, args=(client.close(),))
+        closer.start()
+        closer.join()
+    
+    def _reset(self):
+        self._pid = os.getpid()
+        self._clients = {}
+        self._semaphores = {}
+        self._loops = weakref.WeakKeyDictionary()  # event loop -> its async clients and semaphores
+    
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # The parent's clients stay open for the parent; just stop using them here
+            self._reset()
+    
+    def _loop_state(self) -> Dict:
+        return self._loops.setdefault(asyncio.get_running_loop(), {'clients': {}, 'semaphores': {}})
+    
+    @staticmethod
+    def _create(provider: str, is_async: bool):
+        if provider == 'openai':
+            if not settings.OPENAI_API_KEY:
+                raise Exception("OpenAI API key not configured")
+            client_class = openai.AsyncOpenAI if is_async else openai.OpenAI
+            api_key, base_url = settings.OPENAI_API_KEY, settings.OPENAI_BASE_URL
+        elif provider == 'anthropic':
+            if not settings.ANTHROPIC_API_KEY:
+                raise Exception("Anthropic API key not configured")
+            client_class = anthropic.AsyncAnthropic if is_async else anthropic.Anthropic
+            api_key, base_url = settings.ANTHROPIC_API_KEY, settings.ANTHROPIC_BASE_URL
+        else:
+            raise Exception(f"Unsupported LLM provider: {provider}")
+        
+        limits = httpx.Limits(
+            max_connections=settings.LLM_POOL_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_POOL_CONNECTIONS
+        )
+        http_client = (httpx.AsyncClient if is_async else httpx.Client)(limits=limits, timeout=settings.LLM_TIMEOUT_SECONDS)
+        return client_class(
+            api_key=api_key,
+            base_url=base_url or None,
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=http_client
+        )
 
 
 class LLMService:
     """Handle LLM interactions."""
     
+    clients = LLMClientRegistry()
+    
     @staticmethod
     def get_active_generation_model() -> Optional[GenerationModel]:
         """Get active generation model from database."""
@@ -223,22 +1173,34 @@ class LLMService:
     
     @classmethod
     def generate_answer(cls, query: str, context_chunks: List[Chunk], 
-                        conversation_history: Optional[List[Dict]] = None) -> Tuple[str, List[Dict]]:
-        """Generate answer using LLM with RAG context."""
+                        conversation_history: Optional[List[Dict]] = None,
+                        cache_scope=None, query_embedding: Optional[np.ndarray] = None) -> Tuple[str, List[Dict]]:
+        """
+        Generate answer using LLM with RAG context.
+        
+        With a ``cache_scope`` (``AnswerCache.scope``), a cached answer for the
+        same prompt or a similar question is returned without calling the LLM,
+        and new LLM answers are stored. Without an LLM the answer is extracted
+        from the chunks; pass the ``query_embedding`` used for retrieval to
+        avoid embedding the query again.
+        """
         model = cls.get_active_generation_model()
         if not model:
-            # Fallback: return chunks as answer if no model configured
-            return LLMService._generate_fallback_answer(query, context_chunks)
+            # Fallback: answer from the chunks if no model configured
+            return LLMService._generate_fallback_answer(query, context_chunks, query_embedding)
         
-        # Build context from chunks
-        context_text = "\n\n".join([
-            f"[Document: {chunk.document.title}, Page: {chunk.page_number or 'N/A'}]\n{chunk.text}"
-            for chunk in context_chunks
-        ])
+        # Build context from the parent sections and merged runs of the retrieved chunks;
+        # only the chunks that fit the model's budget can be cited
+        context_text, context_chunks = ContextPacker.pack(context_chunks, model.context_token_budget)
         
         # Build prompt
         prompt = cls._build_qa_prompt(query, context_text, conversation_history)
         
+        if cache_scope is not None:
+            cached = cache_scope.get(model, prompt, context_chunks)
+            if cached is not None:
+                return cached
+        
         # Call LLM
         try:
             if model.provider == 'openai':
@@ -250,13 +1212,114 @@ class LLMService:
             
             # Extract answer and citations
             answer, citations = cls._parse_response(response, context_chunks)
+            if cache_scope is not None:
+                cache_scope.put(model, prompt, context_chunks, answer, citations)
             return answer, citations
         except Exception as e:
             # If LLM call fails (e.g., no API key), fallback to chunk-based answer
             if "API key" in str(e) or "not configured" in str(e):
-                return LLMService._generate_fallback_answer(query, context_chunks)
+                return LLMService._generate_fallback_answer(query, context_chunks, query_embedding)
             raise
     
+    @classmethod
+    async def agenerate_answer(cls, query: str, context_chunks: List[Chunk],
+                               conversation_history: Optional[List[Dict]] = None,
+                               cache_scope=None, query_embedding: Optional[np.ndarray] = None) -> Tuple[str, List[Dict]]:
+        """
+        Async ``generate_answer``, for ASGI views and fanning out many LLM calls at once.
+        
+        Database and cache work (model lookup, section text, ``cache_scope``)
+        runs in a worker thread; only the provider call is awaited on the event loop.
+        """
+        model = await sync_to_async(cls.get_active_generation_model)()
+        if not model:
+            return await sync_to_async(cls._generate_fallback_answer)(query, context_chunks, query_embedding)
+        
+        context_text, context_chunks = await sync_to_async(ContextPacker.pack)(context_chunks, model.context_token_budget)
+        prompt = cls._build_qa_prompt(query, context_text, conversation_history)
+        if cache_scope is not None:
+            cached = await sync_to_async(cache_scope.get)(model, prompt, context_chunks)
+            if cached is not None:
+                return cached
+        
+        try:
+            if model.provider == 'openai':
+                response = await cls._acall_openai(model.model_id, prompt)
+            elif model.provider == 'anthropic':
+                response = await cls._acall_anthropic(model.model_id, prompt)
+            else:
+                raise Exception(f"Unsupported LLM provider: {model.provider}")
+        except Exception as e:
+            if "API key" in str(e) or "not configured" in str(e):
+                return await sync_to_async(cls._generate_fallback_answer)(query, context_chunks, query_embedding)
+            raise
+        answer, citations = await sync_to_async(cls._parse_response)(response, context_chunks)
+        if cache_scope is not None:
+            await sync_to_async(cache_scope.put)(model, prompt, context_chunks, answer, citations)
+        return answer, citations
+    
+    @classmethod
+    def stream_answer(cls, query: str, context_chunks: List[Chunk],
+                      conversation_history: Optional[List[Dict]] = None, cache_scope=None,
+                      query_embedding: Optional[np.ndarray] = None) -> Iterator[Dict]:
+        """
+        Generate an answer like ``generate_answer``, yielding it as the provider produces it.
+        
+        Yields ``{'type': 'token', 'text': ...}`` events, then one
+        ``{'type': 'done', 'answer': ..., 'citations': [...]}`` event.
+        Citations can only be extracted from the complete answer. A cached
+        answer arrives as a single token event.
+        """
+        model = cls.get_active_generation_model()
+        if not model:
+            yield from cls._stream_fallback(query, context_chunks, query_embedding)
+            return
+        
+        context_text, context_chunks = ContextPacker.pack(context_chunks, model.context_token_budget)
+        prompt = cls._build_qa_prompt(query, context_text, conversation_history)
+        if cache_scope is not None:
+            cached = cache_scope.get(model, prompt, context_chunks)
+            if cached is not None:
+                yield {'type': 'token', 'text': cached[0]}
+                yield {'type': 'done', 'answer': cached[0], 'citations': cached[1]}
+                return
+        
+        if model.provider == 'openai':
+            tokens = cls._stream_openai(model.model_id, prompt)
+        elif model.provider == 'anthropic':
+            tokens = cls._stream_anthropic(model.model_id, prompt)
+        else:
+            raise Exception(f"Unsupported LLM provider: {model.provider}")
+        
+        parts = []
+        try:
+            for text in tokens:
+                parts.append(text)
+                yield {'type': 'token', 'text': text}
+        except Exception as e:
+            # Same fallback as generate_answer, as long as nothing was streamed yet
+            if not parts and ("API key" in str(e) or "not configured" in str(e)):
+                yield from cls._stream_fallback(query, context_chunks, query_embedding)
+                return
+            raise
+        
+        answer, citations = cls._parse_response(''.join(parts), context_chunks)
+        if cache_scope is not None:
+            cache_scope.put(model, prompt, context_chunks, answer, citations)
+        yield {'type': 'done', 'answer': answer, 'citations': citations}
+    
+    @classmethod
+    def _stream_fallback(cls, query: str, chunks: List[Chunk],
+                         query_embedding: Optional[np.ndarray] = None) -> Iterator[Dict]:
+        answer, citations = cls._generate_fallback_answer(query, chunks, query_embedding)
+        yield {'type': 'token', 'text': answer}
+        yield {'type': 'done', 'answer': answer, 'citations': citations}
+    
+    @staticmethod
+    def _build_context(chunks: List[Chunk], token_budget: Optional[int] = None) -> str:
+        """Build prompt context from retrieved leaf chunks (see ``ContextPacker``)."""
+        return ContextPacker.pack(chunks, token_budget)[0]
+    
     @staticmethod
     def _build_qa_prompt(query: str, context: str, history: Optional[List[Dict]] = None) -> str:
         """Build prompt for Q/A."""
@@ -293,45 +1356,95 @@ Answer:"""
         return prompt
     
     @staticmethod
-    def _call_openai(model_id: str, prompt: str) -> str:
-        """Call OpenAI API."""
-        if not settings.OPENAI_API_KEY:
-            raise Exception("OpenAI API key not configured")
-        
-        client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=[
+    def _openai_request(model_id: str, prompt: str) -> Dict:
+        return {
+            'model': model_id,
+            'messages': [
                 {"role": "system", "content": "You are a helpful research assistant."},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
+            'temperature': 0.7,
+            'max_tokens': 1000,
+            'timeout': settings.LLM_TIMEOUT_SECONDS,
+        }
     
     @staticmethod
-    def _call_anthropic(model_id: str, prompt: str) -> str:
-        """Call Anthropic API."""
-        if not settings.ANTHROPIC_API_KEY:
-            raise Exception("Anthropic API key not configured")
-        
-        client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-        response = client.messages.create(
-            model=model_id,
-            max_tokens=1000,
-            messages=[
+    def _anthropic_request(model_id: str, prompt: str) -> Dict:
+        return {
+            'model': model_id,
+            'max_tokens': 1000,
+            'messages': [
                 {"role": "user", "content": prompt}
-            ]
-        )
+            ],
+            'timeout': settings.LLM_TIMEOUT_SECONDS,
+        }
+    
+    @classmethod
+    def _call_openai(cls, model_id: str, prompt: str) -> str:
+        """Call OpenAI API."""
+        client = cls.clients.get('openai')
+        with cls.clients.slot('openai'):
+            response = client.chat.completions.create(**cls._openai_request(model_id, prompt))
+        return response.choices[0].message.content
+    
+    @classmethod
+    def _call_anthropic(cls, model_id: str, prompt: str) -> str:
+        """Call Anthropic API."""
+        client = cls.clients.get('anthropic')
+        with cls.clients.slot('anthropic'):
+            response = client.messages.create(**cls._anthropic_request(model_id, prompt))
+        return response.content[0].text
+    
+    @classmethod
+    def _stream_openai(cls, model_id: str, prompt: str) -> Iterator[str]:
+        """Stream an OpenAI completion as text deltas."""
+        client = cls.clients.get('openai')
+        with cls.clients.slot('openai'):
+            stream = client.chat.completions.create(**cls._openai_request(model_id, prompt), stream=True)
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    
+    @classmethod
+    def _stream_anthropic(cls, model_id: str, prompt: str) -> Iterator[str]:
+        """Stream an Anthropic completion as text deltas."""
+        client = cls.clients.get('anthropic')
+        with cls.clients.slot('anthropic'):
+            with client.messages.stream(**cls._anthropic_request(model_id, prompt)) as stream:
+                yield from stream.text_stream
+    
+    @classmethod
+    async def _acall_openai(cls, model_id: str, prompt: str) -> str:
+        """Call OpenAI API without blocking the event loop."""
+        client = cls.clients.get('openai', is_async=True)
+        async with cls.clients.aslot('openai'):
+            response = await client.chat.completions.create(**cls._openai_request(model_id, prompt))
+        return response.choices[0].message.content
+    
+    @classmethod
+    async def _acall_anthropic(cls, model_id: str, prompt: str) -> str:
+        """Call Anthropic API without blocking the event loop."""
+        client = cls.clients.get('anthropic', is_async=True)
+        async with cls.clients.aslot('anthropic'):
+            response = await client.messages.create(**cls._anthropic_request(model_id, prompt))
         return response.content[0].text
     
     @staticmethod
-    def _generate_fallback_answer(query: str, chunks: List[Chunk]) -> Tuple[str, List[Dict]]:
+    def _generate_fallback_answer(query: str, chunks: List[Chunk],
+                                  query_embedding: Optional[np.ndarray] = None) -> Tuple[str, List[Dict]]:
         """Generate answer from chunks when LLM is not available."""
         if not chunks:
             return "No relevant information found in the documents.", []
         
+        try:
+            extracted = ExtractiveAnswerer.answer(query, chunks, query_embedding)
+        except (EmbeddingBackendUnavailable, ImportError) as e:
+            # No embedding backend either: fall back to leading snippets
+            logger.warning("Extractive answer unavailable, quoting leading snippets: %s", e)
+            extracted = None
+        if extracted is not None:
+            return extracted
+        
         # Build answer from top chunks - more concise and focused
         answer_parts = []
         citations = []
@@ -370,7 +1483,7 @@ Answer:"""
                 'chunk_id': chunk.id,
                 'page_number': chunk.page_number,
                 'snippet': chunk.text[:200] if chunk.text else '',
-                'score': None
+                'score': getattr(chunk, 'score', None)
             })
         
         # Build concise answer
@@ -394,52 +1507,51 @@ Answer:"""
                     'chunk_id': chunk.id,
                     'page_number': chunk.page_number,
                     'snippet': chunk.text[:200],
-                    'score': None
+                    'score': getattr(chunk, 'score', None)
                 })
         
         return answer, citations
     
     @classmethod
     def generate_summary(cls, document_chunks: List[Chunk], summary_type: str = 'short') -> Tuple[str, str, List[Dict]]:
-        """Generate multi-document summary."""
+        """
+        Generate multi-document summary.
+        
+        If every document has a current ``DocumentSummary`` for the active
+        model (generated at ingest), the summary is built from those digests.
+        Otherwise chunks that fit in ``SUMMARY_CONTEXT_TOKENS`` (by
+        ``Chunk.token_count``) are summarized in one call, and larger
+        selections are summarized in parts (map), in parallel, and the partial
+        summaries combined into the final summary (reduce). See
+        ``_map_reduce_context``.
+        
+        ``extractive`` needs no LLM: it quotes the passages ranked highest by
+        ``TextRankSummarizer``.
+        """
+        if summary_type == 'extractive':
+            return TextRankSummarizer.summarize(document_chunks, summary_type)
+        
         model = cls.get_active_generation_model()
         if not model:
             raise Exception("No active generation model found")
         
-        # Combine all chunks
-        context_text = "\n\n".join([
-            f"[Document: {chunk.document.title}, Page: {chunk.page_number or 'N/A'}]\n{chunk.text}"
-            for chunk in document_chunks
-        ])
-        
-        # Build prompt based on type
-        if summary_type == 'related_work':
-            prompt = f"""Summarize the following research documents, focusing on related work and methodology.
-
-Documents:
-{context_text}
-
-Provide:
-1. A brief summary (2-3 sentences)
-2. A detailed "Related Work" section with inline citations in the format [Document: title, Page: X]
-
-Summary:"""
-        else:
-            prompt = f"""Provide a {'brief' if summary_type == 'short' else 'detailed'} summary of the following research documents.
-
-Documents:
-{context_text}
-
-Summary:"""
-        
         # Call LLM
         try:
-            if model.provider == 'openai':
-                response = cls._call_openai(model.model_id, prompt)
-            elif model.provider == 'anthropic':
-                response = cls._call_anthropic(model.model_id, prompt)
+            digests = cls._document_digests(model, document_chunks)
+            if digests:
+                # Every document has a current ingest-time digest: one small call over N digests
+                context_text = digests
+            elif sum(cls._chunk_tokens(chunk) for chunk in document_chunks) <= settings.SUMMARY_CONTEXT_TOKENS:
+                # Combine all chunks
+                context_text = "\n\n".join([
+                    f"[Document: {chunk.document.title}, Page: {chunk.page_number or 'N/A'}]\n{chunk.text}"
+                    for chunk in document_chunks
+                ])
             else:
-                raise Exception(f"Unsupported LLM provider: {model.provider}")
+                context_text = cls._map_reduce_context(model, document_chunks)
+            
+            # Build prompt based on type
+            response = cls._complete(model, cls._build_summary_prompt(context_text, summary_type))
             
             # Extract summary and related work
             if summary_type == 'related_work':
@@ -472,12 +1584,196 @@ Summary:"""
         
         return summary, related_work, citations
     
+    @classmethod
+    def generate_document_summary(cls, document_chunks: List[Chunk],
+                                  model: Optional[GenerationModel] = None) -> Tuple[str, str]:
+        """Generate a short summary and a methodology digest of one document's chunks."""
+        model = model or cls.get_active_generation_model()
+        if not model:
+            raise Exception("No active generation model found")
+        
+        title = document_chunks[0].document.title
+        if sum(cls._chunk_tokens(chunk) for chunk in document_chunks) <= settings.SUMMARY_CONTEXT_TOKENS:
+            context_text = "\n\n".join(
+                f"[Document: {title}, Page: {chunk.page_number or 'N/A'}]\n{chunk.text}" for chunk in document_chunks
+            )
+        else:
+            context_text = cls._map_reduce_context(model, document_chunks)
+        
+        response = cls._complete(model, f"""Read the research document "{title}" below and write two sections.
+Summary: 3-4 sentences on the problem, the approach and the main results.
+Methodology: a digest of the methods, data and evaluation, citing pages in the format [Document: {title}, Page: X].
+
+Document:
+{context_text}
+
+Summary:""")
+        summary, _, methodology = response.partition('Methodology:')
+        summary = summary.strip()
+        if summary.startswith('Summary:'):
+            summary = summary[len('Summary:'):].strip()
+        return summary, methodology.strip()
+    
+    @staticmethod
+    def chunk_digest(chunks: List[Chunk]) -> str:
+        """Identify the exact chunks a summary was built from; re-chunking a document changes it."""
+        return hashlib.sha256(','.join(str(chunk.id) for chunk in chunks).encode()).hexdigest()
+    
+    @classmethod
+    def _document_digests(cls, model: GenerationModel, document_chunks: List[Chunk]) -> Optional[str]:
+        """Context built from ingest-time summaries, or None unless every document has a current one."""
+        documents = OrderedDict()
+        for chunk in document_chunks:
+            documents.setdefault(chunk.document_id, []).append(chunk)
+        summaries = {
+            summary.document_id: summary
+            for summary in DocumentSummary.objects.filter(generation_model=model, document_id__in=list(documents))
+        }
+        if any(
+            doc_id not in summaries or summaries[doc_id].chunk_digest != cls.chunk_digest(chunks)
+            for doc_id, chunks in documents.items()
+        ):
+            return None
+        return "\n\n".join(
+            f"[Document: {chunks[0].document.title}]\n{summaries[doc_id].summary}\n"
+            f"Methodology: {summaries[doc_id].methodology}"
+            for doc_id, chunks in documents.items()
+        )
+    
+    @staticmethod
+    def _build_summary_prompt(context_text: str, summary_type: str) -> str:
+        if summary_type == 'related_work':
+            return f"""Summarize the following research documents, focusing on related work and methodology.
+
+Documents:
+{context_text}
+
+Provide:
+1. A brief summary (2-3 sentences)
+2. A detailed "Related Work" section with inline citations in the format [Document: title, Page: X]
+
+Summary:"""
+        return f"""Provide a {'brief' if summary_type == 'short' else 'detailed'} summary of the following research documents.
+
+Documents:
+{context_text}
+
+Summary:"""
+    
+    @classmethod
+    def _complete(cls, model: GenerationModel, prompt: str) -> str:
+        if model.provider == 'openai':
+            return cls._call_openai(model.model_id, prompt)
+        elif model.provider == 'anthropic':
+            return cls._call_anthropic(model.model_id, prompt)
+        raise Exception(f"Unsupported LLM provider: {model.provider}")
+    
+    @staticmethod
+    def _chunk_tokens(chunk: Chunk) -> int:
+        return chunk.token_count or PDFProcessor.estimate_token_count(chunk.text)
+    
+    @staticmethod
+    def _token_groups(items: List, tokens: Callable, budget: int) -> List[List]:
+        """Split items, in order, into consecutive groups of at most ``budget`` tokens (an oversized item stands alone)."""
+        groups, current, used = [], [], 0
+        for item in items:
+            count = tokens(item)
+            if current and used + count > budget:
+                groups.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += count
+        if current:
+            groups.append(current)
+        return groups
+    
+    @classmethod
+    def _map_reduce_context(cls, model: GenerationModel, document_chunks: List[Chunk]) -> str:
+        """
+        Condense chunks that don't fit one prompt into per-document partial summaries.
+        
+        Map: each document's chunks are split into groups of at most
+        ``SUMMARY_CONTEXT_TOKENS`` and every group is summarized, with up to
+        ``SUMMARY_MAP_CONCURRENCY`` calls in flight. A document's partial
+        summary is cached under its chunk ids, so summarizing it again (alone
+        or with other documents) skips the map calls. Reduce: while the partials
+        still exceed the budget, neighbouring ones are merged by further calls.
+        """
+        budget = settings.SUMMARY_CONTEXT_TOKENS
+        documents = OrderedDict()
+        for chunk in document_chunks:
+            documents.setdefault(chunk.document_id, []).append(chunk)
+        titles = {doc_id: chunks[0].document.title for doc_id, chunks in documents.items()}
+        
+        def cache_key(doc_id, chunks):
+            return f'summary_partial:{model.id}:{budget}:{doc_id}:{cls.chunk_digest(chunks)}'
+        
+        partials = {doc_id: cache.get(cache_key(doc_id, chunks)) for doc_id, chunks in documents.items()}
+        tasks = [
+            (doc_id, group)
+            for doc_id, chunks in documents.items() if partials[doc_id] is None
+            for group in cls._token_groups(chunks, cls._chunk_tokens, budget)
+        ]
+        
+        def summarize_group(task):
+            doc_id, group = task
+            text = "\n\n".join(f"[Page: {chunk.page_number or 'N/A'}]\n{chunk.text}" for chunk in group)
+            return cls._complete(model, f"""Summarize this part of the research document "{titles[doc_id]}".
+Keep its key claims, methods and results, and cite pages in the format [Document: {titles[doc_id]}, Page: X].
+Use at most {settings.SUMMARY_PARTIAL_WORDS} words.
+
+{text}
+
+Summary:""")
+        
+        if tasks:
+            # The shared client's slots still cap calls across all requests in this process
+            with ThreadPoolExecutor(min(settings.SUMMARY_MAP_CONCURRENCY, len(tasks))) as pool:
+                results = list(pool.map(summarize_group, tasks))
+            for doc_id, chunks in documents.items():
+                if partials[doc_id] is None:
+                    partials[doc_id] = "\n".join(
+                        result for (task_doc_id, _), result in zip(tasks, results) if task_doc_id == doc_id
+                    )
+                    cache.set(cache_key(doc_id, chunks), partials[doc_id], settings.SUMMARY_PARTIAL_CACHE_TTL_SECONDS)
+        
+        sections = [f"[Document: {titles[doc_id]}]\n{partials[doc_id]}" for doc_id in documents]
+        while sum(PDFProcessor.estimate_token_count(section) for section in sections) > budget:
+            groups = cls._token_groups(sections, PDFProcessor.estimate_token_count, budget)
+            if len(groups) == len(sections):
+                break  # Every section is over budget on its own; merging can't shrink the prompt further
+            
+            def merge(group):
+                if len(group) == 1:
+                    return group[0]
+                return cls._complete(model, f"""Combine these summaries of research documents into one summary.
+Keep each document's key points and every [Document: title, Page: X] citation.
+
+{chr(10).join(group)}
+
+Combined summary:""")
+            
+            with ThreadPoolExecutor(min(settings.SUMMARY_MAP_CONCURRENCY, len(groups))) as pool:
+                sections = list(pool.map(merge, groups))
+        
+        return "\n\n".join(sections)
+    
     @staticmethod
     def _generate_fallback_summary(chunks: List[Chunk], summary_type: str = 'short') -> Tuple[str, str, List[Dict]]:
         """Generate summary from chunks when LLM is not available."""
         if not chunks:
             return "No documents available for summarization.", "", []
         
+        try:
+            summary, related_work, citations = TextRankSummarizer.summarize(chunks, summary_type)
+            summary += "\n\n*Note: This is an extractive summary quoting the most central passages of each document. Configure OPENAI_API_KEY or ANTHROPIC_API_KEY for AI-generated summaries.*"
+            if related_work:
+                related_work += "\n\n*Note: This related work section quotes each document's next most central passages. Configure OPENAI_API_KEY or ANTHROPIC_API_KEY for AI-generated related work synthesis.*"
+            return summary, related_work, citations
+        except (EmbeddingBackendUnavailable, ImportError) as e:
+            # No embedding model to rank with: fall back to leading excerpts
+            logger.warning("Extractive summary unavailable, quoting leading excerpts: %s", e)
+        
         # Group chunks by document
         doc_chunks = {}
         for chunk in chunks:
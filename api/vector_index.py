@@ -0,0 +1,384 @@
+"""
+Single-writer FAISS vector indexes backed by a write-ahead log.
+"""
+import os
+import json
+import fcntl
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+from core.models import EmbeddingModel, ChunkEmbedding, VectorIndexLog
+from .lazy import LazyModule
+
+# Imported on first index access, not at startup
+faiss = LazyModule('faiss')
+FAISS_AVAILABLE = faiss.available
+
+
+class _LoadedIndex:
+    """
+    An index held by a reader: the snapshot it was loaded from, plus the log
+    entries applied on top of it. ``lock`` guards changing and searching it.
+    """
+
+    def __init__(self, index, snapshot_seq: int):
+        self.index = index
+        self.snapshot_seq = snapshot_seq
+        self.applied = set()  # Ids of log entries after the snapshot already applied
+        self.lock = threading.Lock()
+
+
+class VectorIndexStore:
+    """
+    One FAISS index per (embedding model, workspace), with a single writer.
+
+    Ingestion never touches index files. It appends 'add' and 'delete'
+    entries to the VectorIndexLog table, which acts as the write-ahead log.
+    One writer applies pending entries in batches and checkpoints a snapshot.
+    The writer is the ``checkpoint_vector_index`` task on the ``index``
+    queue, and a file lock serialises it. A checkpoint writes the index to a
+    temporary file and renames it into place, then replaces the manifest
+    that records the last applied log sequence number the same way.
+    Readers load the snapshot named in the manifest and replay the log tail
+    after it. They therefore see every committed write without waiting for
+    a checkpoint.
+
+    Vectors are stored under their chunk ids (``IndexIDMap2``). Re-adding a
+    chunk replaces its vector, so replaying an entry twice is harmless.
+
+    Embeddings are L2-normalized when they are created, so the indexes use
+    inner product and search scores are cosine similarities (higher is
+    better). The manifest records the metric. A snapshot written under
+    another metric is rebuilt from the stored embeddings on first use.
+    """
+
+    METRIC = 'ip'
+
+    _readers: Dict[Tuple[int, int], _LoadedIndex] = {}
+    _lock = threading.Lock()
+
+    # Write path
+
+    @staticmethod
+    def append(embedding_model: EmbeddingModel, workspace_id: int, op: str, chunk_ids: Iterable[int]) -> Optional[VectorIndexLog]:
+        """Record an index change in the log; returns the entry (None if there was nothing to log)."""
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids]
+        if not chunk_ids:
+            return None
+        return VectorIndexLog.objects.create(
+            embedding_model=embedding_model, workspace_id=workspace_id, op=op, chunk_ids=chunk_ids
+        )
+
+    @classmethod
+    def request_checkpoint(cls, embedding_model: EmbeddingModel, workspace_id: int):
+        """Ask the writer for a checkpoint once enough entries are pending; beat covers the rest."""
+        if cls.pending_entries(embedding_model, workspace_id) >= settings.VECTOR_INDEX_CHECKPOINT_ENTRIES:
+            from .tasks import checkpoint_vector_index
+            checkpoint_vector_index.delay(embedding_model.id, workspace_id)
+
+    @classmethod
+    def pending_entries(cls, embedding_model: EmbeddingModel, workspace_id: int) -> int:
+        """Number of log entries not yet folded into the snapshot."""
+        seq = cls._read_manifest(embedding_model.id, workspace_id).get('seq', 0)
+        return cls._log(embedding_model.id, workspace_id).filter(id__gt=seq).count()
+
+    @classmethod
+    def pending_keys(cls) -> List[Tuple[int, int]]:
+        """(embedding model id, workspace id) pairs whose snapshot is behind the log."""
+        keys = VectorIndexLog.objects.values('embedding_model_id', 'workspace_id').annotate(last=Max('id'))
+        return [
+            (row['embedding_model_id'], row['workspace_id'])
+            for row in keys
+            if row['last'] > cls._read_manifest(row['embedding_model_id'], row['workspace_id']).get('seq', 0)
+        ]
+
+    @classmethod
+    def checkpoint(cls, embedding_model: EmbeddingModel, workspace_id: int) -> int:
+        """
+        Apply pending log entries to the snapshot and write it out atomically.
+
+        Must only be called by the writer; returns the number of entries applied.
+        """
+        cls._require_faiss()
+        key = (embedding_model.id, workspace_id)
+        if cls._is_stale(cls._read_manifest(*key)):
+            cls.rebuild(embedding_model, workspace_id)
+        with cls._writer_lock(key):
+            manifest = cls._read_manifest(*key)
+            index = cls._read_snapshot(key, manifest) or cls._new_index(embedding_model.dimension)
+            seq = manifest.get('seq', 0)
+
+            applied = 0
+            batch_size = settings.VECTOR_INDEX_APPLY_BATCH
+            while True:
+                entries = list(cls._log(*key).filter(id__gt=seq).order_by('id')[:batch_size])
+                if not entries:
+                    break
+                cls._apply(index, embedding_model, entries)
+                seq = entries[-1].id
+                applied += len(entries)
+
+            if applied:
+                cls._write_snapshot(key, index, seq)
+                # Keep the entries after the previous checkpoint for readers still on it
+                cls._log(*key).filter(id__lte=manifest.get('seq', 0)).delete()
+            return applied
+
+    @classmethod
+    def rebuild(cls, embedding_model: EmbeddingModel, workspace_id: int,
+                on_progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Rebuild one workspace's index from its stored embeddings and swap it in.
+
+        Embeddings are streamed from the database in batches of
+        ``VECTOR_INDEX_REBUILD_BATCH`` and decoded straight into one
+        preallocated matrix, so memory stays at a single copy of the vectors.
+        Other workspaces are untouched. ``on_progress`` gets the rows done, the
+        total, and the throughput after every batch.
+        """
+        cls._require_faiss()
+        key = (embedding_model.id, workspace_id)
+        on_progress = on_progress or (lambda progress: None)
+        batch_size = settings.VECTOR_INDEX_REBUILD_BATCH
+        started = time.perf_counter()
+
+        with cls._writer_lock(key):
+            # Entries logged for this index after this point are replayed on top of the rebuilt snapshot
+            seq = cls._log(*key).aggregate(last=Max('id'))['last'] or 0
+            rows = ChunkEmbedding.objects.filter(
+                embedding_model=embedding_model,
+                chunk__document__workspace_id=workspace_id
+            ).order_by('chunk_id').values_list('chunk_id', 'vector')
+
+            total = rows.count()
+            ids = np.empty(total, dtype='int64')
+            vectors = np.empty((total, embedding_model.dimension), dtype='float32')
+            done = 0
+            for chunk_id, vector in rows.iterator(chunk_size=batch_size):
+                if done == total:
+                    break  # Rows added since the count come back through the log
+                ids[done] = chunk_id
+                vectors[done] = vector
+                done += 1
+                if done % batch_size == 0:
+                    on_progress(cls._progress(done, total, started))
+
+            index = cls._new_index(embedding_model.dimension)
+            if done:
+                index.add_with_ids(vectors[:done], ids[:done])
+            cls._write_snapshot(key, index, seq)
+            cls._log(*key).filter(id__lte=seq).delete()
+
+        # Swap this process's copy in one step; other processes pick it up from the manifest
+        with cls._lock:
+            cls._readers[key] = _LoadedIndex(index, seq)
+
+        progress = cls._progress(done, done, started)
+        on_progress(progress)
+        return progress
+
+    # Read path
+
+    @classmethod
+    def get_index(cls, embedding_model: EmbeddingModel, workspace_id: int):
+        """
+        Return an up-to-date index: the latest snapshot plus the log tail.
+
+        The index is this process's cached copy and later calls update it in
+        place; use ``search`` to query it while other threads may be writing.
+        """
+        return cls._current(embedding_model, workspace_id).index
+
+    @classmethod
+    def search(cls, embedding_model: EmbeddingModel, workspace_id: int,
+               query_embedding: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Return (chunk id, cosine similarity) pairs for the most similar vectors in a workspace, best first."""
+        loaded = cls._current(embedding_model, workspace_id)
+        query = np.asarray(query_embedding, dtype='float32').reshape(1, -1)
+        with loaded.lock:
+            index = loaded.index
+            if index.ntotal == 0:
+                return []
+            scores, ids = index.search(query, min(top_k, index.ntotal))
+        return [
+            (int(chunk_id), float(score))
+            for chunk_id, score in zip(ids[0], scores[0])
+            if chunk_id >= 0  # FAISS returns -1 for empty slots
+        ]
+
+    @classmethod
+    def version(cls, embedding_model: EmbeddingModel, workspace_id: int) -> int:
+        """Sequence number of the latest write to a workspace's index; grows whenever its contents change."""
+        key = (embedding_model.id, workspace_id)
+        last = cls._log(*key).aggregate(last=Max('id'))['last'] or 0
+        return max(last, cls._read_manifest(*key).get('seq', 0))
+
+    @classmethod
+    def clear_cache(cls):
+        """Drop every index loaded by this process."""
+        with cls._lock:
+            cls._readers.clear()
+
+    # Internals
+
+    @classmethod
+    def _current(cls, embedding_model: EmbeddingModel, workspace_id: int) -> _LoadedIndex:
+        """
+        This process's copy of an index, brought up to date with the log.
+
+        The class lock only guards the ``_readers`` map. Catching up runs under
+        the copy's own lock, so other workspaces' searches never wait on it.
+        """
+        cls._require_faiss()
+        key = (embedding_model.id, workspace_id)
+        if cls._is_stale(cls._read_manifest(*key)):
+            cls.rebuild(embedding_model, workspace_id)
+
+        with cls._lock:
+            loaded = cls._readers.get(key)
+        manifest = cls._read_manifest(*key)
+        if loaded is None or loaded.snapshot_seq < manifest.get('seq', 0):
+            fresh = cls._load(key, embedding_model.dimension, manifest)
+            with cls._lock:
+                loaded = cls._readers.get(key)
+                # Another thread may have loaded this snapshot (or a newer one) meanwhile
+                if loaded is None or loaded.snapshot_seq < fresh.snapshot_seq:
+                    cls._readers[key] = loaded = fresh
+
+        with loaded.lock:
+            cls._catch_up(key, loaded, embedding_model)
+        return loaded
+
+    @classmethod
+    def _catch_up(cls, key: Tuple[int, int], loaded: _LoadedIndex, embedding_model: EmbeddingModel):
+        """
+        Apply log entries after the snapshot that this copy hasn't applied yet.
+
+        Applied entries are tracked by id rather than by the highest id seen,
+        because ids are assigned before commit: an entry with a lower id can
+        become visible after a higher one.
+        """
+        logged = set(cls._log(*key).filter(id__gt=loaded.snapshot_seq).values_list('id', flat=True))
+        pending = logged - loaded.applied
+        if not pending:
+            return
+        entries = list(VectorIndexLog.objects.filter(id__in=pending).order_by('id'))
+        cls._apply(loaded.index, embedding_model, entries)
+        loaded.applied |= pending
+
+    @staticmethod
+    def _log(embedding_model_id: int, workspace_id: int):
+        return VectorIndexLog.objects.filter(embedding_model_id=embedding_model_id, workspace_id=workspace_id)
+
+    @staticmethod
+    def _require_faiss():
+        if not FAISS_AVAILABLE:
+            raise Exception("faiss not installed. Install with: pip install faiss-cpu")
+
+    @staticmethod
+    def _progress(done: int, total: int, started: float) -> Dict:
+        elapsed = time.perf_counter() - started
+        return {
+            'done': done,
+            'total': total,
+            'seconds': round(elapsed, 3),
+            'vectors_per_second': round(done / elapsed, 1) if elapsed else None,
+        }
+
+    @staticmethod
+    def _new_index(dimension: int):
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+
+    @classmethod
+    def _is_stale(cls, manifest: Dict) -> bool:
+        """A snapshot from before the switch to inner product (no metric recorded) is L2."""
+        return bool(manifest.get('snapshot')) and manifest.get('metric', 'l2') != cls.METRIC
+
+    @staticmethod
+    def _apply(index, embedding_model: EmbeddingModel, entries: List[VectorIndexLog]):
+        """Replay log entries onto an index in order."""
+        for entry in entries:
+            ids = np.array(entry.chunk_ids, dtype='int64')
+            index.remove_ids(ids)
+            if entry.op != 'add':
+                continue
+            # Chunks deleted since the entry was logged are skipped; their delete entry follows
+            rows = list(ChunkEmbedding.objects.filter(
+                embedding_model=embedding_model, chunk_id__in=entry.chunk_ids
+            ).values_list('chunk_id', 'vector'))
+            if rows:
+                index.add_with_ids(
+                    np.array([vector for _, vector in rows], dtype='float32'),
+                    np.array([chunk_id for chunk_id, _ in rows], dtype='int64')
+                )
+
+    @classmethod
+    def _load(cls, key: Tuple[int, int], dimension: int, manifest: Dict) -> _LoadedIndex:
+        try:
+            index = cls._read_snapshot(key, manifest)
+        except FileNotFoundError:
+            # The writer replaced the snapshot between our manifest read and open
+            manifest = cls._read_manifest(*key)
+            index = cls._read_snapshot(key, manifest)
+        return _LoadedIndex(index or cls._new_index(dimension), manifest.get('seq', 0))
+
+    @staticmethod
+    def _directory(key: Tuple[int, int]) -> Path:
+        embedding_model_id, workspace_id = key
+        return Path(settings.VECTOR_DB_PATH) / f'model_{embedding_model_id}' / f'workspace_{workspace_id}'
+
+    @classmethod
+    def _read_manifest(cls, embedding_model_id: int, workspace_id: int) -> Dict:
+        try:
+            with open(cls._directory((embedding_model_id, workspace_id)) / 'manifest.json') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @classmethod
+    def _read_snapshot(cls, key: Tuple[int, int], manifest: Dict):
+        if not manifest.get('snapshot'):
+            return None
+        return faiss.read_index(str(cls._directory(key) / manifest['snapshot']))
+
+    @classmethod
+    def _write_snapshot(cls, key: Tuple[int, int], index, seq: int):
+        """Write the index, then point the manifest at it; both via rename so readers never see partial files."""
+        directory = cls._directory(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        previous = cls._read_manifest(*key).get('snapshot')
+
+        snapshot = f'index-{seq}.faiss'
+        faiss.write_index(index, str(directory / f'{snapshot}.tmp'))
+        os.replace(directory / f'{snapshot}.tmp', directory / snapshot)
+
+        manifest_tmp = directory / 'manifest.json.tmp'
+        with open(manifest_tmp, 'w') as f:
+            json.dump({
+                'seq': seq, 'snapshot': snapshot, 'count': int(index.ntotal), 'dimension': index.d, 'metric': cls.METRIC
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_tmp, directory / 'manifest.json')
+
+        if previous and previous != snapshot:
+            (directory / previous).unlink(missing_ok=True)
+
+    @classmethod
+    @contextmanager
+    def _writer_lock(cls, key: Tuple[int, int]):
+        """Exclusive lock so only one process writes a given index at a time."""
+        directory = cls._directory(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / 'writer.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,23 +1,39 @@
 """
 API views for document processing, RAG Q/A, and chat.
 """
+import json
+import time
+import zlib
+import tarfile
+import zipfile
+import itertools
 from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.throttling import UserRateThrottle, ScopedRateThrottle
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.db import transaction
+from django.core.files import File
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 from core.models import (
-    Document, Workspace, ChatSession, ChatMessage, GenerationModel
+    Document, Workspace, ChatSession, ChatMessage, GenerationModel, EmbeddingModel, ChunkEmbedding,
+    EmbeddingMigration, SummaryJob
 )
 from core.serializers import DocumentSerializer, ChatSessionSerializer
 from .serializers import (
-    DocumentUploadSerializer, QuerySerializer, QueryResponseSerializer,
+    DocumentUploadSerializer, DocumentBulkUploadSerializer, QuerySerializer, QueryResponseSerializer,
     SummarizeSerializer, SummaryResponseSerializer, ChatMessageCreateSerializer
 )
-from .utils import EmbeddingService, LLMService
-from .tasks import process_document
+from .utils import PDFProcessor, EmbeddingService, LLMService
+from .scheduler import IngestionScheduler
+from .vector_index import VectorIndexStore
+from .reembedding import EmbeddingMigrator
+from .answer_cache import AnswerCache
+from .single_flight import SingleFlight
+from .summary_jobs import SummaryJobs
 
 
 class DocumentViewSet(viewsets.ModelViewSet):
@@ -32,6 +48,25 @@ class DocumentViewSet(viewsets.ModelViewSet):
         user_workspaces = Workspace.objects.filter(owner=self.request.user)
         return Document.objects.filter(workspace__in=user_workspaces)
 
+    def perform_destroy(self, instance):
+        """Delete the document, then log its vectors for removal from the index."""
+        workspace_id = instance.workspace_id
+        removals = [
+            (embedding_model, list(ChunkEmbedding.objects.filter(
+                chunk__document=instance, embedding_model=embedding_model
+            ).values_list('chunk_id', flat=True)))
+            for embedding_model in EmbeddingModel.objects.filter(embeddings__chunk__document=instance).distinct()
+        ]
+
+        def log_removals():
+            for embedding_model, chunk_ids in removals:
+                VectorIndexStore.append(embedding_model, workspace_id, 'delete', chunk_ids)
+
+        # Logged only once the rows are gone, so a rebuild can't snapshot them and then drop the entry
+        with transaction.atomic():
+            instance.delete()
+            transaction.on_commit(log_removals)
+
     @action(detail=False, methods=['post'])
     def upload(self, request):
         """Upload and process a PDF document."""
@@ -52,11 +87,8 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Save file
-        file_path = default_storage.save(
-            f'workspaces/{workspace_id}/{file.name}',
-            ContentFile(file.read())
-        )
+        # Save file (streamed to storage in chunks)
+        file_path = default_storage.save(f'workspaces/{workspace_id}/{file.name}', file)
         
         # Create document record
         document = Document.objects.create(
@@ -69,14 +101,103 @@ class DocumentViewSet(viewsets.ModelViewSet):
             status='uploaded'
         )
         
-        # Trigger async processing
-        process_document.delay(document.id)
+        # Queue for async processing, ahead of bulk loads
+        IngestionScheduler.submit([document], request.user, interactive=True)
         
         return Response(
             DocumentSerializer(document).data,
             status=status.HTTP_201_CREATED
         )
 
+    @action(detail=False, methods=['post'])
+    def bulk_upload(self, request):
+        """
+        Upload several PDFs, or a zip/tar archive of PDFs, in one request.
+        
+        Each file is streamed to storage in chunks, documents are created in
+        bulk, and processing for all of them is enqueued in one batch.
+        """
+        serializer = DocumentBulkUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        workspace_id = serializer.validated_data['workspace_id']
+        
+        # Verify workspace ownership
+        try:
+            workspace = Workspace.objects.get(id=workspace_id, owner=request.user)
+        except Workspace.DoesNotExist:
+            return Response(
+                {'error': 'Workspace not found or access denied'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Archive members first, so an unreadable archive is rejected before anything is stored
+        archive = serializer.validated_data.get('archive')
+        members = itertools.chain(
+            PDFProcessor.iter_archive_pdfs(archive) if archive is not None else [],
+            ((f.name, f, f.size) for f in serializer.validated_data.get('files', []))
+        )
+        
+        documents = []
+        skipped = []
+        stored = []
+        try:
+            for name, fileobj, size in members:
+                # Archive members and loose files go through the same checks
+                if not name.lower().endswith('.pdf'):
+                    skipped.append({'filename': name, 'reason': 'not a PDF'})
+                    continue
+                if len(documents) >= settings.BULK_UPLOAD_MAX_FILES:
+                    skipped.append({'filename': name, 'reason': 'file limit reached'})
+                    continue
+                if size > settings.BULK_UPLOAD_MAX_FILE_SIZE:
+                    skipped.append({'filename': name, 'reason': 'file too large'})
+                    continue
+                
+                upload = File(fileobj, name=name)
+                upload.size = size
+                file_path = default_storage.save(f'workspaces/{workspace_id}/{name}', upload)
+                stored.append(file_path)
+                documents.append(Document(
+                    workspace=workspace,
+                    title=name,
+                    filename=name,
+                    file_path=file_path,
+                    file_size=size,
+                    uploaded_by=request.user,
+                    status='uploaded'
+                ))
+        except (ValueError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError) as e:
+            # A corrupt archive can fail partway through: drop the members already stored
+            self._delete_files(stored)
+            return Response({'error': f'Could not read upload: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            self._delete_files(stored)
+            raise
+        
+        if not documents:
+            return Response(
+                {'error': 'No PDF files found in upload', 'skipped': skipped},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        documents = Document.objects.bulk_create(documents)
+        
+        # Queue the whole batch for fair, low-priority processing
+        IngestionScheduler.submit(documents, request.user)
+        
+        return Response({
+            'documents': DocumentSerializer(documents, many=True).data,
+            'skipped': skipped,
+        }, status=status.HTTP_201_CREATED)
+    
+    @staticmethod
+    def _delete_files(file_paths):
+        """Remove files stored for an upload that was rejected."""
+        for file_path in file_paths:
+            default_storage.delete(file_path)
+
 
 class ChatSessionViewSet(viewsets.ModelViewSet):
     """Chat session management viewset."""
@@ -110,6 +231,8 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
         
         message_text = serializer.validated_data['message']
         top_k = serializer.validated_data.get('top_k', 5)
+        stream = serializer.validated_data.get('stream', False)
+        started = time.perf_counter()
         
         # Create user message
         user_message = ChatMessage.objects.create(
@@ -132,23 +255,47 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
         try:
             # Get query embedding
             embedding_service = EmbeddingService()
-            query_embedding = embedding_service.create_embedding(message_text)
+            embedding_model = embedding_service.get_serving_embedding_model(session.workspace.id)
+            query_embedding = embedding_service.create_embedding(message_text, embedding_model)
             
             # Search similar chunks
             similar_chunks = embedding_service.search_similar_chunks(
                 query_embedding,
                 top_k=top_k,
-                workspace_id=session.workspace.id
+                workspace_id=session.workspace.id,
+                embedding_model=embedding_model
             )
             
             chunks = [chunk for chunk, _ in similar_chunks]
+            # The prompt includes the history, so only exact repeats can hit
+            cache_scope = AnswerCache.scope(session.workspace.id, embedding_model)
+            
+            if stream:
+                def save_message(answer, citations):
+                    # Persisted once the stream completes
+                    assistant_message = ChatMessage.objects.create(
+                        session=session,
+                        role='assistant',
+                        content=answer,
+                        citations=citations,
+                        generation_model=LLMService.get_active_generation_model()
+                    )
+                    assistant_message.retrieved_chunks.set(chunks)
+                    return {'message_id': assistant_message.id, 'citations': citations}
+                
+                return _sse_response(_answer_events(
+                    message_text, chunks, started, history, on_done=save_message, cache_scope=cache_scope,
+                    query_embedding=query_embedding
+                ))
             
             # Generate answer
             llm_service = LLMService()
             answer, citations = llm_service.generate_answer(
                 message_text,
                 chunks,
-                conversation_history=history
+                conversation_history=history,
+                cache_scope=cache_scope,
+                query_embedding=query_embedding
             )
             
             # Get active generation model
@@ -177,6 +324,62 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
             )
 
 
+def _format_citations(citations):
+    return [
+        {
+            'document_id': citation['document_id'],
+            'document_title': citation['document_title'],
+            'chunk_id': citation['chunk_id'],
+            'page_number': citation['page_number'],
+            'snippet': citation['snippet'],
+            'score': citation.get('score')
+        }
+        for citation in citations
+    ]
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+    return response
+
+
+def _answer_events(query_text, chunks, started, history=None, on_done=None, cache_scope=None, query_embedding=None):
+    """
+    Server-sent events for a streamed answer.
+    
+    ``token`` events carry the text as the LLM produces it. Once it finishes,
+    a ``citations`` event carries ``on_done(answer, citations)`` (or just the
+    citations). A final ``done`` event reports the time to first token and
+    the total time, both measured from ``started``. A failure mid-stream ends
+    with an ``error`` event, since the status line has already been sent.
+    """
+    time_to_first_token = None
+    try:
+        events = LLMService.stream_answer(
+            query_text, chunks, conversation_history=history, cache_scope=cache_scope, query_embedding=query_embedding
+        )
+        for event in events:
+            if event['type'] == 'token':
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                yield _sse('token', {'text': event['text']})
+            else:
+                payload = on_done(event['answer'], event['citations']) if on_done else {'citations': event['citations']}
+                yield _sse('citations', payload)
+        yield _sse('done', {
+            'time_to_first_token_ms': round(time_to_first_token * 1000, 1) if time_to_first_token is not None else None,
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e:
+        yield _sse('error', {'error': str(e)})
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def query(request):
@@ -192,6 +395,9 @@ def query(request):
     query_text = serializer.validated_data['query']
     top_k = serializer.validated_data.get('top_k', 5)
     include_citations = serializer.validated_data.get('include_citations', True)
+    min_score = serializer.validated_data.get('min_score', settings.QUERY_MIN_SCORE)
+    stream = serializer.validated_data.get('stream', False)
+    started = time.perf_counter()
     
     # Verify workspace access
     try:
@@ -202,54 +408,72 @@ def query(request):
             status=status.HTTP_404_NOT_FOUND
         )
     
-    try:
-        # Get query embedding
-        embedding_service = EmbeddingService()
-        query_embedding = embedding_service.create_embedding(query_text)
-        
-        # Search similar chunks
-        similar_chunks = embedding_service.search_similar_chunks(
-            query_embedding,
-            top_k=top_k,
-            workspace_id=workspace_id
-        )
+    if stream:
+        try:
+            embedding_model, query_embedding, chunks = _retrieve(workspace_id, query_text, top_k, min_score)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not chunks:
+            return Response({'error': 'No relevant documents found'}, status=status.HTTP_404_NOT_FOUND)
         
-        chunks = [chunk for chunk, _ in similar_chunks]
+        return _sse_response(_answer_events(
+            query_text, chunks, started,
+            on_done=lambda answer, citations: {
+                'citations': _format_citations(citations) if include_citations else [],
+                'retrieved_chunks': [chunk.id for chunk in chunks]
+            },
+            cache_scope=AnswerCache.scope(workspace_id, embedding_model, query_embedding),
+            query_embedding=query_embedding
+        ))
+    
+    # Identical requests already in flight (on any worker) share one answer
+    (data, status_code), _ = SingleFlight.run(
+        SingleFlight.key('query', workspace_id, query_text, top_k, include_citations, min_score),
+        lambda: _answer_query(workspace_id, query_text, top_k, include_citations, min_score)
+    )
+    return Response(data, status=status_code)
+
+
+def _retrieve(workspace_id, query_text, top_k, min_score):
+    """Embed the query and return (embedding_model, query_embedding, chunks scoring at least min_score)."""
+    embedding_service = EmbeddingService()
+    embedding_model = embedding_service.get_serving_embedding_model(workspace_id)
+    query_embedding = embedding_service.create_embedding(query_text, embedding_model)
+    
+    # Search similar chunks
+    similar_chunks = embedding_service.search_similar_chunks(
+        query_embedding,
+        top_k=top_k,
+        workspace_id=workspace_id,
+        embedding_model=embedding_model
+    )
+    return embedding_model, query_embedding, [chunk for chunk, score in similar_chunks if score >= min_score]
+
+
+def _answer_query(workspace_id, query_text, top_k, include_citations, min_score):
+    """Answer a non-streaming query; returns (response data, status code)."""
+    try:
+        embedding_model, query_embedding, chunks = _retrieve(workspace_id, query_text, top_k, min_score)
         
+        # Nothing similar enough: answer without calling the LLM
         if not chunks:
-            return Response(
-                {'error': 'No relevant documents found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            return {'error': 'No relevant documents found'}, status.HTTP_404_NOT_FOUND
         
         # Generate answer
         llm_service = LLMService()
-        answer, citations = llm_service.generate_answer(query_text, chunks)
-        
-        # Format citations
-        formatted_citations = []
-        if include_citations:
-            for citation in citations:
-                formatted_citations.append({
-                    'document_id': citation['document_id'],
-                    'document_title': citation['document_title'],
-                    'chunk_id': citation['chunk_id'],
-                    'page_number': citation['page_number'],
-                    'snippet': citation['snippet'],
-                    'score': citation.get('score')
-                })
+        answer, citations = llm_service.generate_answer(
+            query_text, chunks, cache_scope=AnswerCache.scope(workspace_id, embedding_model, query_embedding),
+            query_embedding=query_embedding
+        )
         
-        return Response({
+        return {
             'answer': answer,
-            'citations': formatted_citations,
+            'citations': _format_citations(citations) if include_citations else [],
             'retrieved_chunks': [chunk.id for chunk in chunks]
-        }, status=status.HTTP_200_OK)
+        }, status.HTTP_200_OK
     
     except Exception as e:
-        return Response(
-            {'error': str(e)},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return {'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
 @api_view(['POST'])
@@ -266,6 +490,8 @@ def summarize(request):
     workspace_id = serializer.validated_data['workspace_id']
     document_ids = serializer.validated_data['document_ids']
     summary_type = serializer.validated_data.get('summary_type', 'short')
+    background = serializer.validated_data.get('background', False)
+    webhook_url = serializer.validated_data.get('webhook_url', '')
     
     # Verify workspace access
     try:
@@ -289,34 +515,78 @@ def summarize(request):
             status=status.HTTP_404_NOT_FOUND
         )
     
-    try:
-        # Get all chunks from documents
-        from core.models import Chunk
-        chunks = Chunk.objects.filter(document__in=documents).order_by('document', 'chunk_index')
-        
-        if not chunks.exists():
+    if background:
+        if webhook_url and not SummaryJobs.webhook_allowed(webhook_url):
             return Response(
-                {'error': 'No chunks found in documents'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'webhook_url host is not allowed'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Generate summary
-        llm_service = LLMService()
-        summary, related_work, citations = llm_service.generate_summary(
-            list(chunks),
-            summary_type=summary_type
-        )
-        
+        job = SummaryJobs.submit(request.user, workspace, list(documents), summary_type, webhook_url)
         return Response({
-            'summary': summary,
-            'related_work': related_work if summary_type == 'related_work' else None,
-            'citations': citations,
-            'document_ids': list(documents.values_list('id', flat=True))
-        }, status=status.HTTP_200_OK)
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': request.build_absolute_uri(reverse('summary-job', args=[job.id]))
+        }, status=status.HTTP_202_ACCEPTED)
     
+    try:
+        return Response(SummaryJobs.summarize(list(documents), summary_type), status=status.HTTP_200_OK)
+    
+    except LookupError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_404_NOT_FOUND
+        )
     except Exception as e:
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def summary_job(request, job_id):
+    """Status of a background summary, with its result once completed."""
+    try:
+        job = SummaryJob.objects.get(id=job_id, user=request.user)
+    except SummaryJob.DoesNotExist:
+        return Response(
+            {'error': 'Summary job not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(SummaryJobs.payload(job), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ingestion_queues(request):
+    """Ingestion queue depth and wait times per workspace/user (staff only)."""
+    return Response(IngestionScheduler.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def answer_cache_stats(request):
+    """Answer cache hit rates per tier and estimated tokens saved (staff only)."""
+    return Response(AnswerCache.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
+def embedding_migrations(request):
+    """
+    Re-embedding migrations (staff only).
+    
+    GET lists recent migrations with progress and ETA; POST with
+    ``embedding_model_id`` activates that model and starts migrating onto it.
+    """
+    if request.method == 'POST':
+        try:
+            embedding_model = EmbeddingModel.objects.get(id=request.data.get('embedding_model_id'))
+        except (EmbeddingModel.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Embedding model not found'}, status=status.HTTP_404_NOT_FOUND)
+        migration = EmbeddingMigrator.start(embedding_model)
+        return Response(EmbeddingMigrator.progress(migration), status=status.HTTP_202_ACCEPTED)
+    
+    migrations = EmbeddingMigration.objects.select_related('embedding_model', 'previous_model')[:20]
+    return Response([EmbeddingMigrator.progress(m) for m in migrations], status=status.HTTP_200_OK)
@@ -0,0 +1,77 @@
+"""
+Process warm-up for preforking servers (gunicorn ``preload_app``).
+"""
+import gc
+import time
+from typing import Dict
+
+from django.conf import settings
+from django.db import connections
+from core.models import Workspace, EmbeddingModel
+from .utils import EmbeddingService
+from .vector_index import VectorIndexStore, FAISS_AVAILABLE
+
+
+class ProcessWarmup:
+    """
+    Load embedding models and vector indexes once, before workers are forked.
+
+    With ``PRELOAD_MODELS`` on, ``paperbot.wsgi`` calls ``preload`` in the
+    gunicorn master. Every forked worker, including those that replace a
+    worker recycled by ``max_requests``, starts with the models and indexes
+    already in memory, shared copy-on-write with the master. Readers still
+    replay the index log tail on their first search, so a worker forked from
+    an old snapshot still sees every committed write.
+
+    Only weights and indexes are loaded. No forward pass runs in the master,
+    because a thread pool started before ``fork`` is not safe to use in the
+    child. Database connections are closed so workers don't share sockets.
+    The surviving objects are then moved to the permanent GC generation, so
+    collections in the workers don't write to (and so copy) shared pages.
+    """
+
+    @classmethod
+    def preload(cls) -> Dict:
+        """Warm everything up; failures are reported and fall back to lazy loading."""
+        started = time.monotonic()
+        stats = {'models': 0, 'indexes': 0, 'errors': []}
+
+        serving_models = cls._serving_models()
+        if not settings.EMBEDDING_SERVER_SOCKET:
+            # With a shared embedding server, models live in that process instead
+            for embedding_model in {m.id: m for m in serving_models.values()}.values():
+                try:
+                    EmbeddingService.get_model(embedding_model)
+                    stats['models'] += 1
+                except Exception as e:
+                    stats['errors'].append(f"embedding model {embedding_model}: {e}")
+
+        if FAISS_AVAILABLE:
+            for workspace_id, embedding_model in Workspace.objects.values_list('id', 'embedding_model_id'):
+                embedding_model = serving_models.get(embedding_model or 'active')
+                if embedding_model is None:
+                    continue
+                try:
+                    VectorIndexStore.get_index(embedding_model, workspace_id)
+                    stats['indexes'] += 1
+                except Exception as e:
+                    stats['errors'].append(f"index {embedding_model.id}/{workspace_id}: {e}")
+
+        connections.close_all()
+        gc.collect()
+        gc.freeze()
+        stats['seconds'] = round(time.monotonic() - started, 2)
+        return stats
+
+    @staticmethod
+    def _serving_models() -> Dict:
+        """Every model some workspace is served from, keyed by id; 'active' for unpinned workspaces."""
+        models = {
+            embedding_model.id: embedding_model
+            for embedding_model in EmbeddingModel.objects.filter(serving_workspaces__isnull=False).distinct()
+        }
+        active = EmbeddingService.get_active_embedding_model()
+        if active is not None:
+            models.setdefault(active.id, active)
+            models['active'] = active
+        return models
@@ -4,9 +4,9 @@ Admin configuration for core models.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
-    User, Workspace, Document, Chunk, EmbeddingModel,
-    ChunkEmbedding, GenerationModel, ChatSession, ChatMessage,
-    PipelineRun, AuditLog
+    User, Workspace, Document, Section, Chunk, EmbeddingModel,
+    ChunkEmbedding, EmbeddingMigration, VectorIndexLog, GenerationModel, DocumentSummary, SummaryJob,
+    ChatSession, ChatMessage, PipelineRun, IngestionJob, AuditLog
 )
 
 
@@ -18,7 +18,7 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Workspace)
 class WorkspaceAdmin(admin.ModelAdmin):
-    list_display = ['name', 'owner', 'is_active', 'created_at']
+    list_display = ['name', 'owner', 'embedding_model', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'owner__username']
 
@@ -31,25 +31,65 @@ class DocumentAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at', 'processed_at']
 
 
+@admin.register(Section)
+class SectionAdmin(admin.ModelAdmin):
+    list_display = ['document', 'section_index', 'title', 'token_count']
+    list_filter = ['document__workspace']
+    search_fields = ['title', 'document__title']
+
+
 @admin.register(Chunk)
 class ChunkAdmin(admin.ModelAdmin):
-    list_display = ['document', 'chunk_index', 'page_number', 'token_count']
+    list_display = ['document', 'section', 'chunk_index', 'page_number', 'token_count']
     list_filter = ['document__workspace']
     search_fields = ['text', 'document__title']
 
 
 @admin.register(EmbeddingModel)
 class EmbeddingModelAdmin(admin.ModelAdmin):
-    list_display = ['name', 'version', 'dimension', 'is_active', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['name', 'version', 'dimension', 'backend', 'is_active', 'created_at']
+    list_filter = ['is_active', 'backend', 'created_at']
+    actions = ['activate_and_migrate']
+
+    @admin.action(description='Activate and re-embed all workspaces')
+    def activate_and_migrate(self, request, queryset):
+        from api.reembedding import EmbeddingMigrator
+        if queryset.count() != 1:
+            self.message_user(request, 'Select exactly one embedding model.', level='error')
+            return
+        migration = EmbeddingMigrator.start(queryset.get())
+        self.message_user(request, f'Started re-embedding of {migration.total_chunks} chunks.')
+
+
+@admin.register(EmbeddingMigration)
+class EmbeddingMigrationAdmin(admin.ModelAdmin):
+    list_display = ['embedding_model', 'status', 'embedded_chunks', 'total_chunks',
+                    'switched_workspaces', 'total_workspaces', 'started_at']
+    list_filter = ['status']
+    readonly_fields = ['started_at', 'updated_at', 'completed_at']
 
 
 @admin.register(GenerationModel)
 class GenerationModelAdmin(admin.ModelAdmin):
-    list_display = ['name', 'version', 'provider', 'model_id', 'is_active']
+    list_display = ['name', 'version', 'provider', 'model_id', 'context_token_budget', 'is_active']
     list_filter = ['provider', 'is_active', 'created_at']
 
 
+@admin.register(DocumentSummary)
+class DocumentSummaryAdmin(admin.ModelAdmin):
+    list_display = ['document', 'generation_model', 'embedding_model', 'updated_at']
+    list_filter = ['generation_model']
+    search_fields = ['document__title', 'summary']
+    raw_id_fields = ['document']
+
+
+@admin.register(SummaryJob)
+class SummaryJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'workspace', 'user', 'summary_type', 'status', 'created_at', 'completed_at']
+    list_filter = ['status', 'summary_type', 'created_at']
+    readonly_fields = ['created_at', 'started_at', 'completed_at', 'webhook_delivered_at']
+
+
 @admin.register(ChatSession)
 class ChatSessionAdmin(admin.ModelAdmin):
     list_display = ['id', 'workspace', 'user', 'title', 'updated_at']
@@ -66,11 +106,25 @@ class ChatMessageAdmin(admin.ModelAdmin):
 
 @admin.register(PipelineRun)
 class PipelineRunAdmin(admin.ModelAdmin):
-    list_display = ['document', 'status', 'stage', 'started_at', 'completed_at']
+    list_display = ['document', 'status', 'stage', 'checkpoint', 'attempts', 'started_at', 'completed_at']
     list_filter = ['status', 'stage', 'started_at']
     readonly_fields = ['started_at', 'completed_at']
 
 
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['document', 'workspace', 'user', 'priority', 'status', 'enqueued_at', 'dispatched_at']
+    list_filter = ['status', 'priority', 'workspace']
+    readonly_fields = ['enqueued_at', 'dispatched_at', 'completed_at']
+
+
+@admin.register(VectorIndexLog)
+class VectorIndexLogAdmin(admin.ModelAdmin):
+    list_display = ['id', 'embedding_model', 'workspace', 'op', 'created_at']
+    list_filter = ['op', 'embedding_model']
+    readonly_fields = ['created_at']
+
+
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
     list_display = ['user', 'action', 'resource_type', 'created_at']
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Section',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section_index', models.IntegerField()),
+                ('title', models.CharField(blank=True, max_length=500)),
+                ('text', models.TextField()),
+                ('start_char', models.IntegerField(blank=True, null=True)),
+                ('end_char', models.IntegerField(blank=True, null=True)),
+                ('token_count', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='core.document')),
+            ],
+            options={
+                'db_table': 'sections',
+                'ordering': ['document', 'section_index'],
+                'unique_together': {('document', 'section_index')},
+            },
+        ),
+        migrations.AddField(
+            model_name='chunk',
+            name='section',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='core.section'),
+        ),
+    ]
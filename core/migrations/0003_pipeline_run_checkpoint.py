@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_section_hierarchy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinerun',
+            name='attempts',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='pipelinerun',
+            name='checkpoint',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
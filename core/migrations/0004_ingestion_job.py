@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_pipeline_run_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.IntegerField(choices=[(0, 'Interactive'), (1, 'Small document'), (2, 'Bulk')], default=2)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('dispatched', 'Dispatched'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='core.document')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingestion_jobs', to=settings.AUTH_USER_MODEL)),
+                ('workspace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='core.workspace')),
+            ],
+            options={
+                'db_table': 'ingestion_jobs',
+                'ordering': ['enqueued_at'],
+                'indexes': [models.Index(fields=['status', 'enqueued_at'], name='ingestion_j_status_1036a4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+
+def log_existing_embeddings(apps, schema_editor):
+    """Seed the log so existing embeddings end up in the new per-workspace indexes."""
+    ChunkEmbedding = apps.get_model('core', 'ChunkEmbedding')
+    VectorIndexLog = apps.get_model('core', 'VectorIndexLog')
+
+    chunk_ids = defaultdict(list)
+    rows = ChunkEmbedding.objects.values_list('embedding_model_id', 'chunk__document__workspace_id', 'chunk_id')
+    for embedding_model_id, workspace_id, chunk_id in rows.order_by('chunk_id').iterator():
+        chunk_ids[(embedding_model_id, workspace_id)].append(chunk_id)
+
+    VectorIndexLog.objects.bulk_create([
+        VectorIndexLog(embedding_model_id=embedding_model_id, workspace_id=workspace_id, op='add', chunk_ids=ids)
+        for (embedding_model_id, workspace_id), ids in chunk_ids.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_ingestion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorIndexLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('op', models.CharField(choices=[('add', 'Add'), ('delete', 'Delete')], max_length=10)),
+                ('chunk_ids', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('embedding_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_log', to='core.embeddingmodel')),
+                ('workspace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_log', to='core.workspace')),
+            ],
+            options={
+                'db_table': 'vector_index_log',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['embedding_model', 'workspace', 'id'], name='vector_inde_embeddi_01fbb7_idx')],
+            },
+        ),
+        migrations.RunPython(log_existing_embeddings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_vector_index_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workspace',
+            name='embedding_model',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='serving_workspaces', to='core.embeddingmodel'),
+        ),
+        migrations.AlterField(
+            model_name='chunkembedding',
+            name='chunk',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='core.chunk'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='chunkembedding',
+            unique_together={('chunk', 'embedding_model')},
+        ),
+        migrations.CreateModel(
+            name='EmbeddingMigration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='running', max_length=20)),
+                ('total_chunks', models.IntegerField(default=0)),
+                ('embedded_chunks', models.IntegerField(default=0)),
+                ('total_workspaces', models.IntegerField(default=0)),
+                ('switched_workspaces', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('embedding_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='migrations', to='core.embeddingmodel')),
+                ('previous_model', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.embeddingmodel')),
+            ],
+            options={
+                'db_table': 'embedding_migrations',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_embedding_migration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embeddingmodel',
+            name='backend',
+            field=models.CharField(choices=[('torch', 'PyTorch (sentence-transformers)'), ('onnx', 'ONNX Runtime (int8)')], default='torch', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='embeddingmodel',
+            name='onnx_path',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 23:40
+
+from django.db import migrations
+import numpy as np
+
+
+def normalize_embeddings(apps, schema_editor):
+    """L2-normalize stored vectors so inner-product search ranks by cosine similarity."""
+    ChunkEmbedding = apps.get_model('core', 'ChunkEmbedding')
+
+    rows = ChunkEmbedding.objects.order_by('id').only('id', 'vector')
+    batch = []
+    for embedding in rows.iterator(chunk_size=1000):
+        batch.append(embedding)
+        if len(batch) == 1000:
+            _normalize_batch(ChunkEmbedding, batch)
+            batch = []
+    if batch:
+        _normalize_batch(ChunkEmbedding, batch)
+
+
+def _normalize_batch(ChunkEmbedding, batch):
+    # One matrix per model dimension
+    by_dimension = {}
+    for embedding in batch:
+        by_dimension.setdefault(len(embedding.vector), []).append(embedding)
+    for embeddings in by_dimension.values():
+        vectors = np.array([embedding.vector for embedding in embeddings], dtype='float32')
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, np.finfo('float32').tiny)
+        for embedding, vector in zip(embeddings, vectors.tolist()):
+            embedding.vector = vector
+    ChunkEmbedding.objects.bulk_update(batch, ['vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_embedding_model_backend'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_embeddings, migrations.RunPython.noop),
+    ]
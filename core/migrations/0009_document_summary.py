@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_normalize_embeddings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField()),
+                ('methodology', models.TextField(blank=True)),
+                ('chunk_digest', models.CharField(max_length=64)),
+                ('vector', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='core.document')),
+                ('embedding_model', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='document_summaries', to='core.embeddingmodel')),
+                ('generation_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_summaries', to='core.generationmodel')),
+            ],
+            options={
+                'db_table': 'document_summaries',
+                'unique_together': {('document', 'generation_model')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_summary_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationmodel',
+            name='context_token_budget',
+            field=models.IntegerField(default=3000),
+        ),
+    ]
@@ -24,6 +24,11 @@ class Workspace(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Model queries are served from; switched once a re-embedding migration covers the workspace.
+    # Null means the active embedding model.
+    embedding_model = models.ForeignKey(
+        'EmbeddingModel', on_delete=models.SET_NULL, null=True, blank=True, related_name='serving_workspaces'
+    )
 
     class Meta:
         db_table = 'workspaces'
@@ -69,9 +74,30 @@ class Document(models.Model):
         return f"{self.title} ({self.workspace.name})"
 
 
+class Section(models.Model):
+    """Section-level parent grouping the leaf chunks under one heading."""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='sections')
+    section_index = models.IntegerField()  # Order within document
+    title = models.CharField(max_length=500, blank=True)
+    text = models.TextField()
+    start_char = models.IntegerField(null=True, blank=True)
+    end_char = models.IntegerField(null=True, blank=True)
+    token_count = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'sections'
+        ordering = ['document', 'section_index']
+        unique_together = ['document', 'section_index']
+
+    def __str__(self):
+        return f"Section {self.section_index} ({self.title or 'untitled'}) of {self.document.title}"
+
+
 class Chunk(models.Model):
-    """Text chunk from a document."""
+    """Text chunk from a document (leaf of the section hierarchy)."""
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, null=True, blank=True, related_name='chunks')
     chunk_index = models.IntegerField()  # Order within document
     text = models.TextField()
     page_number = models.IntegerField(null=True, blank=True)
@@ -91,12 +117,19 @@ class Chunk(models.Model):
 
 class EmbeddingModel(models.Model):
     """Versioned embedding model metadata."""
+    BACKEND_CHOICES = [
+        ('torch', 'PyTorch (sentence-transformers)'),
+        ('onnx', 'ONNX Runtime (int8)'),
+    ]
+
     name = models.CharField(max_length=255)
     version = models.CharField(max_length=50)
     model_path = models.CharField(max_length=1000)
     dimension = models.IntegerField()
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=False)
+    backend = models.CharField(max_length=20, choices=BACKEND_CHOICES, default='torch')
+    onnx_path = models.CharField(max_length=1000, blank=True)  # Directory written by export_onnx_model
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -110,24 +143,82 @@ class EmbeddingModel(models.Model):
 
 class ChunkEmbedding(models.Model):
     """Embedding vector for a chunk."""
-    chunk = models.OneToOneField(Chunk, on_delete=models.CASCADE, related_name='embedding')
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='embeddings')
     embedding_model = models.ForeignKey(EmbeddingModel, on_delete=models.PROTECT, related_name='embeddings')
     vector = models.JSONField()  # Store as JSON array
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'chunk_embeddings'
+        unique_together = ['chunk', 'embedding_model']
 
     def __str__(self):
         return f"Embedding for {self.chunk}"
 
 
+class EmbeddingMigration(models.Model):
+    """Background re-embedding of every chunk under a newly activated embedding model."""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    embedding_model = models.ForeignKey(EmbeddingModel, on_delete=models.CASCADE, related_name='migrations')
+    previous_model = models.ForeignKey(
+        EmbeddingModel, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    total_chunks = models.IntegerField(default=0)
+    embedded_chunks = models.IntegerField(default=0)
+    total_workspaces = models.IntegerField(default=0)
+    switched_workspaces = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'embedding_migrations'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Migration to {self.embedding_model} - {self.status}"
+
+
+class VectorIndexLog(models.Model):
+    """Write-ahead log of vector index changes; the id is the log sequence number."""
+    OP_CHOICES = [
+        ('add', 'Add'),
+        ('delete', 'Delete'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    embedding_model = models.ForeignKey(EmbeddingModel, on_delete=models.CASCADE, related_name='index_log')
+    workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='index_log')
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    chunk_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'vector_index_log'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['embedding_model', 'workspace', 'id']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {len(self.chunk_ids)} chunks ({self.workspace_id})"
+
+
 class GenerationModel(models.Model):
     """Versioned LLM generation model metadata."""
     name = models.CharField(max_length=255)
     version = models.CharField(max_length=50)
     provider = models.CharField(max_length=50)  # openai, anthropic, local
     model_id = models.CharField(max_length=255)  # e.g., gpt-4, claude-3-opus
+    context_token_budget = models.IntegerField(default=3000)  # Max tokens of retrieved context per Q/A prompt
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -141,6 +232,59 @@ class GenerationModel(models.Model):
         return f"{self.name} v{self.version} ({self.provider})"
 
 
+class DocumentSummary(models.Model):
+    """Summary and methodology digest of a document, generated at ingest by one generation model."""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='summaries')
+    generation_model = models.ForeignKey(GenerationModel, on_delete=models.CASCADE, related_name='document_summaries')
+    summary = models.TextField()
+    methodology = models.TextField(blank=True)
+    chunk_digest = models.CharField(max_length=64)  # Hash of the chunk ids summarized; stale once re-chunked
+    embedding_model = models.ForeignKey(
+        EmbeddingModel, on_delete=models.SET_NULL, null=True, blank=True, related_name='document_summaries'
+    )
+    vector = models.JSONField(default=list, blank=True)  # Embedding of the summary
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'document_summaries'
+        unique_together = ['document', 'generation_model']
+
+    def __str__(self):
+        return f"Summary of {self.document.title} by {self.generation_model}"
+
+
+class SummaryJob(models.Model):
+    """Multi-document summary generated in the background, polled or delivered to a webhook."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='summary_jobs')
+    workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='summary_jobs')
+    document_ids = models.JSONField(default=list)
+    summary_type = models.CharField(max_length=20, default='short')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True)  # Same body as a synchronous /api/summarize/ response
+    error_message = models.TextField(blank=True)
+    webhook_url = models.URLField(max_length=1000, blank=True)
+    webhook_delivered_at = models.DateTimeField(null=True, blank=True)
+    webhook_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'summary_jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Summary job {self.id} ({self.status})"
+
+
 class ChatSession(models.Model):
     """Chat session for iterative Q/A."""
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='chat_sessions')
@@ -189,13 +333,17 @@ class PipelineRun(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+    STAGES = ['extract', 'chunk', 'embed', 'index']
 
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pipeline_runs')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     stage = models.CharField(max_length=50, blank=True)  # extract, chunk, embed, index
+    checkpoint = models.CharField(max_length=50, blank=True)  # Last stage whose output is persisted
+    attempts = models.IntegerField(default=1)
     error_message = models.TextField(blank=True)
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last progress report from the worker
     metadata = models.JSONField(default=dict, blank=True)
 
     class Meta:
@@ -205,6 +353,66 @@ class PipelineRun(models.Model):
     def __str__(self):
         return f"Run {self.id} - {self.document.title} ({self.status})"
 
+    @property
+    def resume_stage(self) -> str:
+        """First stage that still has to run."""
+        if not self.checkpoint:
+            return self.STAGES[0]
+        position = self.STAGES.index(self.checkpoint) + 1
+        return self.STAGES[position] if position < len(self.STAGES) else ''
+
+    def advance_to(self, stage: str):
+        """Start ``stage``, checkpointing every stage before it as completed."""
+        position = self.STAGES.index(stage)
+        if position > 0:
+            self.checkpoint = self.STAGES[position - 1]
+        self.stage = stage
+        self.heartbeat_at = timezone.now()
+        self.save(update_fields=['stage', 'checkpoint', 'heartbeat_at'])
+
+    def beat(self):
+        """Record that the worker is still making progress on this run."""
+        self.heartbeat_at = timezone.now()
+        PipelineRun.objects.filter(id=self.id).update(heartbeat_at=self.heartbeat_at)
+
+
+class IngestionJob(models.Model):
+    """Document waiting for (or undergoing) ingestion, dispatched by the fair scheduler."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('dispatched', 'Dispatched'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_SMALL = 1
+    PRIORITY_BULK = 2
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, 'Interactive'),
+        (PRIORITY_SMALL, 'Small document'),
+        (PRIORITY_BULK, 'Bulk'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='ingestion_jobs')
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_BULK)
+    size_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ingestion_jobs'
+        ordering = ['enqueued_at']
+        indexes = [
+            models.Index(fields=['status', 'enqueued_at']),
+        ]
+
+    def __str__(self):
+        return f"Ingestion of {self.document.title} ({self.status})"
+
 
 class AuditLog(models.Model):
     """Audit log for all user actions."""
@@ -76,7 +76,7 @@ class ChunkSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Chunk
-        fields = ['id', 'document', 'document_title', 'chunk_index',
+        fields = ['id', 'document', 'document_title', 'section', 'chunk_index',
                   'text', 'page_number', 'start_char', 'end_char',
                   'token_count', 'created_at']
         read_only_fields = ['id', 'created_at']
@@ -86,14 +86,14 @@ class EmbeddingModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmbeddingModel
         fields = ['id', 'name', 'version', 'dimension', 'description',
-                  'is_active', 'created_at']
+                  'is_active', 'backend', 'created_at']
         read_only_fields = ['id', 'created_at']
 
 
 class GenerationModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = GenerationModel
-        fields = ['id', 'name', 'version', 'provider', 'model_id',
+        fields = ['id', 'name', 'version', 'provider', 'model_id', 'context_token_budget',
                   'description', 'is_active', 'created_at']
         read_only_fields = ['id', 'created_at']
 
@@ -9,12 +9,18 @@ import os
 bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
 backlog = 2048
 
+# Preload mode: paperbot.wsgi loads the embedding models and vector indexes in the
+# master, and forked workers share them copy-on-write (PRELOAD_MODELS=True)
+preload_app = os.environ.get('PRELOAD_MODELS', 'False') == 'True'
+
 # Worker processes
-# Use only 1 worker to reduce memory usage on Render free tier
-workers = 1
+# Use only 1 worker to reduce memory usage on Render free tier; with preload,
+# extra workers cost little more than the first
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
 worker_class = "sync"
 worker_connections = 1000
-timeout = 180  # Increased timeout for model loading (3 minutes)
+# LLM answers, /summarize calls and SSE streams run well past 30s, preload or not
+timeout = 180
 keepalive = 5
 max_requests = 1000  # Restart worker after N requests to prevent memory leaks
 max_requests_jitter = 50
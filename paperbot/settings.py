@@ -2,6 +2,7 @@
 Django settings for PaperBot project.
 """
 import os
+import json
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -119,6 +120,17 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Logging: application messages (api.*, paperbot.*) go to stderr next to gunicorn's
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO')},
+        'paperbot': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO')},
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -167,6 +179,41 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Staged ingestion: each stage gets its own queue so CPU-heavy extraction and
+# memory-heavy embedding can run on separately sized worker pools
+CELERY_TASK_ROUTES = {
+    'api.tasks.extract_document': {'queue': 'extract'},
+    'api.tasks.chunk_document': {'queue': 'chunk'},
+    'api.tasks.embed_document': {'queue': 'embed'},
+    'api.tasks.embed_chunks': {'queue': 'embed'},
+    'api.tasks.migrate_embeddings': {'queue': 'embed'},
+    'api.tasks.index_document': {'queue': 'index'},
+    'api.tasks.checkpoint_vector_index': {'queue': 'index'},
+    'api.tasks.reindex_workspace': {'queue': 'index'},
+}
+# Honour per-message priorities on Redis (0 = highest)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority',
+}
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-ingestion': {
+        'task': 'api.tasks.dispatch_ingestion',
+        'schedule': 30.0,
+    },
+    'checkpoint-vector-indexes': {
+        'task': 'api.tasks.checkpoint_vector_indexes',
+        'schedule': float(os.getenv('VECTOR_INDEX_CHECKPOINT_SECONDS', '60')),
+    },
+}
+
+# Cache: shared across processes through Redis when REDIS_URL is set
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 # AWS S3 Configuration
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID', '')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY', '')
@@ -185,12 +232,98 @@ else:
 # Vector DB Configuration
 VECTOR_DB_TYPE = os.getenv('VECTOR_DB_TYPE', 'faiss')
 VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', str(BASE_DIR / 'vector_db'))
+VECTOR_INDEX_APPLY_BATCH = int(os.getenv('VECTOR_INDEX_APPLY_BATCH', '500'))  # Log entries per read
+VECTOR_INDEX_REBUILD_BATCH = int(os.getenv('VECTOR_INDEX_REBUILD_BATCH', '2000'))  # Embeddings streamed per query during reindex
+VECTOR_INDEX_CHECKPOINT_ENTRIES = int(os.getenv('VECTOR_INDEX_CHECKPOINT_ENTRIES', '50'))  # Pending entries that trigger a checkpoint
 
 # Embedding Model
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
 
+# Chunking: small leaf chunks are embedded and searched, section-level parents go to the LLM
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '500'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '100'))
+SECTION_MAX_CHARS = int(os.getenv('SECTION_MAX_CHARS', '4000'))
+
+# Streaming ingestion pipeline: bounded queues between extraction, chunking and embedding
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+INGESTION_PAGE_QUEUE_SIZE = int(os.getenv('INGESTION_PAGE_QUEUE_SIZE', '8'))
+INGESTION_EMBED_QUEUE_SIZE = int(os.getenv('INGESTION_EMBED_QUEUE_SIZE', '4'))
+
+# Background re-embedding of the corpus when the active embedding model changes
+EMBEDDING_MIGRATION_BATCH_SIZE = int(os.getenv('EMBEDDING_MIGRATION_BATCH_SIZE', '256'))  # Chunks re-embedded per task
+EMBEDDING_MIGRATION_THROTTLE_SECONDS = float(os.getenv('EMBEDDING_MIGRATION_THROTTLE_SECONDS', '1.0'))  # Pause between batches
+
+# Embedding model pool: loaded models shared per process, keyed by EmbeddingModel
+EMBEDDING_MODEL_POOL_MAX_MB = float(os.getenv('EMBEDDING_MODEL_POOL_MAX_MB', '2048'))  # Least recently used models evicted above this
+
+# ONNX Runtime backend for EmbeddingModel.backend = 'onnx'
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))  # 0 = ONNX Runtime default
+
+# Shared embedding server (python manage.py run_embedding_server); empty = encode in-process
+EMBEDDING_SERVER_SOCKET = os.getenv('EMBEDDING_SERVER_SOCKET', '')
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv('EMBEDDING_SERVER_MAX_BATCH', '64'))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.getenv('EMBEDDING_SERVER_MAX_WAIT_MS', '5'))
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv('EMBEDDING_SERVER_TIMEOUT', '60'))
+EMBEDDING_SERVER_FALLBACK = os.getenv('EMBEDDING_SERVER_FALLBACK', 'True') == 'True'  # Encode locally if the server is down
+
+# Preloading in the gunicorn master, shared copy-on-write with forked workers
+PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', 'False') == 'True'  # Warm models/indexes in paperbot.wsgi (gunicorn preload_app)
+
+# Bulk upload limits
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '500'))
+BULK_UPLOAD_MAX_FILE_SIZE = int(os.getenv('BULK_UPLOAD_MAX_FILE_SIZE', str(100 * 1024 * 1024)))
+
+# Fair ingestion scheduling across users and workspaces
+INGESTION_MAX_IN_FLIGHT = int(os.getenv('INGESTION_MAX_IN_FLIGHT', '4'))
+INGESTION_SMALL_DOCUMENT_BYTES = int(os.getenv('INGESTION_SMALL_DOCUMENT_BYTES', str(2 * 1024 * 1024)))
+INGESTION_AGING_MINUTES = float(os.getenv('INGESTION_AGING_MINUTES', '30'))
+INGESTION_JOB_TIMEOUT_SECONDS = int(os.getenv('INGESTION_JOB_TIMEOUT_SECONDS', str(3 * 60 * 60)))  # Requeue a dispatched job with no progress for this long
+INGESTION_WORKSPACE_WEIGHTS = json.loads(os.getenv('INGESTION_WORKSPACE_WEIGHTS', '{}'))  # {"<workspace id>": weight}
+INGESTION_CELERY_PRIORITIES = {0: 0, 1: 3, 2: 6}  # Interactive, small, bulk
+
+# 'pipeline' runs all stages in one worker; 'chain' splits them into per-queue Celery tasks
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'pipeline')
+EMBEDDING_TASK_BATCH_SIZE = int(os.getenv('EMBEDDING_TASK_BATCH_SIZE', '256'))
+INGESTION_SUMMARIES = os.getenv('INGESTION_SUMMARIES', 'False') == 'True'  # Summarize each document once indexed
+
 # LLM Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
 LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai')  # openai or anthropic
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')  # e.g. the mock server from benchmark_llm_clients --serve
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL', '')
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))  # Per call
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))  # Calls in flight per provider and process
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', '30'))  # Wait for a free slot before failing
+LLM_POOL_CONNECTIONS = int(os.getenv('LLM_POOL_CONNECTIONS', '16'))  # Keep-alive connections per client
+QUERY_MIN_SCORE = float(os.getenv('QUERY_MIN_SCORE', '0.2'))  # Cosine similarity below which chunks don't reach the LLM
+FALLBACK_ANSWER_SENTENCES = int(os.getenv('FALLBACK_ANSWER_SENTENCES', '3'))  # Quoted in extractive answers without an LLM
+
+# Answer cache: exact prompt matches, plus similar questions over the same retrieved chunks
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '86400'))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv('ANSWER_CACHE_SEMANTIC_THRESHOLD', '0.95'))  # 0 disables the semantic tier
+ANSWER_CACHE_SEMANTIC_ENTRIES = int(os.getenv('ANSWER_CACHE_SEMANTIC_ENTRIES', '50'))  # Questions kept per chunk set
+
+# Single-flight: identical /api/query/ requests in flight share one answer.
+# On by default only with a shared cache (REDIS_URL); LocMemCache would coalesce within one process
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', str(bool(REDIS_URL))) == 'True'
+SINGLE_FLIGHT_LOCK_SECONDS = int(os.getenv('SINGLE_FLIGHT_LOCK_SECONDS', '120'))  # Frees a dead leader's lock; must exceed the slowest answer
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '90'))  # Then a waiter answers itself
+SINGLE_FLIGHT_POLL_MS = int(os.getenv('SINGLE_FLIGHT_POLL_MS', '50'))
+SINGLE_FLIGHT_RESULT_TTL_SECONDS = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL_SECONDS', '30'))  # Time for waiters to collect it
+
+# Summarization: map-reduce once the selected chunks exceed one prompt's budget
+SUMMARY_CONTEXT_TOKENS = int(os.getenv('SUMMARY_CONTEXT_TOKENS', '6000'))  # Chunk tokens per LLM prompt
+SUMMARY_MAP_CONCURRENCY = int(os.getenv('SUMMARY_MAP_CONCURRENCY', '4'))  # Parallel map calls per request
+SUMMARY_PARTIAL_WORDS = int(os.getenv('SUMMARY_PARTIAL_WORDS', '200'))  # Length asked of each partial summary
+SUMMARY_PARTIAL_CACHE_TTL_SECONDS = int(os.getenv('SUMMARY_PARTIAL_CACHE_TTL_SECONDS', '604800'))
+SUMMARY_EXTRACTIVE_PASSAGES = int(os.getenv('SUMMARY_EXTRACTIVE_PASSAGES', '3'))  # Passages quoted per document without an LLM
+SUMMARY_EXTRACTIVE_DIVERSITY = float(os.getenv('SUMMARY_EXTRACTIVE_DIVERSITY', '0.3'))  # Penalty on similarity to passages already picked
+TEXTRANK_DAMPING = float(os.getenv('TEXTRANK_DAMPING', '0.85'))
+TEXTRANK_MAX_NODES = int(os.getenv('TEXTRANK_MAX_NODES', '2000'))  # Larger selections rank each document separately
+SUMMARY_WEBHOOK_SECRET = os.getenv('SUMMARY_WEBHOOK_SECRET', '')  # Signs webhook bodies (X-Paperbot-Signature)
+SUMMARY_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('SUMMARY_WEBHOOK_TIMEOUT_SECONDS', '10'))
+SUMMARY_WEBHOOK_ALLOWED_HOSTS = [host for host in os.getenv('SUMMARY_WEBHOOK_ALLOWED_HOSTS', '').split(',') if host]  # Empty: any public host
 
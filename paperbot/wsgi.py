@@ -2,14 +2,22 @@
 WSGI config for PaperBot project.
 """
 import os
+import logging
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'paperbot.settings')
 
 application = get_wsgi_application()
 
+if settings.PRELOAD_MODELS:
+    # Run once in the gunicorn master (preload_app) so forked workers share the pages
+    from api.warmup import ProcessWarmup
 
-
-
-
+    stats = ProcessWarmup.preload()
+    logging.getLogger(__name__).info(
+        "Preloaded %s embedding model(s) and %s index(es) in %ss%s",
+        stats['models'], stats['indexes'], stats['seconds'],
+        ''.join(f"; failed: {error}" for error in stats['errors'])
+    )